@@ -9,17 +9,21 @@ from django.core import validators
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.db import models
-from django.http import QueryDict
+from django.http import HttpResponse, QueryDict
 from django.shortcuts import get_object_or_404, redirect
 from django.forms.models import BaseInlineFormSet
 from mptt.forms import TreeNodeChoiceField
 from mptt.admin import MPTTModelAdmin
 from django.utils.translation import ugettext, ugettext_lazy as _
 from django.template.defaultfilters import date, time
+from django.utils import simplejson
+from django.utils.timezone import now
 
 from utils.diff import generate_diff
 
-from .models import Rule
+from .models import Rule, GenerationJob
+from .models.event import EventQuerySet
+from .models.summary import refresh_summaries, summaries_deferred
 
 import django
 if django.VERSION[0] == 1 and django.VERSION[1] >= 4:
@@ -42,16 +46,26 @@ class TreeModelChoiceField(forms.ModelChoiceField):
 
 
 # ADMIN ACTIONS
+def _update_status(queryset, status):
+    # QuerySet.update() doesn't send signals, so refresh the events' summaries.
+    EventModel = queryset.model.EventModel()
+    event_ids = set(queryset.values_list('event_id', flat=True))
+    queryset.update(status=status)
+    if EventModel.SummaryModel() is not None:
+        refresh_summaries(EventModel._event_manager.filter(pk__in=event_ids))
+
 def _remove_occurrences(modeladmin, request, queryset):
-    for m in queryset:
-        # if the occurrence was generated, then add it as an exclusion.
-        if m.generated_by is not None:
-            m.event.exclusions.get_or_create(start=m.start)
-        m.delete()
+    with summaries_deferred():
+        for m in queryset:
+            # if the occurrence was generated, then add it as an exclusion.
+            if m.generated_by is not None:
+                m.event.exclusions.get_or_create(start=m.start)
+            m.delete()
 _remove_occurrences.short_description = _("Delete occurrences (and prevent recreation by a repeating occurrence)")
 
 def _wipe_occurrences(modeladmin, request, queryset):
-    queryset.delete()
+    with summaries_deferred():
+        queryset.delete()
 _wipe_occurrences.short_description = _("Delete occurrences (but allow recreation by a repeating occurrence)")
 
 def _convert_to_oneoff(modeladmin, request, queryset):
@@ -63,15 +77,15 @@ def _convert_to_oneoff(modeladmin, request, queryset):
 _convert_to_oneoff.short_description = _("Make occurrences one-off (and prevent recreation by a repeating occurrence)")
 
 def _cancel(modeladmin, request, queryset):
-    queryset.update(status=settings.OCCURRENCE_STATUS_CANCELLED[0])
+    _update_status(queryset, settings.OCCURRENCE_STATUS_CANCELLED[0])
 _cancel.short_description = _("Make occurrences cancelled")
 
 def _fully_booked(modeladmin, request, queryset):
-    queryset.update(status=settings.OCCURRENCE_STATUS_FULLY_BOOKED[0])
+    _update_status(queryset, settings.OCCURRENCE_STATUS_FULLY_BOOKED[0])
 _fully_booked.short_description = _("Make occurrences fully booked")
 
 def _clear_status(modeladmin, request, queryset):
-    queryset.update(status="")
+    _update_status(queryset, "")
 _clear_status.short_description = _("Clear booked/cancelled status")
 
 class OccurrenceAdminForm(forms.ModelForm):
@@ -240,8 +254,16 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, show_exclusions=False, sho
         prepopulated_fields = {'slug': ('title', )}
         search_fields = ('title',)
 
-#        def queryset(self, request):
-#             return EventModel.objects.annotate(occurrence_count=Count('occurrences'))
+        def queryset(self, request):
+            qs = super(_EventAdmin, self).queryset(request)
+            if not isinstance(qs, EventQuerySet):
+                # (e.g. from mptt's default manager)
+                qs = qs._clone(klass=EventQuerySet)
+            # (so the columns don't take queries per row)
+            qs = qs.annotate_listed_under().annotate_occurrence_counts()
+            if EventModel.SummaryModel() is not None:
+                qs = qs.select_related('summary')
+            return qs
 
         def append_eventtools_inlines(self, inline_instances):
             eventtools_inlines = [
@@ -296,8 +318,18 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, show_exclusions=False, sho
                 )
 
         def occurrence_link(self, event):
-            count = event.occurrences_in_listing().count()
-            direct_count = event.occurrences.count()
+            # (from EventQuerySet.annotate_occurrence_counts(), see queryset(),
+            # or else counted)
+            count = getattr(event, 'listing_occurrence_count', None)
+            if count is None:
+                count = event.occurrences_in_listing().count()
+            direct_count = getattr(event, 'direct_occurrence_count', None)
+            if direct_count is None:
+                direct_count = event.occurrences.count()
+            forthcoming_count = getattr(event, 'forthcoming_occurrence_count', None)
+            if forthcoming_count is None:
+                forthcoming_count = event.occurrences_in_listing() \
+                    .filter(start__gte=now()).count()
 
             url = self.occurrence_edit_url(event)
 
@@ -310,7 +342,8 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, show_exclusions=False, sho
                     url,
                     count,
                 )
-            return r + ' (%s direct)' % direct_count
+            return r + ' (%s direct, %s forthcoming)' % (
+                direct_count, forthcoming_count)
         occurrence_link.short_description = _('Edit Occurrences')
         occurrence_link.allow_tags = True
 
@@ -318,9 +351,21 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, show_exclusions=False, sho
             return patterns(
                 '',
                 url(r'(?P<parent_id>\d+)/create_variation/',
-                    self.admin_site.admin_view(self._create_variation))
+                    self.admin_site.admin_view(self._create_variation)),
+                url(r'(?P<event_id>\d+)/generation_status/',
+                    self.admin_site.admin_view(self._generation_status)),
                 ) + super(_EventAdmin, self).get_urls()
 
+        def _generation_status(self, request, event_id):
+            """
+            Reports whether the event's occurrences are still being generated
+            (see eventtools.generation), as JSON, for the change form to poll.
+            """
+            event = get_object_or_404(EventModel, id=event_id)
+            return HttpResponse(
+                simplejson.dumps(GenerationJob.objects.status_for_event(event)),
+                mimetype='application/json')
+
         def _create_variation(self, request, parent_id):
             """
             We don't want to try to save child yet, as it is potentially incomplete.
@@ -366,6 +411,9 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, show_exclusions=False, sho
                 'object': obj,
                 'occurrence_edit_url': self.occurrence_edit_url(event=obj),
             }
+            if settings.GENERATION_MODE != 'immediate':
+                extra_extra_context['generation_status'] = \
+                    GenerationJob.objects.status_for_event(obj)
             extra_context.update(extra_extra_context)
             return super(_EventAdmin, self).change_view(request, object_id, extra_context=extra_context)
     return _EventAdmin
@@ -420,3 +468,10 @@ def GeneratorInline(GeneratorModel):
     return _GeneratorInline
     
 admin.site.register(Rule)
+
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('generator_model', 'generator_id', 'event_id', 'status', 'created')
+    list_filter = ('status',)
+    readonly_fields = ('generator_model', 'generator_id', 'event_id', 'saved_start', 'saved_duration', 'created')
+
+admin.site.register(GenerationJob, GenerationJobAdmin)
@@ -0,0 +1,85 @@
+"""
+Benchmarks for eventtools. Each module in this package has a run(stdout)
+function. Run them with
+
+    ./manage.py eventtools_benchmark [module ...]
+
+Some benchmarks create (and then delete) large numbers of rows, so run them
+against a scratch database.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+def timed(f, number):
+    """
+    Returns the mean time in seconds of calling f() `number` times.
+    """
+    started = time.time()
+    for i in xrange(number):
+        f()
+    return (time.time() - started) / number
+
+def report(stdout, label, seconds):
+    stdout.write("%-60s %10.1f us\n" % (label, seconds * 1000000))
+
+def concrete_model(abstract):
+    """
+    Returns the first installed model that subclasses the abstract model, or
+    None (e.g. to benchmark against your app's Occurrence model).
+    """
+    from django.db.models import get_models
+    for model in get_models():
+        if issubclass(model, abstract):
+            return model
+    return None
+
+def explain(queryset):
+    """
+    Returns the database's query plan for the queryset, as a list of lines.
+    """
+    from django.db import connections
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    if connection.vendor == 'sqlite':
+        sql = "EXPLAIN QUERY PLAN " + sql
+    else:
+        sql = "EXPLAIN " + sql
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return [" ".join(unicode(c) for c in row) for row in cursor.fetchall()]
+
+# The start of the occurrences that scratch_occurrences creates, which are
+# every 7 minutes from here.
+FIRST = datetime(2000, 1, 1)
+INTERVAL = timedelta(minutes=7)
+
+@contextmanager
+def scratch_occurrences(Occurrence, rows, name, chunk=10000):
+    """
+    Creates a scratch event with `rows` occurrences, one every INTERVAL from
+    FIRST, mostly an hour long, with a month-long one every 1000, and yields
+    the event. They are deleted (with a single DELETE) afterwards.
+    """
+    from django.db import connections, transaction
+
+    event = Occurrence.EventModel()(title="eventtools %s benchmark" % name,
+        slug="eventtools-%s-benchmark" % name)
+    event.save()
+    try:
+        for i in range(0, rows, chunk):
+            with transaction.commit_on_success():
+                Occurrence.objects.bulk_create([
+                    Occurrence(event=event, start=FIRST + INTERVAL * n,
+                        _duration=30 * 24 * 60 if n % 1000 == 0 else 60)
+                    for n in range(i, min(i + chunk, rows))
+                ])
+        yield event
+    finally:
+        connection = connections[Occurrence.objects.db]
+        qn = connection.ops.quote_name
+        connection.cursor().execute("DELETE FROM %s WHERE %s = %%s" % (
+            qn(Occurrence._meta.db_table),
+            qn(Occurrence._meta.get_field('event').column)), [event.pk])
+        transaction.commit_unless_managed(using=Occurrence.objects.db)
+        event.delete()
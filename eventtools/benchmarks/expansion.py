@@ -0,0 +1,31 @@
+"""
+Time to expand a year of occurrences from simple rules, iterating dateutil's
+rrule and vectorised with NumPy (eventtools.utils.fastrrule).
+"""
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+from eventtools.models.rule import Rule
+from eventtools.utils import fastrrule
+from eventtools.benchmarks import timed, report
+
+NUMBER = 50
+
+RULES = {
+    'daily': Rule(pk=-3, frequency="DAILY", params="byhour:10,14,19"),
+    'weekly': Rule(pk=-4, frequency="WEEKLY", params="byweekday:0,2,4"),
+}
+
+def run(stdout):
+    dtstart = datetime(2012, 3, 14, 10, 30)
+    until = dtstart + timedelta(days=365)
+    for name, rule in sorted(RULES.items()):
+        compiled = rule.compiled()
+        report(stdout, "%s rule, dateutil" % name, timed(
+            lambda: list(takewhile(lambda d: d <= until, compiled._bind(dtstart))),
+            NUMBER))
+        if fastrrule.np is None:
+            stdout.write("NumPy is not installed; skipping vectorised expansion.\n")
+            continue
+        report(stdout, "%s rule, NumPy" % name, timed(
+            lambda: fastrrule.expand(compiled, dtstart, until), NUMBER))
@@ -0,0 +1,59 @@
+"""
+Time to answer overlap, stabbing and nearest-next questions about ROWS
+occurrences with an OccurrenceIntervalIndex (eventtools.utils.intervals),
+compared with a query each. Uses the installed Occurrence model.
+"""
+import random
+from datetime import timedelta
+
+from eventtools.models import OccurrenceModel
+from eventtools.utils.intervals import OccurrenceIntervalIndex
+from eventtools.benchmarks import timed, report, concrete_model, \
+    scratch_occurrences, FIRST, INTERVAL
+
+ROWS = 100000
+NUMBER = 200
+
+def run(stdout):
+    Occurrence = concrete_model(OccurrenceModel)
+    if Occurrence is None:
+        stdout.write("No Occurrence model is installed; skipping.\n")
+        return
+
+    with scratch_occurrences(Occurrence, ROWS, 'intervals') as event:
+        occurrences = Occurrence.objects.filter(event=event)
+        report(stdout, "build the index of %s rows" % ROWS, timed(
+            lambda: OccurrenceIntervalIndex.from_queryset(occurrences), 1))
+        index = OccurrenceIntervalIndex.from_queryset(occurrences)
+
+        random.seed(0)
+        moments = [FIRST + INTERVAL * random.randint(0, ROWS)
+            for i in range(NUMBER)]
+        hour = timedelta(hours=1)
+
+        def each(f):
+            it = iter(moments * 2)
+            return lambda: f(next(it))
+
+        report(stdout, "overlapping() an hour, query", timed(each(lambda t:
+            list(occurrences.overlapping(t, t + hour).values_list('pk', flat=True))
+        ), NUMBER))
+        report(stdout, "overlapping() an hour, index", timed(each(lambda t:
+            index.overlapping(t, t + hour)), NUMBER))
+
+        report(stdout, "on at a moment, query", timed(each(lambda t:
+            list(occurrences.filter(start__lte=t, _end__gte=t)
+                .values_list('pk', flat=True))
+        ), NUMBER))
+        report(stdout, "on at a moment, index", timed(each(lambda t:
+            index.at(t)), NUMBER))
+
+        report(stdout, "next after a moment, query", timed(each(lambda t:
+            list(occurrences.filter(start__gt=t).order_by('start')
+                .values_list('pk', flat=True)[:1])
+        ), NUMBER))
+        report(stdout, "next after a moment, index", timed(each(lambda t:
+            index.next_after(t)), NUMBER))
+
+        report(stdout, "insert and remove, index", timed(each(lambda t:
+            (index.insert(0, t, t + hour), index.remove(0, t))), NUMBER))
@@ -0,0 +1,112 @@
+"""
+Time to find the events in listings (EventQuerySet.in_listings()) in a forest
+of TREES * 4 events (a root, two children and a grandchild each, with
+occurrences at different levels), compared with the previous approach of a
+query per tree level. Uses the installed Event and Occurrence models.
+"""
+from django.db import connections, transaction
+from django.db.models import Max
+
+from eventtools.models import EventModel
+from eventtools.benchmarks import timed, report, concrete_model, FIRST
+
+TREES = 5000
+NUMBER = 5
+
+def in_listings_by_level(queryset):
+    """
+    The previous in_listings(), which ORs together the events with
+    occurrences at each level under events without.
+    """
+    max_level = queryset.aggregate(Max('level'))['level__max']
+    result = queryset.filter(level=0).having_occurrences()
+    qs = queryset.filter(level=0).having_no_occurrences()
+    for level in range(1, max_level+1):
+        if qs:
+            result |= queryset.filter(parent__in=qs).having_occurrences()
+            qs = queryset.filter(parent__in=qs).having_no_occurrences()
+    return result
+
+def _create_forest(Event, first_tree):
+    """
+    Creates the events (with bulk_create, so their tree fields are set
+    here) and their occurrences. In the trees, in turn, the root, both
+    children, the grandchild, or nothing has occurrences. Returns the pks
+    of the events that should be listed.
+    """
+    Occurrence = Event.OccurrenceModel()
+    # (level, lft, rght, parent's position), by position in the tree
+    shape = [(0, 1, 8, None), (1, 2, 5, 0), (2, 3, 4, 1), (1, 6, 7, 0)]
+    with_occurrences = [[0], [1, 3], [2], []]
+
+    pks = {} # (tree, position): pk
+    for position, (level, lft, rght, parent) in enumerate(shape):
+        with transaction.commit_on_success():
+            Event._event_manager.bulk_create([
+                Event(title="eventtools listings benchmark",
+                    slug="eventtools-listings-benchmark-%s-%s" % (tree, position),
+                    tree_id=tree, level=level, lft=lft, rght=rght,
+                    parent_id=pks[(tree, parent)] if parent is not None else None)
+                for tree in range(first_tree, first_tree + TREES)
+            ])
+        pks.update(
+            ((tree, position), pk) for tree, pk in Event._event_manager.filter(
+                tree_id__gte=first_tree, level=level, lft=lft
+            ).values_list('tree_id', 'pk')
+        )
+
+    listed = set()
+    occurrences = []
+    for tree in range(first_tree, first_tree + TREES):
+        for position in with_occurrences[tree % len(with_occurrences)]:
+            listed.add(pks[(tree, position)])
+            occurrences.append(Occurrence(event_id=pks[(tree, position)],
+                start=FIRST, _duration=60))
+    with transaction.commit_on_success():
+        Occurrence.objects.bulk_create(occurrences)
+    return listed
+
+def _delete_forest(Event, first_tree):
+    Occurrence = Event.OccurrenceModel()
+    connection = connections[Event._event_manager.db]
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE %s IN (SELECT %s FROM %s WHERE %s >= %%s)" % (
+        qn(Occurrence._meta.db_table),
+        qn(Occurrence._meta.get_field('event').column),
+        qn(Event._meta.pk.column), qn(Event._meta.db_table),
+        qn(Event._meta.get_field('tree_id').column)), [first_tree])
+    # (children first, for databases that check the parent FK)
+    for level in (2, 1, 0):
+        cursor.execute("DELETE FROM %s WHERE %s >= %%s AND %s = %%s" % (
+            qn(Event._meta.db_table),
+            qn(Event._meta.get_field('tree_id').column),
+            qn(Event._meta.get_field('level').column)), [first_tree, level])
+    transaction.commit_unless_managed(using=Event._event_manager.db)
+
+def run(stdout):
+    Event = concrete_model(EventModel)
+    if Event is None:
+        stdout.write("No Event model is installed; skipping.\n")
+        return
+
+    first_tree = (Event._event_manager.aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+    try:
+        listed = _create_forest(Event, first_tree)
+        events = Event._event_manager.filter(tree_id__gte=first_tree)
+        label = "in_listings() of %s events" % (TREES * 4)
+
+        pks = set(events.in_listings().values_list('pk', flat=True))
+        assert pks == listed
+        report(stdout, label, timed(
+            lambda: list(events.in_listings().values_list('pk', flat=True)),
+            NUMBER))
+
+        pks = set(in_listings_by_level(events).values_list('pk', flat=True))
+        assert pks == listed
+        report(stdout, label + ", a query per level", timed(
+            lambda: list(in_listings_by_level(events)
+                .values_list('pk', flat=True)),
+            NUMBER))
+    finally:
+        _delete_forest(Event, first_tree)
@@ -0,0 +1,41 @@
+"""
+Time to find the occurrences that are on in a window (overlapping(),
+on_day_overlapping() and now_on()) among ROWS occurrences, with the query plan
+for each, to check that they are served by an index on start or _end (see
+UPGRADING.txt for the composite indexes), with and without max_duration. Uses
+the installed Occurrence model.
+"""
+from datetime import timedelta
+
+from eventtools.models import OccurrenceModel
+from eventtools.benchmarks import timed, report, concrete_model, explain, \
+    scratch_occurrences, FIRST, INTERVAL
+
+ROWS = 1000000
+NUMBER = 20
+
+def run(stdout):
+    Occurrence = concrete_model(OccurrenceModel)
+    if Occurrence is None:
+        stdout.write("No Occurrence model is installed; skipping.\n")
+        return
+
+    with scratch_occurrences(Occurrence, ROWS, 'overlaps'):
+        # (a day half way through)
+        day = (FIRST + INTERVAL * (ROWS / 2)).date()
+        month = timedelta(days=31)
+        queries = [
+            ("overlapping() a weekend", lambda **kwargs: Occurrence.objects
+                .overlapping(day, day + timedelta(days=1), **kwargs)),
+            ("on_day_overlapping()", lambda **kwargs: Occurrence.objects
+                .on_day_overlapping(day, **kwargs)),
+            ("now_on()", lambda **kwargs: Occurrence.objects.now_on(**kwargs)),
+        ]
+        for label, query in queries:
+            for kwargs in ({}, {'max_duration': month}):
+                qs = query(**kwargs).order_by().values_list('pk', flat=True)
+                report(stdout, "%s%s, of %s rows" % (label,
+                    " with max_duration" if kwargs else "", ROWS),
+                    timed(lambda: list(qs.all()), NUMBER))
+                for line in explain(qs):
+                    stdout.write("    %s\n" % line)
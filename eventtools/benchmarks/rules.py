@@ -0,0 +1,33 @@
+"""
+Per-call cost of Rule.get_rrule, parsing each time (as it used to) and
+reading the compiled rule cache. (Complex rules are parsed again for each new
+dtstart, so for them only the same-dtstart case is cheaper.)
+"""
+from datetime import datetime, timedelta
+
+from eventtools.models.rule import Rule, CompiledRule
+from eventtools.benchmarks import timed, report
+
+NUMBER = 2000
+
+RULES = {
+    'simple': Rule(pk=-1, frequency="WEEKLY", params="byweekday:0,2,4;byhour:10,14"),
+    'complex': Rule(pk=-2, frequency="MONTHLY",
+        complex_rule="RRULE:FREQ=MONTHLY;BYDAY=%nthday%\nEXDATE:%year%1225T%time%"),
+}
+
+def run(stdout):
+    dtstart = datetime(2012, 3, 14, 10, 30)
+    dtstarts = [dtstart + timedelta(days=i) for i in range(NUMBER)]
+    for name, rule in sorted(RULES.items()):
+        report(stdout, "%s rule, parsed on every call" % name,
+            timed(lambda: CompiledRule(rule)._bind(dtstart), NUMBER))
+
+        compiled = rule.compiled()
+        it = iter(dtstarts)
+        report(stdout, "%s rule, compiled, new dtstart on every call" % name,
+            timed(lambda: compiled._bind(next(it)), NUMBER))
+
+        rule.get_rrule(dtstart)
+        report(stdout, "%s rule, compiled, same dtstart (get_rrule)" % name,
+            timed(lambda: rule.get_rrule(dtstart), NUMBER))
@@ -0,0 +1,106 @@
+"""
+Deferred generation of occurrences.
+
+Saving a generator synchronises its whole series of occurrences, and those of
+the other generators of its event, which can take a while. With
+settings.GENERATION_MODE set to:
+
+ * 'immediate' (the default), that's done while saving.
+
+ * 'deferred', saving records a GenerationJob and returns. Run
+   ./manage.py process_generation_jobs to process jobs (e.g. from cron, or
+   continuously with --sleep).
+
+ * 'thread', jobs are recorded as for 'deferred', and processed by a pool of
+   GENERATION_THREADS threads in the same process, which suits single-server
+   deployments. The threads poll for jobs every GENERATION_POLL_INTERVAL
+   seconds, and as soon as a job is recorded.
+
+Jobs are coalesced per generator, and processed per event. Use
+GenerationJob.objects.status_for_event(event) (or the admin's
+generation_status URL for the event) to find out whether they have finished.
+"""
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection
+
+from eventtools.conf import settings
+from eventtools.models.generation import GenerationJob
+
+logger = logging.getLogger(__name__)
+
+def defer(generator, saved):
+    """
+    Records a job to generate the given generator's occurrences, and starts
+    processing it in the background if GENERATION_MODE is 'thread'.
+    """
+    GenerationJob.objects.enqueue(generator, saved)
+    if settings.GENERATION_MODE == 'thread':
+        _worker.wake()
+
+def process_pending():
+    """
+    Processes the pending jobs, event by event. Returns the number of jobs
+    processed and the number of events whose jobs failed.
+    """
+    processed, failed = 0, 0
+    for key in GenerationJob.objects.pending_events():
+        n, error = _process(key)
+        processed += n
+        failed += bool(error)
+    return processed, failed
+
+def _process(key):
+    try:
+        return GenerationJob.objects.process_event(*key), None
+    except Exception as e:
+        logger.exception("Generating occurrences for %s event %s failed" % key)
+        return 0, e
+
+class _ThreadedWorker(object):
+    """
+    A daemon thread that polls for pending jobs, and processes each event's
+    jobs in a thread pool.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = None
+
+    def wake(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="eventtools-generation")
+                self.thread.daemon = True
+                self.thread.start()
+        self.event.set()
+
+    def run(self):
+        pool = ThreadPool(settings.GENERATION_THREADS)
+        while True:
+            # Jobs recorded in a transaction that hasn't been committed yet
+            # are picked up by the next poll.
+            self.event.wait(settings.GENERATION_POLL_INTERVAL)
+            self.event.clear()
+            try:
+                keys = GenerationJob.objects.pending_events()
+            except Exception:
+                logger.exception("Couldn't poll for generation jobs")
+                keys = []
+            finally:
+                connection.close()
+            if keys:
+                pool.map(_process_in_thread, keys)
+
+def _process_in_thread(key):
+    try:
+        return _process(key)
+    finally:
+        # Each thread has its own connection, which would otherwise be left
+        # open.
+        connection.close()
+
+_worker = _ThreadedWorker()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.importlib import import_module
+
+BENCHMARKS = ['rules', 'expansion', 'overlaps', 'intervals', 'listings']
+
+class Command(BaseCommand):
+    args = "[benchmark ...]"
+    help = "Runs eventtools benchmarks (all of them by default). " \
+        "Available benchmarks: %s" % ", ".join(BENCHMARKS)
+
+    def handle(self, *names, **options):
+        for name in names or BENCHMARKS:
+            if name not in BENCHMARKS:
+                raise CommandError("Unknown benchmark '%s'. Choose from %s" % (
+                    name, ", ".join(BENCHMARKS)))
+            module = import_module('eventtools.benchmarks.%s' % name)
+            self.stdout.write("%s\n%s\n" % (name, (module.__doc__ or "").strip()))
+            module.run(self.stdout)
+            self.stdout.write("\n")
@@ -0,0 +1,137 @@
+import time
+from datetime import date, datetime
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections
+from django.db.models import F, Q, get_model
+
+from eventtools.conf import settings
+from eventtools.models import GeneratorModel
+from eventtools.models.summary import summaries_deferred
+from eventtools.utils.modelutils import concrete_subclasses
+
+
+def _pending(GeneratorModel, until):
+    """
+    Returns the generators that haven't yet generated up to `until` (or their
+    repeat_until date).
+    """
+    return GeneratorModel.objects.filter(
+        Q(generated_until__isnull=True) |
+        Q(generated_until__lt=until) & (
+            Q(repeat_until__isnull=True) |
+            Q(repeat_until__gt=F('generated_until'))
+        )
+    )
+
+
+def _close_connections():
+    # Forked workers must not share their parent's database connections, so
+    # each one opens its own when it first needs it.
+    for connection in connections.all():
+        connection.close()
+
+
+def _extend_tree(args):
+    """
+    Extends the pending generators for the events in one tree. Returns
+    (tree_id, number of generators, number of new occurrences, seconds).
+    """
+    app_label, model_name, tree_id, until = args
+    GeneratorModel = get_model(app_label, model_name)
+    OccurrenceModel = GeneratorModel.OccurrenceModel()
+    started = time.time()
+
+    occurrences = OccurrenceModel.objects.filter(event_tree_id=tree_id)
+    occurrence_count = occurrences.count()
+    generators = _pending(GeneratorModel, until) \
+        .filter(event__tree_id=tree_id).select_related('rule', 'event')
+    generator_count = 0
+    # (the events' summaries are refreshed once each)
+    with summaries_deferred():
+        for generator in generators:
+            generator.extend_to(until)
+            generator_count += 1
+
+    return (
+        tree_id,
+        generator_count,
+        occurrences.count() - occurrence_count,
+        time.time() - started,
+    )
+
+
+class Command(NoArgsCommand):
+    help = "Generates occurrences for every generator up to the generator " \
+        "limit from today (or their repeat_until date). Work is split by " \
+        "event tree, and trees are processed in parallel. Run this daily " \
+        "from cron; it is safe to re-run."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', '-p', type='int', dest='processes',
+            default=cpu_count(),
+            help="Number of worker processes (default: number of CPUs). Use "
+                "1 to run in this process."),
+        make_option('--until', dest='until', default=None,
+            help="Generate up to this date (YYYY-MM-DD), rather than the "
+                "generator limit from today."),
+    )
+
+    def handle_noargs(self, **options):
+        if options['until']:
+            try:
+                until = datetime.strptime(options['until'], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--until must be a date in the form YYYY-MM-DD")
+        else:
+            until = date.today() + settings.DEFAULT_GENERATOR_LIMIT
+        processes = options['processes']
+        verbosity = int(options['verbosity'])
+
+        tasks = []
+        for model in concrete_subclasses(GeneratorModel):
+            tree_ids = _pending(model, until) \
+                .values_list('event__tree_id', flat=True) \
+                .order_by().distinct()
+            tasks += [
+                (model._meta.app_label, model._meta.object_name, tree_id, until)
+                for tree_id in tree_ids
+            ]
+
+        started = time.time()
+        if processes > 1 and len(tasks) > 1:
+            _close_connections()
+            pool = Pool(processes, initializer=_close_connections)
+            try:
+                results = pool.imap_unordered(_extend_tree, tasks)
+                totals = self._report(results, verbosity)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            totals = self._report((_extend_tree(t) for t in tasks), verbosity)
+
+        if verbosity:
+            self.stdout.write(
+                "Extended %s generators in %s trees to %s, creating %s "
+                "occurrences, in %.2fs.\n" % (
+                    totals[1], totals[0], until, totals[2],
+                    time.time() - started
+                )
+            )
+
+    def _report(self, results, verbosity):
+        totals = [0, 0, 0]
+        for tree_id, generator_count, occurrence_count, seconds in results:
+            totals[0] += 1
+            totals[1] += generator_count
+            totals[2] += occurrence_count
+            if verbosity > 1:
+                self.stdout.write(
+                    "Tree %s: %s generators, %s new occurrences, %.2fs\n" % (
+                        tree_id, generator_count, occurrence_count, seconds
+                    )
+                )
+        return totals
@@ -0,0 +1,41 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from eventtools import generation
+from eventtools.models.generation import GenerationJob
+
+
+class Command(NoArgsCommand):
+    help = "Processes pending occurrence generation jobs, which are " \
+        "recorded when generators are saved with GENERATION_MODE = " \
+        "'deferred'. It is safe to run several at once."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--sleep', type='float', dest='sleep', default=None,
+            help="Keep running, checking for new jobs this many seconds "
+                "after running out."),
+        make_option('--retry-failed', action='store_true',
+            dest='retry_failed', default=False,
+            help="Retry jobs that have failed first."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options['verbosity'])
+        if options['retry_failed']:
+            retried = GenerationJob.objects.retry_failed()
+            if verbosity:
+                self.stdout.write("Retrying %s failed jobs.\n" % retried)
+
+        while True:
+            started = time.time()
+            processed, failed = generation.process_pending()
+            if verbosity and (processed or failed or options['sleep'] is None):
+                self.stdout.write(
+                    "Processed %s jobs in %.2fs; jobs for %s events "
+                    "failed.\n" % (processed, time.time() - started, failed))
+            if options['sleep'] is None:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
@@ -0,0 +1,59 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from eventtools.models import EventSummaryModel
+from eventtools.utils.modelutils import concrete_subclasses
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the summaries of every event (see EventSummaryModel) " \
+        "from their occurrences. Summaries are kept up to date as " \
+        "occurrences change, so this is only needed to fill the table " \
+        "for the first time, or after occurrences have been changed " \
+        "without signals (e.g. with QuerySet.update()). It is safe to re-run."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=1000,
+            help="Number of summaries to write per transaction (default: "
+                "1000)."),
+    )
+
+    def handle_noargs(self, **options):
+        chunk_size = options['chunk_size']
+        verbosity = int(options['verbosity'])
+
+        for SummaryModel in concrete_subclasses(EventSummaryModel):
+            started = time.time()
+            EventModel = SummaryModel._meta.get_field('event').rel.to
+            events = EventModel._event_manager.all()
+            count = 0
+            with transaction.commit_on_success():
+                SummaryModel.objects.all().delete()
+            summaries = []
+            for event in events.iterator():
+                summaries.append(
+                    SummaryModel(event=event, **SummaryModel.summarise(event)))
+                if len(summaries) == chunk_size:
+                    count += self._write(SummaryModel, summaries)
+                    summaries = []
+                    if verbosity > 1:
+                        self.stdout.write("%s: %s events\n" % (
+                            SummaryModel._meta.object_name, count))
+            count += self._write(SummaryModel, summaries)
+
+            if verbosity:
+                self.stdout.write(
+                    "Rebuilt %s %s summaries in %.2fs.\n" % (
+                        count, SummaryModel._meta.object_name,
+                        time.time() - started
+                    )
+                )
+
+    def _write(self, SummaryModel, summaries):
+        with transaction.commit_on_success():
+            SummaryModel.objects.bulk_create(summaries)
+        return len(summaries)
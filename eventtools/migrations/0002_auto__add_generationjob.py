@@ -0,0 +1,56 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+
+        # Adding model 'GenerationJob'
+        db.create_table('eventtools_generationjob', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('generator_model', self.gf('django.db.models.fields.CharField')(max_length=100)),
+            ('generator_id', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('event_id', self.gf('django.db.models.fields.PositiveIntegerField')(db_index=True)),
+            ('saved_start', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('saved_duration', self.gf('django.db.models.fields.PositiveIntegerField')(null=True, blank=True)),
+            ('status', self.gf('django.db.models.fields.CharField')(default='pending', max_length=10, db_index=True)),
+            ('error', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+        ))
+        db.send_create_signal('eventtools', ['GenerationJob'])
+
+
+    def backwards(self, orm):
+
+        # Deleting model 'GenerationJob'
+        db.delete_table('eventtools_generationjob')
+
+
+    models = {
+        'eventtools.generationjob': {
+            'Meta': {'ordering': "('pk',)", 'object_name': 'GenerationJob'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'event_id': ('django.db.models.fields.PositiveIntegerField', [], {'db_index': 'True'}),
+            'generator_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'generator_model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'saved_duration': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'saved_start': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'pending'", 'max_length': '10', 'db_index': 'True'})
+        },
+        'eventtools.rule': {
+            'Meta': {'ordering': "('-common', 'name')", 'object_name': 'Rule'},
+            'common': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'complex_rule': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'frequency': ('django.db.models.fields.CharField', [], {'max_length': '10', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'params': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['eventtools']
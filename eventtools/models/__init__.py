@@ -2,9 +2,11 @@
 
 
 from .rule import Rule
+from .generation import GenerationJob
 
 from .event import *
 from .occurrence import *
 from .generator import *
 from .exclusion import *
 from .xseason import *
+from .summary import *
@@ -1,11 +1,14 @@
+from datetime import timedelta
 from operator import itemgetter
 
-from django.db import models
+from django.db import models, connections, router, transaction
 from django.db.models.base import ModelBase
 from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.db.models import Count
 from django.core.urlresolvers import reverse
-from django.utils.timezone import localtime
+from django.utils.datastructures import SortedDict
+from django.utils.timezone import localtime, now
 from django.utils.translation import ugettext, ugettext_lazy as _
 from django.template.defaultfilters import urlencode, slugify
 
@@ -15,6 +18,104 @@ from mptt.managers import TreeManager
 from eventtools.utils.inheritingdefault import ModelInstanceAwareDefault #TODO: deprecate
 from eventtools.utils.pprint_timespan import pprint_datetime_span, pprint_date_span
 from eventtools.conf import settings
+from eventtools.snapshot import schedule_snapshot
+from eventtools.models.summary import summaries_deferred, tree_changed
+
+def sql_names(model, connection):
+    """
+    Returns a dictionary of the quoted names of the event model's table and
+    tree columns, and of its occurrence model's table and columns, for raw
+    SQL over event trees.
+    """
+    qn = connection.ops.quote_name
+    Occurrence = model.OccurrenceModel()
+    mptt = model._mptt_meta
+    column = lambda m, attr: qn(m._meta.get_field(attr).column)
+    return {
+        'events': qn(model._meta.db_table),
+        'event_pk': qn(model._meta.pk.column),
+        'tree_id': column(model, mptt.tree_id_attr),
+        'left': column(model, mptt.left_attr),
+        'right': column(model, mptt.right_attr),
+        'occurrences': qn(Occurrence._meta.db_table),
+        'pk': qn(Occurrence._meta.pk.column),
+        'event': column(Occurrence, 'event'),
+        'start': column(Occurrence, 'start'),
+        'end': column(Occurrence, '_end'),
+        'status': column(Occurrence, 'status'),
+        'event_tree_id': column(Occurrence, 'event_tree_id'),
+        'event_lft': column(Occurrence, 'event_lft'),
+    }
+
+# The counts in an event's status_summary().
+STATUS_SUMMARY_KEYS = (
+    'total', 'cancelled', 'fully_booked', 'available',
+    'forthcoming', 'forthcoming_cancelled', 'forthcoming_fully_booked',
+    'forthcoming_available', 'unfinished', 'unknown_end',
+)
+
+# The most events to summarise in a query.
+STATUS_SUMMARY_BATCH_SIZE = 500
+
+def status_summaries(model, pks, using=None):
+    """
+    Returns a dictionary of pk: status_summary() for the events of the model
+    with the given pks, in one query, which counts the occurrences in each
+    event's listing (ie attached to it or its descendants, by the tree fields
+    stored on the occurrences) with a CASE expression per count.
+    """
+    pks = list(pks)
+    summaries = dict((pk, dict.fromkeys(STATUS_SUMMARY_KEYS, 0)) for pk in pks)
+    if not pks:
+        return summaries
+    if using is None:
+        using = router.db_for_read(model)
+    connection = connections[using]
+    names = sql_names(model, connection)
+
+    moment = connection.ops.value_to_db_datetime(now())
+    status = 'o.%(status)s' % names
+    forthcoming = 'o.%(start)s >= %%s' % names
+    conditions = {
+        'cancelled': ('%s = %%s' % status,
+            [settings.OCCURRENCE_STATUS_CANCELLED[0]]),
+        'fully_booked': ('%s = %%s' % status,
+            [settings.OCCURRENCE_STATUS_FULLY_BOOKED[0]]),
+        'available': ("(%s = '' OR %s IS NULL)" % (status, status), []),
+        'forthcoming': (forthcoming, [moment]),
+        'unfinished': ('o.%(end)s >= %%s' % names, [moment]),
+        # (occurrences without a stored end, e.g. from before it was stored)
+        'unknown_end': ('o.%(end)s IS NULL' % names, []),
+    }
+    for key in ('cancelled', 'fully_booked', 'available'):
+        sql, params = conditions[key]
+        conditions['forthcoming_' + key] = \
+            ('%s AND %s' % (forthcoming, sql), [moment] + params)
+
+    counts, params = [], []
+    for key in STATUS_SUMMARY_KEYS[1:]:
+        sql, condition_params = conditions[key]
+        counts.append('SUM(CASE WHEN %s THEN 1 ELSE 0 END)' % sql)
+        params.extend(condition_params)
+    sql = """
+        SELECT listing.%(event_pk)s, COUNT(*), %(counts)s
+        FROM %(events)s listing
+        INNER JOIN %(occurrences)s o ON o.%(event_tree_id)s = listing.%(tree_id)s
+            AND o.%(event_lft)s >= listing.%(left)s
+            AND o.%(event_lft)s <= listing.%(right)s
+        WHERE listing.%(event_pk)s IN (%(pks)s)
+        GROUP BY listing.%(event_pk)s
+    """ % dict(names,
+        counts=', '.join(counts),
+        pks=', '.join(['%s'] * len(pks)),
+    )
+    cursor = connection.cursor()
+    cursor.execute(sql, params + pks)
+    for row in cursor.fetchall():
+        summaries[row[0]] = dict(zip(STATUS_SUMMARY_KEYS,
+            [int(count or 0) for count in row[1:]]))
+    return summaries
+
 
 class EventQuerySet(models.query.QuerySet):
     # much as you may be tempted to add "starts_between" and other
@@ -33,28 +134,139 @@ class EventQuerySet(models.query.QuerySet):
         Occurrence set, with no repetitions or overlaps. ie, this is probably
         what you want to show in listings.
 
-        Given that the tree is likely to be quite shallow, let's do this breadth-first.
-
-        For each level:
-        * two filter: 1) children of qs having_occurrences and 2) children of qs having_no_occurrences.
-        * 1) is added to result set.
-        * 2) is used as qs for next level
-
-        TODO: For subqueries, this will produce results that are not in the
-        superqueries, because we don't have access to potential missing parents.
-        Maybe this is desired behaviour?
-        """
-        max_level = self.aggregate(models.Max('level'))['level__max']
-
-        result = self.filter(level=0).having_occurrences()
-        qs = self.filter(level=0).having_no_occurrences()
-
-        for level in range(1, max_level+1):
-            if qs:
-                result |= self.filter(parent__in=qs).having_occurrences()
-                qs = self.filter(parent__in=qs).having_no_occurrences()
-
-        return result
+        These are the events that have occurrences, and no ancestor (in the
+        same tree, with lft < theirs and rght > theirs) with occurrences of
+        its own, so this is a single query, however deep the trees are. For
+        a filtered queryset, it returns those of its events that are in
+        listings.
+        """
+        names = sql_names(self.model, connections[self.db])
+        has_occurrences = """
+            EXISTS (
+                SELECT 1 FROM %(occurrences)s eventtools_o
+                WHERE eventtools_o.%(event)s = %(events)s.%(event_pk)s
+            )
+        """ % names
+        no_listed_ancestor = """
+            NOT EXISTS (
+                SELECT 1 FROM %(events)s eventtools_a
+                WHERE eventtools_a.%(tree_id)s = %(events)s.%(tree_id)s
+                    AND eventtools_a.%(left)s < %(events)s.%(left)s
+                    AND eventtools_a.%(right)s > %(events)s.%(right)s
+                    AND EXISTS (
+                        SELECT 1 FROM %(occurrences)s eventtools_o
+                        WHERE eventtools_o.%(event)s = eventtools_a.%(event_pk)s
+                    )
+            )
+        """ % names
+        return self.extra(where=[has_occurrences, no_listed_ancestor])
+
+    # whether to fetch the events' status_summary() and listed_under() along
+    # with them
+    _with_status_summary = False
+    _with_listed_under = False
+
+    def _clone(self, *args, **kwargs):
+        kwargs.setdefault('_with_status_summary', self._with_status_summary)
+        kwargs.setdefault('_with_listed_under', self._with_listed_under)
+        return super(EventQuerySet, self)._clone(*args, **kwargs)
+
+    def annotate_status_summary(self):
+        """
+        Returns a copy of this queryset whose events come with their
+        status_summary() (and so is_cancelled(), is_fully_booked() and so on)
+        already worked out, in one query per STATUS_SUMMARY_BATCH_SIZE events,
+        rather than several queries per event. Use this for listings.
+        """
+        return self._clone(_with_status_summary=True)
+
+    def annotate_listed_under(self):
+        """
+        Returns a copy of this queryset whose events come with listed_under()
+        (and so is_listed()) already worked out: each event's listed_under_id
+        is selected with it, as the pk of the highest event in its ancestors
+        (or itself) with occurrences attached, and the events they are listed
+        under are fetched in one more query per STATUS_SUMMARY_BATCH_SIZE
+        events.
+        """
+        names = sql_names(self.model, connections[self.db])
+        listed_under_id = """
+            SELECT eventtools_a.%(event_pk)s FROM %(events)s eventtools_a
+            WHERE eventtools_a.%(tree_id)s = %(events)s.%(tree_id)s
+                AND eventtools_a.%(left)s <= %(events)s.%(left)s
+                AND eventtools_a.%(right)s >= %(events)s.%(right)s
+                AND EXISTS (
+                    SELECT 1 FROM %(occurrences)s eventtools_o
+                    WHERE eventtools_o.%(event)s = eventtools_a.%(event_pk)s
+                )
+            ORDER BY eventtools_a.%(left)s
+            LIMIT 1
+        """ % names
+        return self.extra(select={'listed_under_id': listed_under_id}) \
+            ._clone(_with_listed_under=True)
+
+    def annotate_occurrence_counts(self):
+        """
+        Returns a copy of this queryset whose events come with the numbers of
+        their occurrences, in the same query: direct_occurrence_count (those
+        attached to the event), listing_occurrence_count (those in its
+        listing, by the tree fields stored on the occurrences) and
+        forthcoming_occurrence_count (those in its listing that haven't
+        started yet).
+        """
+        connection = connections[self.db]
+        names = sql_names(self.model, connection)
+        in_listing = """
+            SELECT COUNT(*) FROM %(occurrences)s eventtools_o
+            WHERE eventtools_o.%(event_tree_id)s = %(events)s.%(tree_id)s
+                AND eventtools_o.%(event_lft)s >= %(events)s.%(left)s
+                AND eventtools_o.%(event_lft)s <= %(events)s.%(right)s
+        """ % names
+        select = SortedDict([
+            ('direct_occurrence_count', """
+                SELECT COUNT(*) FROM %(occurrences)s eventtools_o
+                WHERE eventtools_o.%(event)s = %(events)s.%(event_pk)s
+            """ % names),
+            ('listing_occurrence_count', in_listing),
+            ('forthcoming_occurrence_count',
+                in_listing + " AND eventtools_o.%(start)s >= %%s" % names),
+        ])
+        return self.extra(select=select,
+            select_params=[connection.ops.value_to_db_datetime(now())])
+
+    def iterator(self):
+        events = super(EventQuerySet, self).iterator()
+        if not (self._with_status_summary or self._with_listed_under):
+            return events
+        return self._iterator_in_batches(events)
+
+    def _iterator_in_batches(self, events):
+        batch = []
+        for event in events:
+            batch.append(event)
+            if len(batch) == STATUS_SUMMARY_BATCH_SIZE:
+                for event in self._attach(batch):
+                    yield event
+                batch = []
+        for event in self._attach(batch):
+            yield event
+
+    def _attach(self, events):
+        if events and self._with_status_summary:
+            summaries = status_summaries(self.model,
+                [event.pk for event in events], using=self.db)
+            for event in events:
+                event._status_summary = summaries[event.pk]
+        if events and self._with_listed_under:
+            listed = dict((event.pk, event) for event in events)
+            missing = set(event.listed_under_id for event in events) \
+                - set(listed) - set([None])
+            if missing:
+                listed.update(self.model._event_manager.using(self.db)
+                    .in_bulk(missing))
+            for event in events:
+                event._listed_under = listed.get(event.listed_under_id)
+        return events
 
     def occurrences(self):
         """
@@ -66,27 +278,53 @@ class EventQuerySet(models.query.QuerySet):
                 
     def opening_occurrences(self):
         """
-        Returns the opening occurrences for the events in this queryset.
+        Returns the opening occurrences for the events in this queryset, ie
+        the first of each event's occurrences in listing, as a (lazy)
+        OccurrenceQuerySet.
         """
-        pks = []
-        for e in self:
-            try:
-                pks.append(e.opening_occurrence().id)
-            except AttributeError:
-                pass
-        return self.occurrences().filter(pk__in=pks)
+        return self._listing_occurrences('ASC')
         
     def closing_occurrences(self):
         """
-        Returns the closing occurrences for the events in this queryset.
+        Returns the closing occurrences for the events in this queryset, ie
+        the last of each event's occurrences in listing, as a (lazy)
+        OccurrenceQuerySet.
+        """
+        return self._listing_occurrences('DESC')
+
+    def _listing_occurrences(self, direction):
         """
-        pks = []
-        for e in self:
-            try:
-                pks.append(e.closing_occurrence().id)
-            except AttributeError:
-                pass
-        return self.occurrences().filter(pk__in=pks)
+        Returns the occurrences that come first in each event's listing, in
+        the order ('ASC' or 'DESC') of the occurrence ordering (start, event).
+        A subquery picks one per event, from the occurrences in its (tree_id,
+        lft, rght) range, so it is one query however many events there are.
+        """
+        Occurrence = self.model.OccurrenceModel()
+        connection = connections[self.db]
+        try:
+            events_sql, events_params = self.order_by().values('pk').query \
+                .get_compiler(connection=connection).as_nested_sql()
+        except EmptyResultSet:
+            # (e.g. filter(pk__in=[]))
+            return Occurrence.objects.none()
+        sql = """
+            %(occurrences)s.%(pk)s IN (
+                SELECT (
+                    SELECT eventtools_o.%(pk)s
+                    FROM %(occurrences)s eventtools_o
+                    WHERE eventtools_o.%(event_tree_id)s = eventtools_l.%(tree_id)s
+                        AND eventtools_o.%(event_lft)s >= eventtools_l.%(left)s
+                        AND eventtools_o.%(event_lft)s <= eventtools_l.%(right)s
+                    ORDER BY eventtools_o.%(start)s %(direction)s,
+                        eventtools_o.%(event)s %(direction)s
+                    LIMIT 1
+                )
+                FROM %(events)s eventtools_l
+                WHERE eventtools_l.%(event_pk)s IN (%(events_sql)s)
+            )
+        """ % dict(sql_names(self.model, connection),
+            direction=direction, events_sql=events_sql)
+        return Occurrence.objects.extra(where=[sql], params=list(events_params))
                 
     #some simple annotations
     def having_occurrences(self):
@@ -107,6 +345,77 @@ class EventTreeManager(TreeManager):
         return EventQuerySet(self.model).order_by(
             self.tree_id_attr, self.left_attr)
 
+    # Occurrences store their event's tree_id and lft (as event_tree_id and
+    # event_lft), so the changes that MPTT makes to the tree are made to the
+    # occurrences too: shifting lfts or tree ids is mirrored with an UPDATE,
+    # and after a move or rebuild, the occurrences in the range of trees that
+    # may have changed are copied from their events.
+
+    def _occurrences(self):
+        return self.tree_model.OccurrenceModel()._base_manager
+
+    def _manage_space(self, size, target, tree_id):
+        super(EventTreeManager, self)._manage_space(size, target, tree_id)
+        self._occurrences().filter(event_tree_id=tree_id, event_lft__gt=target) \
+            .update(event_lft=models.F('event_lft') + size)
+
+    def _create_tree_space(self, target_tree_id):
+        super(EventTreeManager, self)._create_tree_space(target_tree_id)
+        self._occurrences().filter(event_tree_id__gt=target_tree_id) \
+            .update(event_tree_id=models.F('event_tree_id') + 1)
+
+    def move_node(self, node, target, position='last-child'):
+        old_parent_id = node._mptt_meta.get_raw_field_value(
+            node, self.parent_attr)
+        tree_id = getattr(node, self.tree_id_attr)
+        tree_ids = [tree_id]
+        if target is not None:
+            tree_ids.append(getattr(target, self.tree_id_attr))
+            if node.is_child_node() and target.is_root_node() and \
+                position in ('left', 'right'):
+                # (MPTT makes space for the new tree first, which shifts the
+                # later trees, maybe including the node's old one)
+                tree_ids.append(tree_id + 1)
+        super(EventTreeManager, self).move_node(node, target, position)
+        tree_ids.append(getattr(node, self.tree_id_attr))
+        self.update_occurrence_trees(min(tree_ids), max(tree_ids))
+        # (the listings of the node's old and new ancestors have changed)
+        tree_changed(self.tree_model, [old_parent_id, node.pk])
+
+    def rebuild(self):
+        super(EventTreeManager, self).rebuild()
+        self.update_occurrence_trees()
+
+    def update_occurrence_trees(self, first_tree_id=None, last_tree_id=None):
+        """
+        Copies the tree_id and lft of the events to their occurrences'
+        event_tree_id and event_lft, for the occurrences whose event_tree_id
+        is in the given range (or is null), or all of them. This is one
+        UPDATE, e.g. to fill the fields in a data migration.
+        """
+        connection = connections[self.db]
+        names = sql_names(self.tree_model, connection)
+        sql = """
+            UPDATE %(occurrences)s SET
+                %(event_tree_id)s = (
+                    SELECT %(tree_id)s FROM %(events)s
+                    WHERE %(events)s.%(event_pk)s = %(occurrences)s.%(event)s
+                ),
+                %(event_lft)s = (
+                    SELECT %(left)s FROM %(events)s
+                    WHERE %(events)s.%(event_pk)s = %(occurrences)s.%(event)s
+                )
+        """ % names
+        params = []
+        if first_tree_id is not None:
+            sql += """
+                WHERE %(event_tree_id)s IS NULL
+                    OR %(event_tree_id)s BETWEEN %%s AND %%s
+            """ % names
+            params = [first_tree_id, last_tree_id]
+        connection.cursor().execute(sql, params)
+        transaction.commit_unless_managed(using=self.db)
+
     def in_listings(self):
         return self.get_query_set().in_listings()
 
@@ -124,6 +433,13 @@ class EventTreeManager(TreeManager):
         return self.get_query_set().having_n_occurrences(n)        
     def having_no_occurrences(self):
         return self.get_query_set().having_no_occurrences()        
+
+    def annotate_status_summary(self):
+        return self.get_query_set().annotate_status_summary()
+    def annotate_listed_under(self):
+        return self.get_query_set().annotate_listed_under()
+    def annotate_occurrence_counts(self):
+        return self.get_query_set().annotate_occurrence_counts()
             
 class EventOptions(object):
     """
@@ -253,10 +569,37 @@ class EventModel(MPTTModel):
         """
         return cls.exclusions.related.model
 
+    @classmethod
+    def SummaryModel(cls):
+        """
+        Returns the class used for summaries (see EventSummaryModel), or None
+        if there isn't one.
+        """
+        summary = getattr(cls, 'summary', None)
+        if summary is None:
+            return None
+        return summary.related.model
+
+    def schedule_summary(self):
+        """
+        Returns my EventSummaryModel instance, or None if there isn't a
+        summary model, or my summary hasn't been built yet (in which case the
+        accessors below query my occurrences instead). Use
+        select_related('summary') to fetch the summaries of a listing along
+        with the events.
+        """
+        SummaryModel = type(self).SummaryModel()
+        if SummaryModel is None or self.pk is None:
+            return None
+        try:
+            return self.summary
+        except SummaryModel.DoesNotExist:
+            return None
+
     def save(self, *args, **kwargs):
         """
         When an event is saved, the changes to fields are cascaded to children,
-        and any endless generators are updated, so that a few more occurrences
+        and any endless generators are extended, so that a few more occurrences
         are generated
         """
         #this has to happen before super.save, so that we can tell what's
@@ -266,12 +609,32 @@ class EventModel(MPTTModel):
 
         self._cascade_changes_to_children()
         r = super(EventModel, self).save(*args, **kwargs)
-
-        endless_generators = self.generators.filter(repeat_until__isnull=True)
-        [g.save() for g in endless_generators]
+        # (my occurrences' statuses are read afresh)
+        self.__dict__.pop('_status_summary', None)
+
+        endless_generators = [g for g in
+            self.generators.filter(repeat_until__isnull=True)
+            if g.generated_until is None
+            or g.generated_until < g._generation_limit()]
+        if endless_generators:
+            # The generators share a snapshot of my schedule from the earliest
+            # date they have generated until (so only the part they extend is
+            # loaded), and my summary is refreshed once.
+            afters = [g.generated_until for g in endless_generators]
+            after = None if None in afters else min(afters)
+            with schedule_snapshot(self, after=after), summaries_deferred():
+                for g in endless_generators:
+                    g.event = self
+                    g.extend_to()
 
         return r
                 
+    def delete(self, *args, **kwargs):
+        # (my summary and my ancestors' are refreshed once, when I'm gone)
+        with summaries_deferred():
+            super(EventModel, self).delete(*args, **kwargs)
+    delete.alters_data = True
+
     def reload(self):
         """
         Used for refreshing events in a queryset that may have changed.        
@@ -321,15 +684,49 @@ class EventModel(MPTTModel):
         Occurrence set, with no repetitions or overlaps. ie, this is probably
         what you want to show in listings.
         """
-        return self.get_descendants(include_self=True).occurrences()
+        mptt = self._mptt_meta
+        # (a range scan on the tree fields stored on occurrences, ordered by
+        # them rather than by the default ('start', 'event'), which would join
+        # the events table to order by its tree fields)
+        return self.OccurrenceModel().objects.filter(
+            event_tree_id=getattr(self, mptt.tree_id_attr),
+            event_lft__gte=getattr(self, mptt.left_attr),
+            event_lft__lte=getattr(self, mptt.right_attr),
+        ).order_by('start', 'event_tree_id', 'event_lft')
+
+    def _summarised_occurrence(self, pk):
+        """
+        Returns my occurrence with the pk stored in my summary, or None if
+        there isn't one (e.g. the summary is stale).
+        """
+        if pk is None:
+            return None
+        try:
+            return self.occurrences_in_listing().filter(pk=pk)[0]
+        except IndexError:
+            return None
 
     def opening_occurrence(self):
+        summary = self.schedule_summary()
+        if summary is not None:
+            if not summary.total_count:
+                return None
+            occurrence = self._summarised_occurrence(summary.first_occurrence_pk)
+            if occurrence is not None:
+                return occurrence
         try:
             return self.occurrences_in_listing().all()[0]
         except IndexError:
             return None
         
     def closing_occurrence(self):
+        summary = self.schedule_summary()
+        if summary is not None:
+            if not summary.total_count:
+                return None
+            occurrence = self._summarised_occurrence(summary.last_occurrence_pk)
+            if occurrence is not None:
+                return occurrence
         try:
             return self.occurrences_in_listing().all().reverse()[0]
         except IndexError:
@@ -338,16 +735,53 @@ class EventModel(MPTTModel):
     def get_absolute_url(self):
         return reverse('events:event', kwargs={'event_slug': self.slug })
         
+    def status_summary(self):
+        """
+        Returns a dictionary of the numbers of my occurrences in listing
+        (total, cancelled, fully_booked and available), the numbers of those
+        that are forthcoming (forthcoming, forthcoming_cancelled, and so on),
+        the number that are unfinished, and the number whose end isn't stored
+        (unknown_end), which aren't counted as unfinished. The availability
+        methods below read from this.
+
+        It is worked out in one query, and memoised (use reload() for a fresh
+        copy, or save()). Events from EventQuerySet.annotate_status_summary()
+        come with it.
+        """
+        summary = getattr(self, '_status_summary', None)
+        if summary is None:
+            summary = status_summaries(type(self), [self.pk],
+                using=self._state.db)[self.pk]
+            self._status_summary = summary
+        return summary
+
     def is_finished(self):
-        """ the event has finished if the closing occurrence has finished. """
-        closing_occurrence = self.closing_occurrence()
-        if closing_occurrence:
-            return closing_occurrence.is_finished()
+        """
+        The event has finished if all its occurrences have (so this uses the
+        stored ends, or works out the ends of occurrences without one from
+        their start and duration). Returns None if there are no occurrences.
+        """
+        summary = self.status_summary()
+        if not summary['total']:
+            return None
+        if summary['unfinished']:
+            return False
+        if summary['unknown_end']:
+            moment = now()
+            for start, duration in self.occurrences_in_listing() \
+                .filter(_end__isnull=True).values_list('start', '_duration') \
+                .iterator():
+                if start + timedelta(minutes=duration or 0) >= moment:
+                    return False
+        return True
 
     def listed_under(self):
         """
         This event is listed under the highest ancestor that has Occurrences directly attached.
+        Events from EventQuerySet.annotate_listed_under() come with it.
         """
+        if hasattr(self, '_listed_under'):
+            return self._listed_under
         try:
             return self.get_ancestors().having_occurrences().order_by('level')[0]
         except (IndexError, AttributeError):
@@ -356,6 +790,9 @@ class EventModel(MPTTModel):
         return None
 
     def is_listed(self):
+        if hasattr(self, 'listed_under_id'):
+            # (without fetching the event it's listed under)
+            return self.listed_under_id == self.pk
         return self.listed_under() == self
     is_listed.boolean = True
 
@@ -365,6 +802,14 @@ class EventModel(MPTTModel):
         """
         if self.season_description:
             return self.season_description
+
+        summary = self.schedule_summary()
+        if summary is not None:
+            if summary.first_start is None:
+                return None
+            first = localtime(summary.first_start).date()
+            last = localtime(summary.last_start).date()
+            return pprint_date_span(first, last)
         
         o = self.opening_occurrence()
         c = self.closing_occurrence()
@@ -376,11 +821,27 @@ class EventModel(MPTTModel):
             
         return None
 
+    def next_start(self):
+        """
+        Returns the start of the next of my occurrences in listing, or None.
+        """
+        summary = self.schedule_summary()
+        # (the summary's next start is stale once it has passed)
+        if summary is not None and (summary.next_start is None
+            or summary.next_start >= now()):
+            return summary.next_start
+        starts = self.occurrences_in_listing().filter(start__gte=now()) \
+            .order_by('start').values_list('start', flat=True)[:1]
+        return starts[0] if starts else None
+
     def sessions(self):
         return self.sessions_description
 
     def occurrence_statuses(self):
         #returns a set of statuses of my occurrences
+        summary = self.schedule_summary()
+        if summary is not None:
+            return summary.status_set()
         return set(self.occurrences_in_listing().values_list('status', flat=True).distinct())
 
     def status(self):
@@ -393,32 +854,33 @@ class EventModel(MPTTModel):
 
     def is_cancelled(self):
         """Return True if all occurrences are cancelled"""
-        cancelled = self.cancelled_occurrences().count()
-        return cancelled > 0 and self.occurrences_in_listing().count() == cancelled
+        summary = self.status_summary()
+        return summary['cancelled'] > 0 and summary['total'] == summary['cancelled']
 
     def forthcoming_is_cancelled(self):
         """Return True if all forthcoming occurrences are cancelled"""
-        forthcoming = self.occurrences_in_listing().forthcoming().count()
-        cancelled_forthcoming = self.cancelled_occurrences().forthcoming().count()
-        return cancelled_forthcoming > 0 and forthcoming == cancelled_forthcoming
+        summary = self.status_summary()
+        return summary['forthcoming_cancelled'] > 0 and summary['forthcoming'] == summary['forthcoming_cancelled']
 
     def is_fully_booked(self):
         """
         Return True if no occurrences are available and at least one is fully booked. (a mix of cancelled and fully booked is allowed)
         """
-        return self.available_occurrences().count() == 0 and self.fully_booked_occurrences().count() > 0
+        summary = self.status_summary()
+        return summary['available'] == 0 and summary['fully_booked'] > 0
 
     def forthcoming_is_fully_booked(self):
         """
         Return True if no forthcoming occurrences are available and at least one is fully booked. (a mix of cancelled and fully booked is allowed)
         """
-        return self.available_occurrences().forthcoming().count() == 0 and self.fully_booked_occurrences().forthcoming().count() > 0
+        summary = self.status_summary()
+        return summary['forthcoming_available'] == 0 and summary['forthcoming_fully_booked'] > 0
 
     def is_available(self):
         """
         Return True if any sessions are available (ie not cancelled or fully booked)
         """
-        return self.available_occurrences().count() > 0
+        return self.status_summary()['available'] > 0
 
     def unavailable_status_message(self):
         if self.is_finished():
@@ -457,10 +919,17 @@ class EventModel(MPTTModel):
         if not formatting: # use default formatting
             formatting = '%I.%M%p'
 
-        starting_times = list(set([
-            localtime(occurrence.start).time()
-            for occurrence in self.occurrences.all()
-        ]))
+        summary = self.schedule_summary()
+        if summary is not None and self.is_leaf_node():
+            # (my listing is just my occurrences)
+            if summary.distinct_times != 1:
+                return 'Times vary'
+            starting_times = [localtime(summary.first_start).time()]
+        else:
+            starting_times = list(set([
+                localtime(occurrence.start).time()
+                for occurrence in self.occurrences.all()
+            ]))
 
         if len(starting_times) == 1:
             # `lower` converts Django's 'PM' into 'pm' and `lstrip` removes any leading '0'
@@ -0,0 +1,197 @@
+import sys
+import traceback
+
+from django.db import models, transaction
+from django.db.models import get_model
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
+
+from eventtools.snapshot import schedule_snapshot
+
+class GenerationJobManager(models.Manager):
+
+    def enqueue(self, generator, saved):
+        """
+        Records that the given (just saved) generator's occurrences need
+        generating. `saved` is the (start, _duration) that its occurrences
+        currently reflect, or None for a new generator.
+
+        Jobs are coalesced: if there is already a job for the generator, that
+        one (which has the earlier state) is kept, and retried if it failed.
+        """
+        label = model_label(type(generator))
+        existing = self.filter(generator_model=label, generator_id=generator.pk)
+        if existing.exists():
+            existing.filter(status=GenerationJob.FAILED).update(
+                status=GenerationJob.PENDING, error="")
+            return existing[0]
+        saved_start, saved_duration = saved or (None, None)
+        return self.create(
+            generator_model=label, generator_id=generator.pk,
+            event_id=generator.event_id,
+            saved_start=saved_start, saved_duration=saved_duration,
+        )
+
+    def for_event(self, event):
+        """
+        The jobs for the given event's generators.
+        """
+        return self.filter(
+            generator_model=model_label(event.GeneratorModel()),
+            event_id=event.pk)
+
+    def status_for_event(self, event):
+        """
+        Returns a dictionary describing the generation status of the given
+        event's generators, for the admin to poll:
+
+            {'status': 'pending', 'pending': 2, 'failed': 0, 'errors': []}
+
+        status is 'failed' if any job has failed, 'pending' if any job is
+        still to be done, and 'done' otherwise.
+        """
+        counts = dict(self.for_event(event).order_by().values_list('status')
+            .annotate(models.Count('pk')))
+        pending = counts.get(GenerationJob.PENDING, 0)
+        failed = counts.get(GenerationJob.FAILED, 0)
+        if failed:
+            status = 'failed'
+        elif pending:
+            status = 'pending'
+        else:
+            status = 'done'
+        errors = []
+        if failed:
+            errors = list(self.for_event(event)
+                .filter(status=GenerationJob.FAILED)
+                .values_list('error', flat=True).distinct())
+        return {
+            'status': status,
+            'pending': pending,
+            'failed': failed,
+            'errors': errors,
+        }
+
+    def pending_events(self):
+        """
+        Returns a list of (generator model label, event id) for the events
+        that have pending jobs, oldest first.
+        """
+        keys = []
+        for key in self.filter(status=GenerationJob.PENDING) \
+            .order_by('pk').values_list('generator_model', 'event_id'):
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    def process_event(self, generator_model, event_id):
+        """
+        Processes all the pending jobs for an event's generators in one
+        transaction, so other generators of the event are updated only once.
+
+        Processing is idempotent: the generator rows are locked, the jobs are
+        deleted in the same transaction as the occurrences are updated, and a
+        job that fails is marked as failed without any of its changes being
+        applied. Returns the number of jobs processed.
+        """
+        try:
+            return self._process_event(generator_model, event_id)
+        except Exception:
+            error = "".join(traceback.format_exception(*sys.exc_info()))
+            self.filter(
+                generator_model=generator_model, event_id=event_id,
+                status=GenerationJob.PENDING,
+            ).update(status=GenerationJob.FAILED, error=error)
+            raise
+
+    @transaction.commit_on_success()
+    def _process_event(self, generator_model, event_id):
+        GeneratorModel = get_model(*generator_model.split('.'))
+        # Lock the event's generators, so that saving them waits until we're
+        # done, and a job created meanwhile is left for the next run.
+        generators = list(GeneratorModel.objects.select_for_update()
+            .filter(event=event_id).select_related('rule'))
+        jobs = list(self.filter(
+            generator_model=generator_model, event_id=event_id,
+            status=GenerationJob.PENDING,
+        ).order_by('pk'))
+        if not jobs:
+            return 0
+
+        # The earliest job for a generator has the state its occurrences
+        # reflect.
+        since = {}
+        for job in jobs:
+            since.setdefault(job.generator_id, job.saved())
+
+        if generators:
+            # The generators share a snapshot of the event's schedule.
+            with schedule_snapshot(generators[0].event):
+                released = set()
+                for generator in generators:
+                    if generator.pk in since:
+                        released |= generator._regenerate(since[generator.pk])
+
+                if released:
+                    for generator in generators:
+                        generator._fill_starts(released)
+
+        self.filter(pk__in=[job.pk for job in jobs]).delete()
+        return len(jobs)
+
+    def retry_failed(self):
+        """
+        Makes failed jobs pending again. Since failed jobs changed nothing,
+        they can safely be run again.
+        """
+        return self.filter(status=GenerationJob.FAILED) \
+            .update(status=GenerationJob.PENDING, error="")
+
+
+class GenerationJob(models.Model):
+    """
+    A generator whose occurrences are waiting to be generated, when
+    settings.GENERATION_MODE is 'deferred' or 'thread' (see
+    eventtools.generation).
+
+    Generators are implemented in other apps, so they are referred to by
+    model label ('app_label.modelname') and id.
+    """
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('pending')),
+        (FAILED, _('failed')),
+    )
+
+    generator_model = models.CharField(_('generator model'), max_length=100)
+    generator_id = models.PositiveIntegerField(_('generator id'))
+    event_id = models.PositiveIntegerField(_('event id'), db_index=True)
+    # The start and duration that the generator's occurrences reflect.
+    saved_start = models.DateTimeField(null=True, blank=True)
+    saved_duration = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(_('status'), max_length=10,
+        choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    error = models.TextField(_('error'), blank=True)
+    created = models.DateTimeField(_('created'), default=now)
+
+    objects = GenerationJobManager()
+
+    class Meta:
+        verbose_name = _('occurrence generation job')
+        verbose_name_plural = _('occurrence generation jobs')
+        ordering = ('pk',)
+        app_label = "eventtools"
+
+    def __unicode__(self):
+        return u"%s %s (%s)" % (
+            self.generator_model, self.generator_id, self.status)
+
+    def saved(self):
+        if self.saved_start is None:
+            return None
+        return (self.saved_start, self.saved_duration)
+
+
+def model_label(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.object_name.lower())
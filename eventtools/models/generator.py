@@ -1,20 +1,223 @@
 # -*- coding: utf-8 -*-
 
 
-from django.db import models, transaction
+from django.db import models, transaction, DatabaseError
 from django.db.models.base import ModelBase
 from django.utils.translation import ugettext, ugettext_lazy as _
 from django.utils.timezone import get_current_timezone, localtime
 from django.core import exceptions
 
 from dateutil import rrule
-from eventtools.models.xtimespan import XTimespanModel
+from eventtools.models.xtimespan import XTimespanModel, XTimespanManager
 
 from eventtools.conf import settings
+from eventtools.signals import occurrences_changed
+from eventtools import generation
+from eventtools.snapshot import EventScheduleSnapshot, schedule_snapshot, \
+    after_datetime
+from eventtools.models.summary import summaries_deferred
+from eventtools.utils import fastrrule
+from eventtools.utils.intervals import sweep_overlaps
 from eventtools.utils.pprint_timespan import (
     pprint_datetime_span, pprint_date_span)
 
 from datetime import date, time, datetime, timedelta
+from heapq import merge
+from operator import itemgetter
+
+# The most values to pass to a single query (e.g. for pk__in lookups).
+BATCH_SIZE = 500
+
+class GeneratorChanges(object):
+    """
+    The changes that saving a generator would make to its occurrences, as
+    computed by GeneratorModel.plan_changes():
+
+    shifted is a list of (pk, old start, new start) for the occurrences that
+    would be timeshifted (or just have their duration changed).
+
+    added is a list of the starts of the occurrences that would be generated.
+    If settings.MATERIALISE_GENERATED_OCCURRENCES is False, they aren't
+    stored, so they are listed in virtual instead (see
+    OccurrenceQSFN.between_with_virtual()).
+
+    deleted and unhooked are lists of (pk, start) for the occurrences that are
+    no longer generated, and would be deleted, or unhooked from the generator
+    if there is something FKed to them that is protecting them.
+
+    The starts in added, virtual, deleted and unhooked are after any
+    timeshift.
+    """
+    def __init__(self, generator, after=None, until=None):
+        self.generator = generator
+        self.after = after
+        self.until = until
+        self.start_shift = timedelta(0)
+        self.duration_changed = False
+        self.shifted = []
+        self.added = []
+        self.virtual = []
+        self.deleted = []
+        self.unhooked = []
+
+    def __nonzero__(self):
+        # (virtual occurrences don't change what is stored)
+        return bool(self.shifted or self.added or self.deleted or self.unhooked)
+
+    def clashes(self, occurrences):
+        """
+        Returns a list of (start, occurrence) for the occurrences that would
+        be added (or appear virtually) or timeshifted to `start` and would
+        clash with (overlap) one
+        of the given occurrences, e.g. to warn about clashes at a venue before
+        saving the generator:
+
+            changes = generator.plan_changes()
+            clashes = changes.clashes(
+                Occurrence.objects.filter(event__venue=venue))
+
+        Each clashing occurrence is given as a (start, end, event_id, pk)
+        tuple, as by OccurrenceQSFN.find_overlaps(). The occurrences that these
+        changes would move or remove are ignored. Occurrences that only touch
+        don't clash.
+        """
+        starts = sorted(set(self.added) | set(self.virtual) |
+            set(start for pk, old_start, start in self.shifted))
+        if not starts:
+            return []
+        duration = self.generator.duration
+        event_id = self.generator.event_id
+        planned = [(start, start + duration, event_id, None) for start in starts]
+        moving = set(pk for pk, old_start, start in self.shifted) | \
+            set(pk for pk, start in self.deleted + self.unhooked)
+        existing = (
+            span for span in occurrences
+                .overlapping(starts[0], starts[-1] + duration)
+                .order_by('start').values_list('start', '_end', 'event_id', 'pk')
+                .iterator()
+            if span[3] not in moving
+        )
+        clashes = []
+        for earlier, later in sweep_overlaps(merge(planned, existing)):
+            # (only between a planned and an existing occurrence)
+            if (earlier[3] is None) != (later[3] is None):
+                if earlier[3] is None:
+                    clashes.append((earlier[0], later))
+                else:
+                    clashes.append((later[0], earlier))
+        return clashes
+
+    def __repr__(self):
+        return "<GeneratorChanges: %s shifted, %s added, %s virtual, %s deleted, %s unhooked>" % (
+            len(self.shifted), len(self.added), len(self.virtual),
+            len(self.deleted), len(self.unhooked))
+
+class GeneratorManager(XTimespanManager):
+
+    def bulk_create_with_occurrences(self, generators, chunk_size=5000,
+        progress=None):
+        """
+        Creates the given (unsaved) generators and their occurrences, e.g. to
+        import a season's schedule, much faster than saving the generators one
+        at a time.
+
+        Their events and rules are fetched in a query each, and the generators
+        are saved individually (to get their pks), in one transaction. All
+        their rules are then expanded, and clashes and exclusions resolved, in
+        memory, in the same way as save() would (the generators are taken in
+        order, so where two generators of an event clash, the first one wins).
+        Finally the occurrences are written with bulk_create, in a transaction
+        per `chunk_size` occurrences. So apart from the saves, the number of
+        queries doesn't grow with the number of generators.
+
+        `progress`, if given, is called as progress(created, total) after each
+        chunk is written.
+
+        occurrences_changed is sent once per generator, with the ids of its
+        occurrences as `added`, if anything is listening.
+
+        Unlike save(), this ignores settings.GENERATION_MODE, and doesn't
+        cascade to the events' other generators (there is nothing released for
+        them to fill). Returns the number of occurrences created.
+        """
+        generators = list(generators)
+        if not generators:
+            return 0
+
+        # (rather than a query per generator for each)
+        events = self.model.EventModel()._event_manager.in_bulk(
+            set(g.event_id for g in generators if g.event_id is not None))
+        rules = self.model._meta.get_field('rule').rel.to._default_manager \
+            .in_bulk(set(g.rule_id for g in generators if g.rule_id is not None))
+        for generator in generators:
+            if generator.event_id in events:
+                generator.event = events[generator.event_id]
+            if generator.rule_id in rules:
+                generator.rule = rules[generator.rule_id]
+
+        with transaction.commit_on_success():
+            for generator in generators:
+                if not getattr(generator, 'is_clean', False):
+                    generator.clean(ExceptionClass=AttributeError)
+                generator.generated_until = generator._generation_limit()
+                super(GeneratorModel, generator).save()
+
+        if not settings.MATERIALISE_GENERATED_OCCURRENCES:
+            return 0
+
+        OccurrenceModel = self.model.OccurrenceModel()
+
+        # The (event tree, left value) of the occurrences that already exist,
+        # by start, so we can tell if an occurrence is in an event's listing.
+        taken = {}
+        for tree_id, lft, start in OccurrenceModel.objects.filter(
+            event_tree_id__in=set(e.tree_id for e in events.values()),
+            start__gte=min(g.start for g in generators),
+        ).values_list('event_tree_id', 'event_lft', 'start'):
+            taken.setdefault(start, []).append((tree_id, lft))
+
+        exclusions = set(self.model.EventModel().ExclusionModel().objects
+            .filter(event__in=events.keys()).values_list('event_id', 'start'))
+
+        occurrences = []
+        for generator in generators:
+            event = events[generator.event_id]
+            for start in generator._generate_dates(
+                until=generator.generated_until):
+                if (event.pk, start) in exclusions:
+                    continue
+                if any(
+                    tree_id == event.tree_id and event.lft <= lft <= event.rght
+                    for tree_id, lft in taken.get(start, [])
+                ):
+                    continue
+                taken.setdefault(start, []).append((event.tree_id, event.lft))
+                occurrences.append(OccurrenceModel(
+                    event_id=event.pk, generated_by_id=generator.pk,
+                    start=start, _duration=generator._duration,
+                ))
+
+        for i in range(0, len(occurrences), chunk_size):
+            with transaction.commit_on_success():
+                OccurrenceModel.objects.bulk_create(
+                    occurrences[i:i+chunk_size])
+            if progress is not None:
+                progress(min(i + chunk_size, len(occurrences)),
+                    len(occurrences))
+
+        if occurrences_changed.receivers:
+            # (events' summaries are refreshed once, not per generator)
+            with summaries_deferred():
+                for i in range(0, len(generators), BATCH_SIZE):
+                    added = {}
+                    for generator_id, pk in OccurrenceModel.objects.filter(
+                        generated_by__in=generators[i:i+BATCH_SIZE]
+                    ).values_list('generated_by_id', 'pk'):
+                        added.setdefault(generator_id, []).append(pk)
+                    for generator in generators[i:i+BATCH_SIZE]:
+                        generator._send_occurrences_changed(
+                            added=added.get(generator.pk, []))
+        return len(occurrences)
 
 class GeneratorModel(XTimespanModel):
     """
@@ -25,6 +228,9 @@ class GeneratorModel(XTimespanModel):
     
     save() generates Occurrences.
     
+    plan_changes() lists the Occurrences that save() would add, delete, unhook
+    or timeshift, without changing anything, e.g. to preview an edit.
+    
     clean() makes sure the Generator has valid values (and is called by admin
     before the instance is saved)
        
@@ -32,7 +238,13 @@ class GeneratorModel(XTimespanModel):
     generator. It's not great at the moment and might be replaced or deprecated
     in favour of a hand-written description in the Event.
     
+    extend_to() generates Occurrences up to a later date, without regenerating
+    the ones that have already been generated.
+
     EventModel() returns the Model of the Event that this Generator links to.
+
+    objects.bulk_create_with_occurrences() creates many generators and their
+    Occurrences at once, e.g. for importing schedules.
     """
 
     #define a FK called 'event' in the subclass
@@ -44,6 +256,14 @@ class GeneratorModel(XTimespanModel):
             "occurrences will be created."
         )
     )
+    # The date up to which occurrences have been generated. Endless generators
+    # are extended from here, rather than regenerated from the start.
+    generated_until = models.DateField(
+        null=True, blank=True, editable=False,
+        verbose_name=_('generated until'),
+    )
+
+    objects = GeneratorManager()
 
     class Meta:
         abstract = True
@@ -57,6 +277,10 @@ class GeneratorModel(XTimespanModel):
     @classmethod
     def EventModel(cls):
         return cls._meta.get_field('event').rel.to
+
+    @classmethod
+    def OccurrenceModel(cls):
+        return cls.occurrences.related.model
         
     def clean(self, ExceptionClass=exceptions.ValidationError):
         super(GeneratorModel, self).clean()
@@ -72,8 +296,9 @@ class GeneratorModel(XTimespanModel):
     @transaction.commit_on_success()
     def save(self, *args, **kwargs):
         """
-        Generally (and for a combination of field changes), we take a
-        two-pass approach:
+        Saving applies the changes that plan_changes() computes (see there for
+        the rules), so previewing and saving can't disagree. Generally (and for
+        a combination of field changes), we take a two-pass approach:
     
          1) First update existing occurrences to match update-compatible fields.
          2) Then synchronise the candidate occurrences with the existing
@@ -84,7 +309,14 @@ class GeneratorModel(XTimespanModel):
                 the generator.
 
         Finally, we also update other generators, because they might have had
-        clashing occurrences which no longer clash.
+        clashing occurrences which no longer clash. Only the starts that this
+        generator has released (by moving or deleting its occurrences) are
+        offered to the other generators, and only those whose rules hit them
+        generate anything.
+
+        If settings.GENERATION_MODE isn't 'immediate', the generator is saved
+        and all of the above is left to a background job (see
+        eventtools.generation).
         """
         
         cascade = kwargs.pop('cascade', True)
@@ -94,32 +326,92 @@ class GeneratorModel(XTimespanModel):
             # we do it here.
             self.clean(ExceptionClass=AttributeError)
         
-        # Occurrences updates/generates
-        if self.pk:
-            self._update_existing_occurrences() # need to do this before save, so we can detect changes
-        r = super(GeneratorModel, self).save(*args, **kwargs)
-        self._sync_occurrences() #need to do this after save, so we have a pk to hang new occurrences from.
-    
-        # finally, we should also update other generators, because they might 
-        # have had clashing occurrences
-        if cascade:
-            for generator in self.event.generators.exclude(pk=self.pk):
-                generator.save(cascade=False)
+        if settings.GENERATION_MODE != 'immediate':
+            # Record a job to generate occurrences later, with the state that
+            # my occurrences currently reflect.
+            saved = self._saved_timespan()
+            r = super(GeneratorModel, self).save(*args, **kwargs)
+            generation.defer(self, saved)
+            return r
+
+        # The other generators of the event share my snapshot of its schedule,
+        # and its summary is refreshed once.
+        with schedule_snapshot(self.event), summaries_deferred():
+            # Occurrences updates/generates
+            changes = self.plan_changes() # need to do this before save, so we can detect changes
+            self.generated_until = changes.until
+            r = super(GeneratorModel, self).save(*args, **kwargs)
+            released = self._apply_changes(changes) #need to do this after save, so we have a pk to hang new occurrences from.
+        
+            # finally, we should also update other generators, because they might 
+            # have had clashing occurrences
+            if cascade and released:
+                for generator in self.event.generators.exclude(pk=self.pk) \
+                    .select_related('rule'):
+                    generator.event = self.event
+                    generator._fill_starts(released)
         
         return r
         
-    def _generate_dates(self):
-        drop_dead_date = datetime.combine(self.repeat_until or date.today() \
-            + settings.DEFAULT_GENERATOR_LIMIT, time.max)
+    @transaction.commit_on_success()
+    def extend_to(self, until=None):
+        """
+        Generates occurrences from the date I was last generated until, up to
+        and including the date `until` or repeat_until, whichever is earlier
+        (by default, repeat_until, or for endless generators, the generator
+        limit from today).
+
+        Only the new part of the series is synchronised, so it is much cheaper
+        than save() for extending endless generators. If I've never been
+        generated, then the whole series is synchronised.
+        """
+        until = self._generation_limit(until)
+        if self.generated_until is not None and until <= self.generated_until:
+            return
+
+        changes = GeneratorChanges(self, after=self.generated_until, until=until)
+        self._apply_changes(self._plan_sync(changes))
+        type(self).objects.filter(pk=self.pk).update(generated_until=until)
+        self.generated_until = until
+
+    def _generation_limit(self, until=None):
+        """
+        Returns the last date that occurrences should be generated for:
+        repeat_until, or for endless generators, the generator limit from
+        today. An explicit `until` is clamped to repeat_until.
+        """
+        if self.repeat_until:
+            if until is None:
+                return self.repeat_until
+            return min(until, self.repeat_until)
+        if until is None:
+            return date.today() + settings.DEFAULT_GENERATOR_LIMIT
+        return until
+
+    def _generate_dates(self, after=None, until=None):
+        """
+        Yields the rule's occurrence datetimes that fall after the date
+        `after` (if given), up to and including the date `until` (by default,
+        the generation limit).
+        """
+        drop_dead_date = datetime.combine(
+            until or self._generation_limit(), time.max)
 
         # We may need a timezone-aware datetime if our rule generates
         # non-naive datetime occurrences
         drop_dead_date_with_tzinfo = drop_dead_date.replace(
             tzinfo=get_current_timezone())
 
-        # Yield rule's occurrence datetimes up until "drop dead" date(time)
-        rule = self.rule.get_rrule(dtstart=localtime(self.start))
-        date_iter = iter(rule)
+        # Yield rule's occurrence datetimes up until "drop dead" date(time).
+        # Simple rules are expanded in one go if NumPy is available (a day
+        # further than needed, since the cut-off below may compare aware
+        # datetimes).
+        dtstart = localtime(self.start)
+        dates = fastrrule.expand(self.rule.compiled(), dtstart,
+            drop_dead_date + timedelta(days=1))
+        if dates is None:
+            dates = self.rule.get_rrule(dtstart=dtstart)
+        date_iter = iter(dates)
         while True:
             d = date_iter.next()
             if d.tzinfo:
@@ -128,11 +420,18 @@ class GeneratorModel(XTimespanModel):
                 dddate = drop_dead_date
             if d > dddate:
                 break
+            if after is not None and d.date() <= after:
+                continue
             yield d
     
-    @transaction.commit_on_success()
-    def _update_existing_occurrences(self):
+    def plan_changes(self):
         """
+        Returns a GeneratorChanges, listing the occurrences that saving me
+        would timeshift, add, delete, or unhook from me, compared with what is
+        in the database. Nothing is written, and the number of queries doesn't
+        depend on the number of occurrences (other than to look up protected
+        occurrences in batches).
+
         When you change a generator and save it, it updates existing occurrences
         according to the following rules:
         
@@ -156,17 +455,7 @@ class GeneratorModel(XTimespanModel):
          * Occurrences that are removed are deleted or unhooked, for reasons
            described above.
         """
-        
-        """
-        Pass 1)
-        if start date or time is changed:
-            update the start times of my occurrences
-        if end date or time is changed:
-            update the end times of my occurrences
 
-        Pass 2 is in _sync_occurrences, below.
-        """
-        
         # TODO: it would be ideal to minimise the consequences of shifting one
         # occurrence to replace another - ie to leave most occurrences untouched 
         # and to create only new ones and unhook ungenerated ones.
@@ -175,31 +464,47 @@ class GeneratorModel(XTimespanModel):
         # date to before the old start date. For now we'll just update the dates
         # and times.
 
-        saved_self = type(self).objects.get(pk=self.pk)
-        
-        start_shift = self.start - saved_self.start
-        duration_changed = self._duration != saved_self._duration
-
-        if start_shift or duration_changed:
-            # Update occurrences in opposite direction to the adjustment of the
-            # 'start' field, to avoid updating an occurrence to clash with an
-            # existing one's (event_id, start) DB uniqueness constraint (#606)
-            if start_shift.total_seconds() >= 0:
-                start_order_by = '-start'  # Moving to future, start from latest
-            else:
-                start_order_by = 'start'  # Moving to past, start from earliest
+        return self._plan_changes(self._saved_timespan())
 
-            for o in self.occurrences.order_by(start_order_by):
-                o.start += start_shift
-                o._duration = self._duration
-                o.save()
+    def _saved_timespan(self):
+        """
+        Returns my (start, _duration) as saved in the database, or None.
+        """
+        if self.pk:
+            return EventScheduleSnapshot.for_generator(self) \
+                .saved_timespan(self)
+        return None
 
-    
-    @transaction.commit_on_success()
-    def _sync_occurrences(self):
-    
+    def _plan_changes(self, since):
+        """
+        Plans the changes, given the (start, _duration) that my occurrences
+        currently reflect (None if they have not been generated).
+        """
+        changes = GeneratorChanges(self, until=self._generation_limit())
+        if since is not None:
+            saved_start, saved_duration = since
+            changes.start_shift = self.start - saved_start
+            changes.duration_changed = self._duration != saved_duration
+        return self._plan_sync(changes)
+
+    def _regenerate(self, since):
+        """
+        Brings my occurrences up to date with my saved state, given the
+        (start, _duration) that they currently reflect. This is how deferred
+        generation jobs are processed (see eventtools.generation).
+
+        Returns the set of starts that my occurrences no longer occupy.
+        """
+        changes = self._plan_changes(since)
+        type(self).objects.filter(pk=self.pk) \
+            .update(generated_until=changes.until)
+        self.generated_until = changes.until
+        return self._apply_changes(changes)
+
+    def _plan_sync(self, changes):
         """
-        Pass 2)
+        Fills in the given changes, which say whether my occurrences are to be
+        timeshifted, with the occurrences to add, delete or unhook.
 
         Generate a list of candidate occurrences.
         * For candidate occurrences that exist, do nothing.
@@ -208,12 +513,14 @@ class GeneratorModel(XTimespanModel):
           generator if they are protected by a Foreign Key.
             
         In detail:
-        Get a list, A, of already-generated occurrences.
+        Get a list, A, of already-generated occurrences (at their starts after
+        any timeshift).
         
         Generate candidate Occurrences.
         For each candidate Occurrence:
             if it exists for the event:
-                if I created it, unhook, and remove from the list A.
+                if I created it, and it isn't excluded, remove it from the
+                list A.
                 else do nothing
             if it is an exclusion, do nothing
             otherwise create it.
@@ -221,12 +528,56 @@ class GeneratorModel(XTimespanModel):
         The items remaining in list A are 'orphan' occurrences, that were
         previously generated, but would no longer be. These are unhooked from
         the generator.
+
+        The existing occurrence starts and the exclusions are read from a
+        snapshot of the event's schedule (see eventtools.snapshot), which is
+        shared with other generators of the event that are being saved
+        together, and the candidates are compared against them in memory, so
+        the number of queries doesn't depend on the number of candidates.
+
+        If changes.after is given, only the occurrences after that date are
+        synchronised (see extend_to).
         """
-        
-        all_occurrences = self.event.occurrences_in_listing().all() #regardless of generator
-        existing_but_not_regenerated = set(self.occurrences.all()) #generated by me only
+        after = changes.after
+        snapshot = EventScheduleSnapshot.for_generator(self, after)
+        taken = snapshot.taken #regardless of generator
+        exclusions = snapshot.exclusions
+
+        #generated by me only
+        mine = {}
+        if self.pk is not None:
+            mine = snapshot.generated_by(self)
+            if after is not None:
+                # a shared snapshot may have earlier occurrences too
+                after_end = after_datetime(after)
+                mine = dict(
+                    (pk, o) for pk, o in mine.items() if o[0] > after_end)
 
-        for start in self._generate_dates():
+        # Move my occurrences to their starts after any timeshift, without
+        # changing the snapshot.
+        moved = {}
+        if changes.start_shift or changes.duration_changed:
+            shift = changes.start_shift
+            changes.shifted = [
+                (pk, start, start + shift) for pk, (start, event_id)
+                in sorted(mine.items(), key=itemgetter(1))
+            ]
+            mine = dict(
+                (pk, (start + shift, event_id))
+                for pk, (start, event_id) in mine.items()
+            )
+            if shift:
+                for pk, (start, event_id) in mine.items():
+                    moved.setdefault(start, []).append((pk, event_id))
+
+        def occurrences_at(start):
+            if not moved:
+                return taken.get(start, [])
+            return [o for o in taken.get(start, []) if o[0] not in mine] + \
+                moved.get(start, [])
+
+        existing_but_not_regenerated = set(mine)
+        for start in self._generate_dates(after=after, until=changes.until):
             # if the proposed occurrence exists, then don't make a new one.
             # However, if it belongs to me: 
             #       and if it is marked as an exclusion:
@@ -234,42 +585,253 @@ class GeneratorModel(XTimespanModel):
             #       else:
             #           remove it from the set of existing_but_not_regenerated
             #           occurrences so it stays hooked up
+            existing = occurrences_at(start)
+            if existing:
+                for pk, event_id in existing:
+                    if pk in mine and (event_id, start) not in exclusions:
+                        existing_but_not_regenerated.discard(pk)
+                continue
+
+            # if the proposed occurrence is an exclusion, don't save it.
+            if (self.event_id, start) in exclusions:
+                continue
+
+            #OK, we're good to create the occurrence (or it is virtual).
+            if settings.MATERIALISE_GENERATED_OCCURRENCES:
+                changes.added.append(start)
+            else:
+                changes.virtual.append(start)
+
+        # Finally, any unaccounted-for occurrences are deleted. If we can't
+        # delete, due to protection set by FKs to it, then unhook it instead.
+        orphans = sorted(existing_but_not_regenerated, key=mine.get)
+        protected = set()
+        for i in range(0, len(orphans), BATCH_SIZE):
+            protected |= self.OccurrenceModel().protected_pks(
+                orphans[i:i+BATCH_SIZE])
+        for pk in orphans:
+            if pk in protected:
+                changes.unhooked.append((pk, mine[pk][0]))
+            else:
+                changes.deleted.append((pk, mine[pk][0]))
+        return changes
+
+    def _apply_changes(self, changes):
+        """
+        Makes the changes planned by plan_changes() (or by extend_to()).
+
+        Returns the set of starts that my occurrences no longer occupy (and so
+        are free for other generators to fill).
+        """
+        snapshot = EventScheduleSnapshot.active(self.event)
+        released = set()
+        if changes.shifted:
+            released |= self._timeshift_occurrences(changes)
+
+        added = []
+        if changes.added:
+            added = self._create_occurrences(changes.added)
+            if snapshot is not None:
+                snapshot.record_added(self, changes.added)
+
+        # (the plan has already found which are protected)
+        deleted, unhooked = self._remove_occurrences(
+            [pk for pk, start in changes.deleted + changes.unhooked],
+            protected=set(pk for pk, start in changes.unhooked))
+        removed = set(start for pk, start in deleted)
+        released |= removed
+
+        if snapshot is not None:
+            snapshot.record_changes(changes, removed)
+
+        self._send_occurrences_changed(
+            added=added,
+            updated=[pk for pk, old_start, start in changes.shifted],
+            unhooked=[pk for pk, start in unhooked],
+            deleted=[pk for pk, start in deleted],
+        )
+        return released
+
+    def _create_occurrences(self, starts):
+        """
+        Creates my occurrences at the given starts, with one bulk INSERT.
 
+        Returns the ids of the new occurrences, if anything is listening to
+        occurrences_changed (otherwise they aren't looked up).
+        """
+        OccurrenceModel = self.OccurrenceModel()
+        OccurrenceModel.objects.bulk_create([
+            OccurrenceModel(
+                event=self.event, generated_by=self, start=start,
+                _duration=self._duration
+            ) for start in starts
+        ])
+        if not occurrences_changed.receivers:
+            return []
+        ids = []
+        for i in range(0, len(starts), BATCH_SIZE):
+            ids.extend(self.occurrences.filter(start__in=starts[i:i+BATCH_SIZE])
+                .values_list('pk', flat=True))
+        return ids
+
+    def _send_occurrences_changed(self, added=(), updated=(), unhooked=(),
+        deleted=()):
+        """
+        Sends occurrences_changed once, if any of my occurrences changed.
+        """
+        if added or updated or unhooked or deleted:
+            occurrences_changed.send(
+                sender=self.OccurrenceModel(), generator=self,
+                added=list(added), updated=list(updated),
+                unhooked=list(unhooked), deleted=list(deleted),
+            )
+
+    def _timeshift_occurrences(self, changes):
+        """
+        Shifts the start of my occurrences by changes.start_shift, and sets
+        their duration to mine, with a few set-based UPDATEs. If the database
+        can't do that, fall back to updating the occurrences one at a time.
+
+        Per-occurrence signals are not sent in bulk (and are only sent one at
+        a time if settings.GENERATOR_ROW_SIGNALS); _apply_changes() sends
+        occurrences_changed with the ids of the updated occurrences.
+
+        Returns the set of starts that my occurrences no longer occupy.
+        """
+        start_shift = changes.start_shift
+        if start_shift:
+            sid = transaction.savepoint()
             try:
-                o = all_occurrences.filter(start=start)[0]
-                if o.generated_by == self:
-                    if not o.is_exclusion():
-                        existing_but_not_regenerated.discard(o)
+                self._bulk_timeshift(start_shift)
+            except (DatabaseError, NotImplementedError):
+                # (without savepoints, some of the UPDATEs may have been made,
+                # so the ordered timeshift sets each occurrence's planned
+                # start, rather than shifting where it is now)
+                transaction.savepoint_rollback(sid)
+                self._ordered_timeshift(changes)
+            else:
+                transaction.savepoint_commit(sid)
+        else:
+            self.occurrences.update(_duration=self._duration,
+                _end=models.F('start') + self.duration)
+
+        return set(old_start for pk, old_start, start in changes.shifted) - \
+            set(start for pk, old_start, start in changes.shifted)
+
+    def _bulk_timeshift(self, start_shift):
+        """
+        Shifting every occurrence in one UPDATE may momentarily clash with the
+        (event_id, start) uniqueness constraint, since rows are checked as
+        they are updated. So we take two passes: first move all my
+        occurrences past both the latest occurrence in the table and the
+        latest of their final starts, where they can't clash with anything,
+        then move them to their final starts.
+        """
+        OccurrenceModel = self.occurrences.model
+        latest = OccurrenceModel.objects.aggregate(
+            latest=models.Max('start'))['latest']
+        mine = self.occurrences.aggregate(
+            earliest=models.Min('start'), latest=models.Max('start'))
+        if mine['earliest'] is None:
+            return
+        offset = max(latest, mine['latest'] + start_shift) - \
+            mine['earliest'] + timedelta(days=1)
+
+        self.occurrences.update(start=models.F('start') + offset)
+        self.occurrences.update(
+            start=models.F('start') + (start_shift - offset),
+            _duration=self._duration,
+        )
+        # (in a separate UPDATE, since some databases set columns in turn)
+        self.occurrences.update(_end=models.F('start') + self.duration)
+
+    def _ordered_timeshift(self, changes):
+        # Update occurrences in opposite direction to the adjustment of the
+        # 'start' field, to avoid updating an occurrence to clash with an
+        # existing one's (event_id, start) DB uniqueness constraint (#606)
+        starts = dict((pk, start) for pk, old_start, start in changes.shifted)
+        if changes.start_shift.total_seconds() >= 0:
+            start_order_by = '-start'  # Moving to future, start from latest
+        else:
+            start_order_by = 'start'  # Moving to past, start from earliest
+
+        for o in self.occurrences.order_by(start_order_by):
+            if o.pk not in starts:
                 continue
-            except IndexError:
-                # no occurrence exists yet.
-                pass
+            o.start = starts[o.pk]
+            o._duration = self._duration
+            if settings.GENERATOR_ROW_SIGNALS:
+                o.save()
+            else:
+                type(o)._base_manager.filter(pk=o.pk).update(
+                    start=o.start, _duration=o._duration, _end=o.end())
 
-            # if the proposed occurrence is an exclusion, don't save it.
-            if self.event.exclusions.filter(
-                event=self.event, start=start
-            ).count():
-                continue            
-
-            #OK, we're good to create the occurrence.
-            o = self.occurrences.create(event=self.event, start=start, _duration=self._duration)
-#            print "created %s" % o
-            #implied generated_by = self
     
-        # Finally, delete any unaccounted_for occurrences. If we can't delete, due to protection set by FKs to it, then
-        # unhook it instead.
-        for o in existing_but_not_regenerated:
-#            print "deleting %s" % o
-            o.delete()
+    def _remove_occurrences(self, pks, protected=None):
+        """
+        Deletes my occurrences with the given pks in bulk, or unhooks them if
+        there is something FKed to them that is protecting them (whose pks
+        can be given as `protected`, if they're already known).
 
+        Returns two lists of the (pk, start) of the deleted and the unhooked
+        occurrences.
+        """
+        pks = list(pks)
+        deleted, unhooked = [], []
+        # Keep the number of query parameters within the database's limits.
+        for i in range(0, len(pks), BATCH_SIZE):
+            d, u = self.occurrences.filter(pk__in=pks[i:i+BATCH_SIZE]) \
+                .delete_or_unhook(send_signals=settings.GENERATOR_ROW_SIGNALS,
+                    protected=protected)
+            deleted.extend(d)
+            unhooked.extend(u)
+        return deleted, unhooked
+
+    @transaction.commit_on_success()
+    def _fill_starts(self, starts):
+        """
+        Generates occurrences at those of the given starts that my rule hits,
+        unless they are already taken or excluded. This is how a generator
+        picks up the starts that another generator of the event has released.
+        """
+        if not starts or not settings.MATERIALISE_GENERATED_OCCURRENCES:
+            return
+        after = localtime(min(starts)).date() - timedelta(1)
+        until = localtime(max(starts)).date()
+        until = min(until, self.generated_until or self._generation_limit())
+
+        hits = [
+            d for d in self._generate_dates(after=after, until=until)
+            if d in starts
+        ]
+
+        if not hits:
+            return
+
+        # (The snapshot is shared if the generators are being saved together.)
+        snapshot = EventScheduleSnapshot.for_generator(self)
+        new_starts = [
+            start for start in hits if not snapshot.taken.get(start)
+            and not snapshot.is_excluded(self.event_id, start)
+        ]
+
+        added = self._create_occurrences(new_starts)
+        snapshot.record_added(self, new_starts)
+        self._send_occurrences_changed(added=added)
+
+    @transaction.commit_on_success()
     def delete(self, *args, **kwargs):
         """
         If I am deleted, then cascade to my Occurrences, UNLESS there is is something FKed to them that is protecting them,
         in which case the FK is set to NULL.
         """
-        for o in self.occurrences.all():
-            o.delete()
-
+        with summaries_deferred():
+            deleted, unhooked = self.occurrences.all().delete_or_unhook(
+                send_signals=settings.GENERATOR_ROW_SIGNALS)
+            self._send_occurrences_changed(
+                unhooked=[pk for pk, start in unhooked],
+                deleted=[pk for pk, start in deleted],
+            )
         super(GeneratorModel,self).delete(*args, **kwargs)
 
     def robot_description(self):
@@ -1,24 +1,33 @@
 from vobject.icalendar import utc
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.safestring import mark_safe
 from django.core.urlresolvers import reverse
 from django.db.models import signals
 from django.db.models.base import ModelBase
+from django.db.models.deletion import Collector, ProtectedError
+from django.db.models import sql
 from django.template.defaultfilters import urlencode
 from django.utils.dateformat import format
-from django.utils.timezone import make_aware, localtime
+from django.utils.timezone import make_aware, localtime, is_naive, \
+    get_current_timezone
 from django.utils.translation import ugettext as _
 from eventtools.models.xtimespan import XTimespanModel, XTimespanQSFN, XTimespanQuerySet, XTimespanManager
 from eventtools.conf import settings
+from eventtools.models.generator import BATCH_SIZE
+from eventtools.snapshot import EventScheduleSnapshot
+from eventtools.models.summary import summaries_deferred
 
 from eventtools.utils import datetimeify, dayify
+from eventtools.utils.intervals import sweep_overlaps
 from eventtools.utils.managertype import ManagerType
 
 import datetime
 from dateutil.tz import gettz
+from itertools import groupby
+from operator import itemgetter
 
 
 
@@ -33,6 +42,39 @@ dateranges.dates_in_week_of(day) # a generator
 
 """
 
+def _delete(queryset, send_signals=True):
+    """
+    Deletes the queryset. If send_signals is False, and nothing else needs to
+    be deleted or updated along with it, it is deleted without sending
+    pre_delete and post_delete signals.
+    """
+    if send_signals:
+        return queryset.delete()
+    collector = Collector(using=queryset.db)
+    collector.collect(queryset)
+    if collector.data.keys() == [queryset.model] and not collector.batches \
+        and not collector.field_updates:
+        sql.DeleteQuery(queryset.model).delete_batch(
+            [o.pk for o in collector.data[queryset.model]], queryset.db)
+        transaction.commit_unless_managed(using=queryset.db)
+    else:
+        collector.delete()
+
+def event_trees(EventModel, pks):
+    """
+    Returns a dictionary of pk: (tree_id, lft) for the events with the given
+    pks, in a query per BATCH_SIZE events.
+    """
+    pks = [pk for pk in pks if pk is not None]
+    mptt = EventModel._mptt_meta
+    trees = {}
+    for i in range(0, len(pks), BATCH_SIZE):
+        for pk, tree_id, lft in EventModel._event_manager.order_by() \
+            .filter(pk__in=pks[i:i+BATCH_SIZE]) \
+            .values_list('pk', mptt.tree_id_attr, mptt.left_attr):
+            trees[pk] = (tree_id, lft)
+    return trees
+
 class OccurrenceQSFN(XTimespanQSFN):
     """
     All the query functions are defined here, so they can be easily introspected
@@ -59,8 +101,191 @@ class OccurrenceQSFN(XTimespanQSFN):
     def cancelled(self):
         return self.filter(status=settings.OCCURRENCE_STATUS_CANCELLED[0])
 
+    def between_with_virtual(self, d1, d2, generators=None):
+        """
+        Returns a list of the occurrences in this queryset that start between
+        d1 and d2, merged (in start order) with 'virtual' occurrences: unsaved
+        occurrences computed from generators' rules, which are not (yet)
+        stored in the database.
+
+        This is how to list occurrences when
+        settings.MATERIALISE_GENERATED_OCCURRENCES is False, and generators
+        don't store their occurrences ahead of time.
+
+        By default, all generators are expanded. The virtual occurrences are
+        not filtered by this queryset, so pass the generators that are
+        relevant to it, e.g. for an event's listing:
+
+            event.occurrences_in_listing().between_with_virtual(d1, d2,
+                generators=event.GeneratorModel().objects.filter(
+                    event__in=event.get_descendants(include_self=True)))
+
+        Virtual occurrences are not generated if an occurrence already exists
+        at the same start in the generator event's listing (stored occurrences
+        override virtual ones), or if the start is excluded.
+
+        Use is_virtual() to tell them apart, and materialise() to store one
+        when something needs to refer to it.
+        """
+        lo = datetimeify(d1, clamp="min")
+        hi = datetimeify(d2, clamp="max")
+        if settings.USE_TZ:
+            if is_naive(lo):
+                lo = make_aware(lo, get_current_timezone())
+            if is_naive(hi):
+                hi = make_aware(hi, get_current_timezone())
+
+        stored = list(self.filter(start__gte=lo, start__lte=hi))
+
+        if generators is None:
+            generators = self.model.GeneratorModel().objects.all()
+        generators = list(generators.select_related('rule', 'event'))
+        if not generators:
+            return stored
+
+        # The (event tree, left value) of all stored occurrences in the
+        # window, by start, so we can tell if an occurrence already exists in
+        # a generator event's listing.
+        tree_ids = set(g.event.tree_id for g in generators)
+        taken = {}
+        for tree_id, lft, start in self.model.objects \
+            .filter(event_tree_id__in=tree_ids, start__gte=lo, start__lte=hi) \
+            .values_list('event_tree_id', 'event_lft', 'start'):
+            taken.setdefault(start, []).append((tree_id, lft))
+
+        exclusions = set(self.model.EventModel().ExclusionModel().objects
+            .filter(event__in=set(g.event_id for g in generators),
+                start__gte=lo, start__lte=hi)
+            .values_list('event_id', 'start'))
+
+        virtual = []
+        for g in generators:
+            event = g.event
+            for start in g._generate_dates(
+                after=localtime(lo).date() - datetime.timedelta(1),
+                until=g._generation_limit(localtime(hi).date()),
+            ):
+                if not lo <= start <= hi:
+                    continue
+                if (event.pk, start) in exclusions:
+                    continue
+                if any(
+                    tree_id == event.tree_id and event.lft <= lft <= event.rght
+                    for tree_id, lft in taken.get(start, [])
+                ):
+                    continue
+                taken.setdefault(start, []).append((event.tree_id, event.lft))
+                virtual.append(self.model(
+                    event=event, generated_by=g, start=start,
+                    _duration=g._duration,
+                ))
+
+        return sorted(stored + virtual, key=lambda o: (o.start, o.event_id))
+
+    def find_overlaps(self, group_by=None):
+        """
+        Yields the pairs of occurrences in this queryset that overlap (i.e.
+        clash), as pairs of (start, end, event_id, pk) tuples, e.g. to check a
+        season's schedule before publishing it:
+
+            upcoming = Occurrence.objects.forthcoming()
+            for earlier, later in upcoming.find_overlaps(group_by='event__venue'):
+                ...
+
+        If group_by (a field lookup) is given, only occurrences with the same
+        value for it are compared. Occurrences that only touch don't clash.
+
+        The occurrences are streamed from one query, sorted by (group and)
+        start, and compared with a sweep line, in O(n log n + k) time for k
+        pairs (see eventtools.utils.intervals.sweep_overlaps). This uses the
+        stored ends, so backfill them first (see update_ends).
+        """
+        fields = ('start', '_end', 'event_id', 'pk')
+        if group_by is None:
+            for pair in sweep_overlaps(
+                self.order_by('start').values_list(*fields).iterator()):
+                yield pair
+            return
+        rows = self.order_by(group_by, 'start') \
+            .values_list(group_by, *fields).iterator()
+        for group, group_rows in groupby(rows, itemgetter(0)):
+            for pair in sweep_overlaps(row[1:] for row in group_rows):
+                yield pair
+
 class OccurrenceQuerySet(XTimespanQuerySet, OccurrenceQSFN):
-    pass #all the goodness is inherited from OccurrenceQuerySetFN
+    # all the goodness is inherited from OccurrenceQuerySetFN, except for bulk
+    # changes, which aren't injected into the manager.
+
+    def delete_or_unhook(self, send_signals=True, protected=None):
+        """
+        Deletes these occurrences, except for those that are protected by a
+        ForeignKey with on_delete=PROTECT (e.g. tickets), directly or through
+        a cascade (see protected_pks()), which are unhooked from their
+        generators (made one-off) instead. This is what Occurrence.delete()
+        does, but with a few queries per batch of occurrences rather than per
+        occurrence.
+
+        If the protected pks are already known (e.g. from a generator's
+        plan_changes()), they can be given as `protected`, and aren't looked
+        up again, unless deleting the others turns out to be protected (i.e.
+        something has come to protect them since).
+
+        If send_signals is False, the deleted occurrences don't send
+        pre_delete and post_delete signals, unless deleting them cascades to
+        other objects. Unhooking never sends signals.
+
+        Returns two lists of the (pk, start) of the deleted and the unhooked
+        occurrences.
+        """
+        occurrences = list(self.values_list('pk', 'start'))
+        deleted, unhooked = [], []
+        with summaries_deferred():
+            for i in range(0, len(occurrences), BATCH_SIZE):
+                batch = occurrences[i:i+BATCH_SIZE]
+                pks = [pk for pk, start in batch]
+                if protected is None:
+                    batch_protected = self.model.protected_pks(pks)
+                else:
+                    batch_protected = set(protected).intersection(pks)
+                try:
+                    d, u = self._delete_or_unhook_batch(
+                        batch, batch_protected, send_signals)
+                except ProtectedError:
+                    if protected is None:
+                        raise
+                    d, u = self._delete_or_unhook_batch(
+                        batch, self.model.protected_pks(pks), send_signals)
+                deleted.extend(d)
+                unhooked.extend(u)
+        return deleted, unhooked
+
+    def _delete_or_unhook_batch(self, batch, protected, send_signals):
+        """
+        Unhooks the occurrences in the batch of (pk, start) whose pks are in
+        protected, and deletes the others.
+        """
+        if protected:
+            self.model._base_manager.filter(pk__in=protected) \
+                .update(generated_by=None)
+        unhooked = [(pk, start) for pk, start in batch if pk in protected]
+        deleted = [(pk, start) for pk, start in batch if pk not in protected]
+        if deleted:
+            _delete(self.model._base_manager.filter(
+                pk__in=[pk for pk, start in deleted]), send_signals)
+        return deleted, unhooked
+
+    def bulk_create(self, objs, *args, **kwargs):
+        trees = event_trees(self.model.EventModel(),
+            set(obj.event_id for obj in objs))
+        for obj in objs:
+            obj.event_tree_id, obj.event_lft = trees.get(obj.event_id, (None, None))
+        return super(OccurrenceQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+    def delete(self):
+        # (the events' summaries are refreshed once, not per occurrence)
+        with summaries_deferred():
+            super(OccurrenceQuerySet, self).delete()
+    delete.alters_data = True
 
 class OccurrenceManager(XTimespanManager):
     __metaclass__ = ManagerType(OccurrenceQSFN, supertype=XTimespanManager.__metaclass__,)
@@ -85,6 +310,12 @@ class OccurrenceModel(XTimespanModel):
     """
 
     status = models.CharField(max_length=20, blank=True, verbose_name=_('status'), choices=settings.OCCURRENCE_STATUS_CHOICES)
+    # The event's tree_id and lft, so that the occurrences in an event's
+    # listing can be found with a range scan. They are set on save() and
+    # bulk_create(), and kept in sync by the EventTreeManager as the tree
+    # changes.
+    event_tree_id = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    event_lft = models.PositiveIntegerField(null=True, blank=True, editable=False)
 
     objects = OccurrenceManager()
     
@@ -96,6 +327,12 @@ class OccurrenceModel(XTimespanModel):
     def __unicode__(self):
         return u"%s: %s" % (self.event, self.timespan_description())
 
+    def save(self, *args, **kwargs):
+        # (from the database, in case the event instance is out of date)
+        trees = event_trees(type(self).EventModel(), [self.event_id])
+        self.event_tree_id, self.event_lft = trees.get(self.event_id, (None, None))
+        return super(OccurrenceModel, self).save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('events:occurrence', kwargs={'event_slug': self.event.slug, 'occurrence_pk': self.pk })
 
@@ -103,7 +340,92 @@ class OccurrenceModel(XTimespanModel):
     def EventModel(cls):
         return cls._meta.get_field('event').rel.to
 
+    @classmethod
+    def GeneratorModel(cls):
+        return cls._meta.get_field('generated_by').rel.to
+
+    @classmethod
+    def protected_pks(cls, pks):
+        """
+        Returns the set of the given occurrence pks that can't be deleted,
+        because they are referred to by a ForeignKey with on_delete=PROTECT,
+        or deleting them would cascade to something that is. There is one
+        query per protecting or cascading relation (and more to find which
+        occurrences are protected through a cascading relation, if any are).
+        """
+        pks = list(pks)
+        protected = set()
+        if not pks:
+            return protected
+        cascading = []
+        for related in cls._meta.get_all_related_objects():
+            if related.field.rel.on_delete is models.CASCADE:
+                cascading.append(related)
+            if related.field.rel.on_delete is not models.PROTECT:
+                continue
+            protected.update(related.model._base_manager.filter(**{
+                '%s__in' % related.field.name: pks
+            }).values_list(related.field.attname, flat=True))
+
+        if cascading:
+            unprotected = [pk for pk in pks if pk not in protected]
+            for i in range(0, len(unprotected), BATCH_SIZE):
+                protected.update(cls._cascade_protected_pks(
+                    cascading, unprotected[i:i+BATCH_SIZE]))
+        return protected
+
+    @classmethod
+    def _cascade_protected_pks(cls, cascading, pks):
+        """
+        Returns the pks whose deletion would cascade to something protected,
+        by collecting the objects that would be deleted with them, as Django
+        does, and splitting the pks in halves while that fails.
+        """
+        if not pks:
+            return set()
+        try:
+            for related in cascading:
+                objs = related.model._base_manager.filter(**{
+                    '%s__in' % related.field.name: pks
+                })
+                Collector(using=objs.db).collect(objs)
+        except models.ProtectedError:
+            if len(pks) == 1:
+                return set(pks)
+            half = len(pks) // 2
+            return cls._cascade_protected_pks(cascading, pks[:half]) | \
+                cls._cascade_protected_pks(cascading, pks[half:])
+        return set()
+
+    def is_virtual(self):
+        """
+        True if this occurrence was computed from a generator's rule, and
+        isn't stored in the database (see between_with_virtual).
+        """
+        return self.pk is None and self.generated_by_id is not None
+
+    def materialise(self):
+        """
+        Stores a virtual occurrence, so that it can be referred to (e.g. by a
+        ticket, or to set its status), and returns the stored occurrence. If
+        one has been stored at the same start in the meantime, that is
+        returned instead.
+        """
+        if self.pk is not None:
+            return self
+        o, created = type(self).objects.get_or_create(
+            event=self.event, start=self.start, defaults={
+                'generated_by': self.generated_by,
+                '_duration': self._duration,
+                'status': self.status,
+            }
+        )
+        return o
+
     def is_exclusion(self):
+        snapshot = EventScheduleSnapshot.active_for_event(self.event)
+        if snapshot is not None:
+            return snapshot.is_excluded(self.event_id, self.start)
         qs = self.event.exclusions.filter(start=self.start)
         if qs.count():
             return True
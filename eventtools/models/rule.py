@@ -1,4 +1,5 @@
 import calendar
+import re
 from django.db import models
 from django.utils.translation import ugettext, ugettext_lazy as _
 from dateutil import rrule
@@ -89,32 +90,117 @@ class Rule(models.Model):
         """Human readable string for Rule"""
         return self.name or unicode(self.frequency).lower()
     
+    def save(self, *args, **kwargs):
+        r = super(Rule, self).save(*args, **kwargs)
+        _compiled_rules.pop(self.pk, None)
+        return r
+
+    def delete(self, *args, **kwargs):
+        _compiled_rules.pop(self.pk, None)
+        return super(Rule, self).delete(*args, **kwargs)
+
+    def compiled(self):
+        """
+        Returns this rule parsed into a CompiledRule. Compiled rules are cached
+        per process, and recompiled if the rule is saved or its fields change.
+        """
+        if self.pk is None:
+            return CompiledRule(self)
+        compiled = _compiled_rules.get(self.pk)
+        if compiled is None or compiled.key != CompiledRule.key_for(self):
+            compiled = _compiled_rules[self.pk] = CompiledRule(self)
+        return compiled
+
     def get_rrule(self, dtstart):
-        if self.complex_rule:
-            d = dtstart.date()
-            weekday = weekdays[d.weekday()]
-            n = 1 + (d.day-1)/7
-
-            start_day, days_in_month = calendar.monthrange(d.year, d.month)
-            days_from_end = days_in_month - d.day
-
-            minus_n = -1 - (days_from_end / 7)
-            cr = self.complex_rule \
-                .replace("%date%", dtstart.strftime("%Y%m%d")) \
-                .replace("%day%", dtstart.strftime("%d")) \
-                .replace("%month%", dtstart.strftime("%m")) \
-                .replace("%year%", dtstart.strftime("%Y")) \
-                .replace("%time%", dtstart.strftime("%H%M%S")) \
-                .replace("%datetime%", dtstart.strftime("%Y%m%dT%H%M%S")) \
-                .replace("%nthday%", "%s%s" % (n, weekday)) \
-                .replace("%-nthday%", "%s%s" % (minus_n, weekday))
+        """
+        Returns a dateutil rrule (or rruleset) for this rule, starting at
+        dtstart. The result may be shared with other callers, so don't
+        modify it.
+        """
+        return self.compiled().bind(dtstart)
+
+
+# Compiled rules, by Rule pk.
+_compiled_rules = {}
+
+# The tokens that can be used in a complex rule, and functions that return
+# their values for a given dtstart.
+def _nthday(dtstart):
+    d = dtstart.date()
+    return "%s%s" % (1 + (d.day - 1) // 7, weekdays[d.weekday()])
+
+def _minus_nthday(dtstart):
+    d = dtstart.date()
+    start_day, days_in_month = calendar.monthrange(d.year, d.month)
+    days_from_end = days_in_month - d.day
+    return "%s%s" % (-1 - (days_from_end // 7), weekdays[d.weekday()])
+
+COMPLEX_RULE_TOKENS = {
+    "%date%": lambda dtstart: dtstart.strftime("%Y%m%d"),
+    "%day%": lambda dtstart: dtstart.strftime("%d"),
+    "%month%": lambda dtstart: dtstart.strftime("%m"),
+    "%year%": lambda dtstart: dtstart.strftime("%Y"),
+    "%time%": lambda dtstart: dtstart.strftime("%H%M%S"),
+    "%datetime%": lambda dtstart: dtstart.strftime("%Y%m%dT%H%M%S"),
+    "%nthday%": _nthday,
+    "%-nthday%": _minus_nthday,
+}
+COMPLEX_RULE_TOKEN_RE = re.compile(r'(%-?[a-z]+%)')
+
+
+class CompiledRule(object):
+    """
+    A Rule prepared for binding to dtstarts.
+
+    The params and frequency of a simple rule are parsed once. The complex
+    rule is split into literal text and tokens once, but it is still parsed
+    by rrulestr for each new dtstart, as the rrules of the dateutil we use
+    can't be re-bound to another dtstart. The most recently bound rrules
+    are kept, so binding the same dtstart again doesn't parse anything.
+    """
+    MAX_BOUND = 128
+
+    @staticmethod
+    def key_for(rule):
+        return (rule.frequency, rule.params, rule.complex_rule)
+
+    def __init__(self, rule):
+        self.key = self.key_for(rule)
+        if rule.complex_rule:
+            # literal text at even indices, tokens at odd indices
+            self.segments = COMPLEX_RULE_TOKEN_RE.split(rule.complex_rule)
+        else:
+            self.segments = None
+        self.frequency = rule.frequency
+        self.params = rule.get_params()
+        self._bound = {}
+
+    def bind(self, dtstart):
+        # (aware datetimes for the same instant are equal whatever their
+        # timezone, but rrules repeat in dtstart's timezone)
+        key = (dtstart, dtstart.tzinfo)
+        try:
+            return self._bound[key]
+        except KeyError:
+            pass
+        if len(self._bound) >= self.MAX_BOUND:
+            self._bound.clear()
+        r = self._bound[key] = self._bind(dtstart)
+        return r
+
+    def _bind(self, dtstart):
+        if self.segments is not None:
+            cr = "".join(
+                COMPLEX_RULE_TOKENS[segment](dtstart)
+                if i % 2 and segment in COMPLEX_RULE_TOKENS else segment
+                for i, segment in enumerate(self.segments)
+            )
             try:
                 return rrule.rrulestr(str(cr), dtstart=dtstart)
             except ValueError: # eg. unsupported property 
                 pass
-        params = self.get_params()
-        frequency = 'rrule.%s' % self.frequency
-        simple_rule = rrule.rrule(eval(frequency), dtstart=dtstart, **params)
+        simple_rule = rrule.rrule(
+            getattr(rrule, self.frequency), dtstart=dtstart, **self.params)
         rs = rrule.rruleset()
         rs.rrule(simple_rule)
         return rs
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+A denormalised summary of each event's schedule, so that listings can show
+events' seasons and statuses from one joined query:
+
+    events = Event.eventobjects.in_listings().select_related('summary')
+
+Summaries are kept up to date as occurrences are saved and deleted, as
+generators change their occurrences (see signals.occurrences_changed), and by
+the admin actions that update occurrences in bulk. Code that updates
+occurrences with QuerySet.update() should call refresh_summaries() for their
+events. The rebuild_event_summaries command fills the table from scratch.
+
+Several changes can be summarised together:
+
+    with summaries_deferred():
+        ...
+
+refreshes the summaries of the events that changed once, as the block exits.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import models
+from django.db.models import Count, Min, Max, signals
+from django.utils.datastructures import SortedDict
+from django.utils.timezone import localtime, now
+from django.utils.translation import ugettext_lazy as _
+
+from eventtools.signals import occurrences_changed
+
+__all__ = ['EventSummaryModel', 'refresh_summaries', 'summaries_deferred']
+
+_local = threading.local()
+
+# Separates the statuses in EventSummaryModel.statuses.
+STATUS_SEPARATOR = u'\n'
+
+
+class EventSummaryModel(models.Model):
+    """
+    An abstract model for a summary of an event's occurrences in listing (ie
+    those attached to it and its descendants). The EventModel accessors
+    (opening_occurrence(), season(), status() and so on) read from it if
+    there is one.
+
+     Implementing subclasses should define an 'event' OneToOneField to an
+    EventModel subclass, as the primary key. The related_name for the field
+    should be 'summary'.
+
+        event = models.OneToOneField(SomeEvent, related_name="summary", primary_key=True)
+    """
+    first_start = models.DateTimeField(null=True, blank=True, verbose_name=_('first start'))
+    last_start = models.DateTimeField(null=True, blank=True, verbose_name=_('last start'))
+    # (becomes stale as time passes; see EventModel.next_start())
+    next_start = models.DateTimeField(null=True, blank=True, verbose_name=_('next start'))
+    total_count = models.PositiveIntegerField(default=0, verbose_name=_('occurrences'))
+    cancelled_count = models.PositiveIntegerField(default=0, verbose_name=_('cancelled'))
+    fully_booked_count = models.PositiveIntegerField(default=0, verbose_name=_('fully booked'))
+    available_count = models.PositiveIntegerField(default=0, verbose_name=_('available'))
+    # the distinct statuses, separated by STATUS_SEPARATOR
+    statuses = models.TextField(blank=True, verbose_name=_('statuses'))
+    # the number of distinct (local) start times
+    distinct_times = models.PositiveIntegerField(default=0, verbose_name=_('distinct start times'))
+    # the pks of the opening and closing occurrences
+    first_occurrence_pk = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('opening occurrence'))
+    last_occurrence_pk = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('closing occurrence'))
+
+    class Meta:
+        abstract = True
+
+    def __unicode__(self):
+        return u"%s: %s occurrences" % (self.event, self.total_count)
+
+    def status_set(self):
+        """
+        Returns the set of the statuses of the occurrences.
+        """
+        if not self.total_count:
+            return set()
+        return set(self.statuses.split(STATUS_SEPARATOR))
+
+    @classmethod
+    def summarise(cls, event):
+        """
+        Returns a dictionary of the field values for the event's summary, in
+        four queries (three if there are none).
+        """
+        from eventtools.conf import settings
+
+        occurrences = event.occurrences_in_listing().order_by()
+        values = {
+            'first_start': None, 'last_start': None, 'total_count': 0,
+            'cancelled_count': 0, 'fully_booked_count': 0,
+            'available_count': 0,
+        }
+        statuses = []
+        for status, count, first, last in occurrences.values('status') \
+            .annotate(n=Count('pk'), first=Min('start'), last=Max('start')) \
+            .values_list('status', 'n', 'first', 'last'):
+            statuses.append(status)
+            values['total_count'] += count
+            if status == settings.OCCURRENCE_STATUS_CANCELLED[0]:
+                values['cancelled_count'] = count
+            elif status == settings.OCCURRENCE_STATUS_FULLY_BOOKED[0]:
+                values['fully_booked_count'] = count
+            elif not status:
+                values['available_count'] += count
+            if values['first_start'] is None or first < values['first_start']:
+                values['first_start'] = first
+            if values['last_start'] is None or last > values['last_start']:
+                values['last_start'] = last
+        values['statuses'] = STATUS_SEPARATOR.join(sorted(set(statuses)))
+        values['next_start'] = occurrences.filter(start__gte=now()) \
+            .aggregate(next=Min('start'))['next']
+        values['distinct_times'] = cls._count_distinct_times(occurrences)
+        values['first_occurrence_pk'], values['last_occurrence_pk'] = \
+            cls._find_opening_and_closing(event) \
+            if values['total_count'] else (None, None)
+        return values
+
+    @classmethod
+    def _find_opening_and_closing(cls, event):
+        """
+        Returns the pks of the first and last occurrences in the event's
+        listing (in its order), in one query.
+        """
+        from django.db import connections
+        listing = event.occurrences_in_listing().values_list('pk', flat=True)
+        first_sql, first_params = listing[:1].query.sql_with_params()
+        last_sql, last_params = listing.reverse()[:1].query.sql_with_params()
+        cursor = connections[listing.db].cursor()
+        cursor.execute('SELECT (%s), (%s)' % (first_sql, last_sql),
+            list(first_params) + list(last_params))
+        return cursor.fetchone()
+
+    @classmethod
+    def _count_distinct_times(cls, occurrences):
+        """
+        Returns the number of distinct local start times of the occurrences,
+        from one row per (stored) hour and minute of their starts.
+
+        With USE_TZ, starts are stored in UTC, so each row's earliest and
+        latest starts are localised (a stored time of day falls at different
+        local times on either side of a daylight saving change).
+        """
+        from django.db import connection
+        qn = connection.ops.quote_name
+        start = '%s.%s' % (qn(occurrences.model._meta.db_table),
+            qn(occurrences.model._meta.get_field('start').column))
+        times = set()
+        # (values_list() would lose the GROUP BY of the extra columns)
+        for row in occurrences.extra(select=SortedDict([
+                ('start_hour', connection.ops.date_extract_sql('hour', start)),
+                ('start_minute', connection.ops.date_extract_sql('minute', start)),
+            ])).values('start_hour', 'start_minute') \
+            .annotate(first=Min('start'), last=Max('start')):
+            times.add(localtime(row['first']).time())
+            times.add(localtime(row['last']).time())
+        return len(times)
+
+
+def _summary_model(EventModel):
+    SummaryModel = EventModel.SummaryModel()
+    if SummaryModel is None or SummaryModel._meta.abstract:
+        return None
+    return SummaryModel
+
+def refresh_summaries(events):
+    """
+    Updates the summaries of the given events and their ancestors (whose
+    listings include the events' occurrences), or creates them.
+    """
+    seen = set()
+    for event in events:
+        # (don't serve a stale cached summary, or status_summary())
+        event.__dict__.pop('_summary_cache', None)
+        event.__dict__.pop('_status_summary', None)
+        SummaryModel = _summary_model(type(event))
+        if SummaryModel is None:
+            continue
+        if event.is_root_node():
+            ancestors = [event]
+        else:
+            ancestors = event.get_ancestors(include_self=True)
+        for e in ancestors:
+            if (type(e), e.pk) in seen:
+                continue
+            seen.add((type(e), e.pk))
+            values = SummaryModel.summarise(e)
+            if not SummaryModel.objects.filter(event=e).update(**values) \
+                and type(e)._event_manager.filter(pk=e.pk).exists():
+                SummaryModel.objects.create(event=e, **values)
+
+@contextmanager
+def summaries_deferred():
+    """
+    Collects the events whose summaries need refreshing until the block
+    exits, and then refreshes them once. Nested blocks refresh when the
+    outermost one exits.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = {}
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    events = []
+    for EventModel, event_ids in pending.items():
+        events.extend(EventModel._event_manager.filter(pk__in=event_ids))
+    refresh_summaries(events)
+
+def _changed(EventModel, event_id, event=None):
+    """
+    Refreshes the summary of the event (which is fetched if not given), or
+    records it as pending.
+    """
+    if _summary_model(EventModel) is None:
+        return
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.setdefault(EventModel, set()).add(event_id)
+        return
+    if event is None:
+        # (there is none if it has been deleted)
+        events = list(EventModel._event_manager.filter(pk=event_id))
+    else:
+        events = [event]
+    refresh_summaries(events)
+
+
+def _is_occurrence(instance):
+    from eventtools.models.occurrence import OccurrenceModel
+    return isinstance(instance, OccurrenceModel)
+
+def _occurrence_pre_save(sender, instance, raw=False, **kwargs):
+    # Remember the event an occurrence is being moved from.
+    if raw or instance.pk is None or not _is_occurrence(instance) or \
+        _summary_model(sender.EventModel()) is None:
+        return
+    instance._saved_event_ids = list(sender._base_manager
+        .filter(pk=instance.pk).values_list('event_id', flat=True))
+
+def _occurrence_post_save(sender, instance, raw=False, **kwargs):
+    if raw or not _is_occurrence(instance):
+        return
+    EventModel = sender.EventModel()
+    for event_id in getattr(instance, '_saved_event_ids', []):
+        if event_id != instance.event_id:
+            _changed(EventModel, event_id)
+    instance._saved_event_ids = []
+    _changed(EventModel, instance.event_id,
+        instance.__dict__.get('_event_cache'))
+
+def _occurrence_post_delete(sender, instance, **kwargs):
+    if not _is_occurrence(instance):
+        return
+    _changed(sender.EventModel(), instance.event_id)
+
+def _event_post_delete(sender, instance, **kwargs):
+    # The listings of a deleted event's ancestors have lost its occurrences
+    # (whose own post_delete can no longer find the event).
+    from eventtools.models.event import EventModel
+    if not isinstance(instance, EventModel) or instance.parent_id is None:
+        return
+    _changed(sender, instance.parent_id)
+
+def tree_changed(EventModel, event_ids):
+    """
+    Refreshes the summaries of the given events and their ancestors (or
+    records them as pending), e.g. after an event has moved in the tree.
+    """
+    for event_id in event_ids:
+        if event_id is not None:
+            _changed(EventModel, event_id)
+
+def _occurrences_changed(sender, generator, **kwargs):
+    _changed(type(generator.event), generator.event_id, generator.event)
+
+def _connect(sender, **kwargs):
+    """
+    Keeps summaries up to date once an EventSummaryModel is installed.
+    """
+    if not issubclass(sender, EventSummaryModel) or sender._meta.abstract:
+        return
+    signals.pre_save.connect(_occurrence_pre_save,
+        dispatch_uid='eventtools.summary.pre_save')
+    signals.post_save.connect(_occurrence_post_save,
+        dispatch_uid='eventtools.summary.post_save')
+    signals.post_delete.connect(_occurrence_post_delete,
+        dispatch_uid='eventtools.summary.post_delete')
+    signals.post_delete.connect(_event_post_delete,
+        dispatch_uid='eventtools.summary.event_post_delete')
+    occurrences_changed.connect(_occurrences_changed,
+        dispatch_uid='eventtools.summary.occurrences_changed')
+
+signals.class_prepared.connect(_connect)
@@ -1,5 +1,6 @@
 import datetime
 
+from django.conf import settings
 from django.db import models
 from django.utils.translation import ugettext as _
 from eventtools.utils import datetimeify
@@ -42,6 +43,17 @@ class XTimespanQSFN(object):
     between = starts_between
     on = starts_on
 
+    def ends_before(self, date):
+        end = datetimeify(date, clamp="max")
+        if settings.USE_TZ and is_naive(end):
+            end = make_aware(end, get_default_timezone())
+        return self.filter(_end__lte=end)
+    def ends_after(self, date):
+        start = datetimeify(date, clamp="min")
+        if settings.USE_TZ and is_naive(start):
+            start = make_aware(start, get_default_timezone())
+        return self.filter(_end__gte=start)
+
     #misc queries (note they assume starts_)
     def forthcoming(self):
         return self.starts_after(now())
@@ -49,8 +61,76 @@ class XTimespanQSFN(object):
     def recent(self):
         return self.starts_before(now())
 
+    # these use the stored end (see XTimespanModel._end)
+    def finished(self):
+        return self.filter(_end__lt=now())
+
+    def unfinished(self):
+        """
+        Returns the timespans that haven't finished, ie that are on now or
+        upcoming.
+        """
+        return self.filter(_end__gte=now())
+
+    def overlapping(self, d1, d2, max_duration=None):
+        """
+        Returns the timespans that are on at any time in a given date/datetime
+        range, including those that started before it (e.g. exhibitions).
+
+        The conditions are start <= d2 and _end >= d1, so an index on start
+        (or _end) only bounds one side of the range it scans. If you know the
+        longest that a timespan can last, pass it as max_duration (a
+        timedelta), to bound start on both sides: start >= d1 - max_duration.
+        """
+        start = datetimeify(d1, clamp="min")
+        end = datetimeify(d2, clamp="max")
+        if settings.USE_TZ:
+            if is_naive(start):
+                start = make_aware(start, get_default_timezone())
+            if is_naive(end):
+                end = make_aware(end, get_default_timezone())
+        qs = self.filter(start__lte=end, _end__gte=start)
+        if max_duration is not None:
+            qs = qs.filter(start__gte=start - max_duration)
+        return qs
+    occupying = overlapping
+
+    def on_day_overlapping(self, day, max_duration=None):
+        d1, d2 = dayify(day)
+        return self.overlapping(d1, d2, max_duration=max_duration)
+
+    def now_on(self, max_duration=None):
+        t = now()
+        qs = self.filter(start__lt=t, _end__gte=t)
+        if max_duration is not None:
+            qs = qs.filter(start__gte=t - max_duration)
+        return qs
+
+def update_ends(queryset):
+    """
+    Sets the stored end of the timespans in the queryset, with one UPDATE per
+    distinct duration. Use it to backfill _end after adding the column (it
+    works on South's frozen models too), or after updating start or _duration
+    with queryset.update().
+    """
+    queryset.filter(_duration__isnull=True).update(_end=models.F('start'))
+    durations = queryset.exclude(_duration__isnull=True) \
+        .order_by().values_list('_duration', flat=True).distinct()
+    for duration in list(durations):
+        queryset.filter(_duration=duration).update(
+            _end=models.F('start') + datetime.timedelta(minutes=duration))
+
 class XTimespanQuerySet(models.query.QuerySet, XTimespanQSFN):
-    pass #all the goodness is inherited from XTimespanQSFN
+    # all the goodness is inherited from XTimespanQSFN, except:
+
+    def bulk_create(self, objs, *args, **kwargs):
+        for obj in objs:
+            if obj.start is not None:
+                obj._end = obj.end()
+        return super(XTimespanQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+    def update_ends(self):
+        update_ends(self)
 
 class XTimespanManager(models.Manager):
     __metaclass__ = ManagerType(XTimespanQSFN)
@@ -62,6 +142,9 @@ class XTimespanManager(models.Manager):
 class XTimespanModel(models.Model):
     start = models.DateTimeField(db_index=True, verbose_name=_('start'))
     _duration = models.PositiveIntegerField(_("duration (mins)"), blank=True, null=True, help_text=_("to create 'all day' events, set start time to 00:00 and leave duration blank"))
+    # end(), stored so that it can be queried. It is set on save() and
+    # bulk_create(), but not by queryset.update() (see update_ends).
+    _end = models.DateTimeField(db_index=True, null=True, blank=True, editable=False, verbose_name=_('end'))
 
     objects = XTimespanManager()
 
@@ -69,6 +152,12 @@ class XTimespanModel(models.Model):
         abstract = True
         ordering = ('start', )
 
+    def save(self, *args, **kwargs):
+        # (without a start, leave it to the database to complain)
+        if self.start is not None:
+            self._end = self.end()
+        return super(XTimespanModel, self).save(*args, **kwargs)
+
     def get_duration(self):
         """
         _duration is a value in minutes. The duration property returns a 
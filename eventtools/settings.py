@@ -22,6 +22,22 @@ ICAL_CALDESC = "Events listing" #e.g. "Events listing from mysite.com"
 from dateutil.relativedelta import relativedelta
 DEFAULT_GENERATOR_LIMIT = relativedelta(years=1) #months=6, etc
 
+# If False, generators don't store their occurrences in advance. List them with
+# OccurrenceQuerySet.between_with_virtual(), and materialise() the ones you need
+# to refer to.
+MATERIALISE_GENERATED_OCCURRENCES = True
+
+# 'immediate' generates occurrences when a generator is saved. 'deferred'
+# records a job for ./manage.py process_generation_jobs, and 'thread' records a
+# job for a pool of GENERATION_THREADS threads in the same process.
+GENERATION_MODE = 'immediate'
+GENERATION_THREADS = 2
+GENERATION_POLL_INTERVAL = 5 # seconds
+
+# If False, generators avoid sending per-occurrence model signals (e.g. when
+# deleting occurrences); listen to eventtools.signals.occurrences_changed.
+GENERATOR_ROW_SIGNALS = True
+
 OCCURRENCE_STATUS_CANCELLED =  ('cancelled', 'Cancelled')
 OCCURRENCE_STATUS_FULLY_BOOKED = ('fully booked', 'Fully Booked')
 
@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+# Sent once each time a generator changes its occurrences (on save, when
+# extending, filling starts released by another generator, importing or
+# deleting), instead of (or as well as; see settings.GENERATOR_ROW_SIGNALS) the
+# per-occurrence model signals. The sender is the Occurrence model. The
+# arguments are the generator that made the changes, and lists of the ids of the
+# occurrences that were added, updated (timeshifted), unhooked (made one-off)
+# and deleted. The lists may be empty.
+occurrences_changed = Signal(
+    providing_args=['generator', 'added', 'updated', 'unhooked', 'deleted'])
@@ -0,0 +1,250 @@
+"""
+A shared, in-memory view of an event's schedule for generator operations.
+
+Saving a generator compares its candidate occurrences with the occurrences,
+exclusions and generators of its event. When several generators of an event
+are processed together (e.g. the cascade to sibling generators on save, or
+extending an event's endless generators), they read from one
+EventScheduleSnapshot, loaded in three queries, and update it in place as
+they change occurrences:
+
+    with schedule_snapshot(event):
+        for generator in event.generators.all():
+            generator.extend_to()
+
+The snapshot is only used inside the block, which should be within a single
+transaction. Changes made to the event's occurrences inside the block, other
+than by generators, aren't seen by the snapshot.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time
+
+from django.utils.timezone import get_current_timezone, make_aware
+
+from eventtools.conf import settings
+
+_local = threading.local()
+
+def _active():
+    if not hasattr(_local, 'snapshots'):
+        _local.snapshots = {}
+    return _local.snapshots
+
+def _key(event):
+    return (type(event)._meta.app_label, type(event)._meta.object_name, event.pk)
+
+@contextmanager
+def schedule_snapshot(event, after=None):
+    """
+    Makes generator operations on the event share a snapshot of its schedule
+    until the block exits. Nested blocks for the same event share the
+    outermost snapshot.
+
+    If `after` (a date) is given, the snapshot only holds the occurrences
+    after it, and operations that need earlier ones use their own snapshot
+    (e.g. when extending generators that have all generated up to `after`).
+    """
+    snapshots = _active()
+    key = _key(event)
+    if key in snapshots:
+        yield snapshots[key]
+        return
+    snapshot = EventScheduleSnapshot(event, after=after)
+    snapshots[key] = snapshot
+    try:
+        yield snapshot
+    finally:
+        del snapshots[key]
+
+def after_datetime(after):
+    """
+    Returns the end of the date `after`, as a datetime to compare starts with.
+    """
+    after_end = datetime.combine(after, time.max)
+    if settings.USE_TZ:
+        after_end = make_aware(after_end, get_current_timezone())
+    return after_end
+
+
+class EventScheduleSnapshot(object):
+    """
+    The occurrences and exclusions of an event and its descendants (i.e. in
+    its listing), and the generators of the event, as compact tuples. They are
+    loaded when first needed, in a query each.
+
+    If `after` (a date) is given, only occurrences after that date are loaded.
+    """
+
+    @classmethod
+    def for_generator(cls, generator, after=None):
+        """
+        Returns the active snapshot for the generator's event, if it covers
+        the occurrences after `after`, or else a new snapshot for the
+        generator alone.
+        """
+        snapshot = _active().get(_key(generator.event))
+        if snapshot is not None and snapshot.covers(after):
+            return snapshot
+        return cls(generator.event, after=after)
+
+    @classmethod
+    def active(cls, event):
+        """
+        Returns the active snapshot for the event, or None.
+        """
+        return _active().get(_key(event))
+
+    @classmethod
+    def active_for_event(cls, event):
+        """
+        Returns the active snapshot whose listing includes the event, if any.
+        """
+        for snapshot in _active().values():
+            if snapshot.includes_event(event):
+                return snapshot
+        return None
+
+    def __init__(self, event, after=None):
+        self.event = event
+        self.after = after
+        self._loaded = False
+        self._exclusions = None
+        self._generators = None
+
+    def covers(self, after):
+        return self.after is None or (after is not None and after >= self.after)
+
+    def includes_event(self, event):
+        root = self.event
+        return type(event) is type(root) and event.tree_id == root.tree_id \
+            and root.lft <= event.lft and event.rght <= root.rght
+
+    def _load(self):
+        if self._loaded:
+            return
+        # (in the listing's order, which doesn't join the events table)
+        occurrences = self.event.occurrences_in_listing() \
+            .order_by('start', 'event_tree_id', 'event_lft')
+        if self.after is not None:
+            occurrences = occurrences.filter(
+                start__gt=after_datetime(self.after))
+
+        # start -> [(pk, event_id)], for every occurrence in the listing
+        self._taken = {}
+        # generator pk -> {pk: (start, event_id)}, for generated occurrences
+        self._generated = {}
+        # generators that have created occurrences whose pks we don't know
+        self._incomplete = set()
+        for pk, event_id, start, generated_by_id in occurrences \
+            .values_list('pk', 'event_id', 'start', 'generated_by_id'):
+            self._taken.setdefault(start, []).append((pk, event_id))
+            if generated_by_id is not None:
+                self._generated.setdefault(generated_by_id, {})[pk] = \
+                    (start, event_id)
+        self._loaded = True
+
+    @property
+    def taken(self):
+        """
+        A dictionary of start: [(occurrence pk, event_id)] for the occurrences
+        in the listing. The pks of occurrences created since the snapshot was
+        loaded are None.
+        """
+        self._load()
+        return self._taken
+
+    @property
+    def exclusions(self):
+        """
+        The set of (event_id, start) for the exclusions in the listing.
+        """
+        if self._exclusions is None:
+            events = self.event.get_descendants(include_self=True)
+            self._exclusions = set(
+                self.event.ExclusionModel().objects.filter(event__in=events)
+                .values_list('event_id', 'start')
+            )
+        return self._exclusions
+
+    def is_excluded(self, event_id, start):
+        return (event_id, start) in self.exclusions
+
+    def saved_timespan(self, generator):
+        """
+        Returns the generator's (start, _duration), as saved, or None.
+        """
+        if self._generators is None:
+            self._generators = dict(
+                (pk, (start, duration)) for pk, start, duration in
+                self.event.generators.values_list('pk', 'start', '_duration')
+            )
+        if generator.pk not in self._generators:
+            # e.g. the generator is being moved from another event
+            saved = list(type(generator).objects.filter(pk=generator.pk)
+                .values_list('start', '_duration'))
+            return saved[0] if saved else None
+        return self._generators[generator.pk]
+
+    def generated_by(self, generator):
+        """
+        Returns a dictionary of pk: (start, event_id) for the occurrences in
+        the listing that the generator generated.
+        """
+        self._load()
+        if generator.pk in self._incomplete:
+            occurrences = generator.occurrences.all()
+            if self.after is not None:
+                occurrences = occurrences.filter(
+                    start__gt=after_datetime(self.after))
+            self._generated[generator.pk] = mine = dict(
+                (pk, (start, event_id)) for pk, start, event_id in
+                occurrences.values_list('pk', 'start', 'event_id'))
+            self._incomplete.discard(generator.pk)
+            # Fill in the pks of the occurrences it created.
+            for pk, (start, event_id) in mine.items():
+                taken = self._taken.get(start, [])
+                if (pk, event_id) not in taken and (None, event_id) in taken:
+                    taken[taken.index((None, event_id))] = (pk, event_id)
+        return self._generated.get(generator.pk, {})
+
+    def _remove(self, pk, start):
+        taken = self._taken.get(start, [])
+        taken[:] = [t for t in taken if t[0] != pk]
+        if not taken:
+            self._taken.pop(start, None)
+
+    def record_changes(self, changes, removed):
+        """
+        Updates the snapshot with GeneratorChanges that have been applied
+        (other than added occurrences; see record_added). `removed` is the
+        set of starts of the occurrences that were actually deleted (rather
+        than unhooked).
+        """
+        generator = changes.generator
+        if self._generators is not None:
+            self._generators[generator.pk] = (generator.start, generator._duration)
+        if not self._loaded:
+            return
+        mine = self._generated.setdefault(generator.pk, {})
+        for pk, old_start, start in changes.shifted:
+            self._remove(pk, old_start)
+        for pk, old_start, start in changes.shifted:
+            event_id = mine.get(pk, (None, generator.event_id))[1]
+            self._taken.setdefault(start, []).append((pk, event_id))
+            mine[pk] = (start, event_id)
+        for pk, start in changes.deleted + changes.unhooked:
+            mine.pop(pk, None)
+            if start in removed:
+                self._remove(pk, start)
+
+    def record_added(self, generator, starts):
+        """
+        Updates the snapshot with occurrences that the generator has created
+        at the given starts.
+        """
+        if not self._loaded or not starts:
+            return
+        for start in starts:
+            self._taken.setdefault(start, []).append((None, generator.event_id))
+        self._incomplete.add(generator.pk)
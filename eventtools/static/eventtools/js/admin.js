@@ -20,5 +20,27 @@
 			$("fieldset."+id).replaceWith($this);
 		});
 
+		/*
+		
+		while occurrences are generated in the background (see eventtools.generation), poll for when they're done.
+		
+		*/
+		
+		var $status = $("#generation-status");
+		function pollGenerationStatus() {
+			$.getJSON($status.attr('data-url'), function(data) {
+				if (data.status == 'pending') {
+					setTimeout(pollGenerationStatus, 3000);
+				} else if (data.status == 'failed') {
+					$status.text("Generating occurrences failed");
+				} else {
+					$status.text("Occurrences generated");
+				}
+			});
+		}
+		if ($status.length) {
+			setTimeout(pollGenerationStatus, 3000);
+		}
+
 	});
 })(jQuery);
\ No newline at end of file
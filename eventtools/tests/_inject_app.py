@@ -2,9 +2,10 @@ import shlex
 import subprocess
 from random import randint
 
-from django.db.models.loading import load_app
+from django.db.models.loading import cache, load_app
 from django.conf import settings
 from django.core.management import call_command
+from django.db import connection
 from django.template.loaders import app_directories
 from django.template import loader
 from django.test import TestCase
@@ -28,6 +29,7 @@ class TestCaseWithApp(TestCase):
         self._old_root_urlconf = settings.ROOT_URLCONF
         settings.ROOT_URLCONF = '%s.urls' % APP_NAME
         load_app(APP_NAME)
+        cache._get_models_cache.clear() # so get_models() includes the app
         call_command('flush', verbosity=0, interactive=False)
         call_command('syncdb', verbosity=0, interactive=False)
         self.ae = self.assertEqual
@@ -50,6 +52,19 @@ class TestCaseWithApp(TestCase):
         reload(app_directories)
         loader.template_source_loaders = None
 
+    def num_queries(self, func, *args, **kwargs):
+        """
+        Returns the number of queries executed by calling func.
+        """
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        starting_count = len(connection.queries)
+        try:
+            func(*args, **kwargs)
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+        return len(connection.queries) - starting_count
+
     def open_string_in_browser(self, s):
         filename = "/tmp/%s.html" % randint(1, 100)
         f = open(filename, "w")
@@ -1,5 +1,5 @@
 from django.db import models
-from eventtools.models import EventModel, OccurrenceModel, GeneratorModel, ExclusionModel
+from eventtools.models import EventModel, OccurrenceModel, GeneratorModel, ExclusionModel, EventSummaryModel
 from django.conf import settings
 
 class ExampleEvent(EventModel):
@@ -23,6 +23,17 @@ class ExampleOccurrence(OccurrenceModel):
 class ExampleExclusion(ExclusionModel):
     event = models.ForeignKey(ExampleEvent, related_name="exclusions")
 
+class ExampleEventSummary(EventSummaryModel):
+    event = models.OneToOneField(ExampleEvent, related_name="summary", primary_key=True)
+
 class ExampleTicket(models.Model):
     # used to test that an occurrence is unhooked rather than deleted.
-    occurrence = models.ForeignKey(ExampleOccurrence, on_delete=models.PROTECT)
\ No newline at end of file
+    occurrence = models.ForeignKey(ExampleOccurrence, on_delete=models.PROTECT)
+
+class ExampleBooking(models.Model):
+    # used to test that an occurrence is unhooked rather than deleted when
+    # deleting it would cascade to something protected.
+    occurrence = models.ForeignKey(ExampleOccurrence)
+
+class ExampleBookingTicket(models.Model):
+    booking = models.ForeignKey(ExampleBooking, on_delete=models.PROTECT)
@@ -1,11 +1,20 @@
 from models import ExampleEvent, ExampleOccurrence
 from eventtools.views import EventViews
+from eventtools.admin import EventAdmin, OccurrenceAdmin
 from django.conf.urls.defaults import *
+from django.contrib import admin
 
-class TestEventViews(EventViews):
-    occurrence_qs = ExampleOccurrence.objects.all()
-    event_qs = ExampleEvent.eventobjects.all()
-    
-views = TestEventViews()
-    
-urlpatterns = views.get_urls()
\ No newline at end of file
+views = EventViews(
+    event_qs=ExampleEvent.eventobjects.all(),
+    occurrence_qs=ExampleOccurrence.objects.all(),
+)
+
+# an admin site with the eventtools admins, for testing them
+admin_site = admin.AdminSite()
+admin_site.register(ExampleEvent, EventAdmin(ExampleEvent))
+admin_site.register(ExampleOccurrence, OccurrenceAdmin(ExampleOccurrence))
+
+urlpatterns = patterns('',
+    url(r'^events/', include(views.urls)),
+    url(r'^admin/', include(admin_site.urls)),
+)
@@ -154,7 +154,204 @@ class TestEvents(AppTestCase):
         o2 = [a.closing_occurrence() for a in ExampleEvent.eventobjects.all()]
         self.ae(set(o), set(o2))
 
-    def test_change_cascade(self):       
+        # it is one query, and each event's opening occurrence may be attached
+        # to one of its descendants
+        self.ae(self.num_queries(lambda: list(ExampleEvent.eventobjects.opening_occurrences())), 1)
+        roots = ExampleEvent.eventobjects.filter(parent=None).having_occurrences()
+        self.ae(set(roots.closing_occurrences()), set(a.closing_occurrence() for a in roots))
+        self.ae(set(roots.opening_occurrences().values_list('event', flat=True)), set(a.opening_occurrence().event_id for a in roots))
+        # (an empty queryset of events has none)
+        self.ae(list(ExampleEvent.eventobjects.filter(pk__in=[]).opening_occurrences()), [])
+        self.ae(list(ExampleEvent.eventobjects.filter(pk__in=[]).closing_occurrences()), [])
+
+    def test_status_summary(self):
+        """
+        An event's availability is worked out from a summary of its
+        occurrences in listing, in one query, which listings can fetch for
+        all their events at once.
+        """
+        festival = ExampleEvent.eventobjects.create(title="Festival", slug="festival")
+        gala = ExampleEvent.eventobjects.create(parent=festival, title="Gala", slug="festival-gala")
+        past = datetime.now() - timedelta(days=7)
+        future = datetime.now() + timedelta(days=7)
+        festival.occurrences.create(start=past, _duration=60, status='cancelled')
+        gala.occurrences.create(start=future, _duration=60, status='fully booked')
+        festival.occurrences.create(start=future + timedelta(days=1), _duration=60, status='cancelled')
+
+        festival = festival.reload()
+        self.ae(self.num_queries(festival.status_summary), 1)
+        summary = festival.status_summary()
+        self.ae(summary['total'], 3)
+        self.ae(summary['cancelled'], 2)
+        self.ae(summary['fully_booked'], 1)
+        self.ae(summary['available'], 0)
+        self.ae(summary['forthcoming'], 2)
+        self.ae(summary['forthcoming_cancelled'], 1)
+        self.ae(summary['unfinished'], 2)
+        self.ae(self.num_queries(festival.unavailable_status_message), 0)
+        self.ae(festival.is_finished(), False)
+        self.ae(festival.is_cancelled(), False)
+        self.ae(festival.is_fully_booked(), True)
+        self.ae(festival.unavailable_status_message(), "This event is fully booked.")
+        self.ae(gala.reload().status_summary()['total'], 1)
+        self.ae(ExampleEvent.eventobjects.create(title="Empty", slug="empty").is_finished(), None)
+
+        # the memoised summary is dropped when the event is saved, or its
+        # summaries are refreshed
+        from eventtools.models import refresh_summaries
+        festival.occurrences.update(status='')
+        self.ae(festival.status_summary()['cancelled'], 2)
+        festival.save()
+        self.ae(festival.status_summary()['cancelled'], 0)
+        festival.occurrences.update(status='cancelled')
+        refresh_summaries([festival])
+        self.ae(festival.status_summary()['cancelled'], 2)
+
+        # occurrences without a stored end (e.g. from before it was stored)
+        # aren't taken to have finished
+        ExampleOccurrence.objects.filter(event__tree_id=festival.tree_id).update(_end=None)
+        festival = festival.reload()
+        self.ae((festival.status_summary()['unfinished'], festival.status_summary()['unknown_end']), (0, 3))
+        self.ae(festival.is_finished(), False)
+        festival.occurrences_in_listing().filter(start__gt=past).delete()
+        self.ae(festival.reload().is_finished(), True)
+
+        events = ExampleEvent.eventobjects.filter(tree_id=festival.tree_id)
+        def summaries():
+            return [e.status_summary() for e in events.annotate_status_summary()]
+        self.ae(self.num_queries(summaries), 2)
+        self.ae(summaries(), [e.status_summary() for e in events])
+
+    def test_schedule_summary(self):
+        """
+        Events' summaries are kept up to date as their occurrences change, and
+        the listing accessors read from them.
+        """
+        from django.core.management import call_command
+        from eventtools.admin import _cancel
+        from eventtools.models import Rule
+
+        festival = ExampleEvent.eventobjects.create(title="Festival", slug="festival")
+        gala = ExampleEvent.eventobjects.create(parent=festival, title="Gala", slug="festival-gala")
+        festival.occurrences.create(start=datetime(2010,1,1, 19,00))
+        gala.occurrences.create(start=datetime(2010,1,3, 19,00), status='fully booked')
+        summary = ExampleEventSummary.objects.get(event=festival)
+        self.ae((summary.first_start, summary.last_start, summary.next_start), (datetime(2010,1,1, 19,00), datetime(2010,1,3, 19,00), None))
+        self.ae((summary.total_count, summary.fully_booked_count, summary.available_count, summary.distinct_times), (2, 1, 1, 1))
+        self.ae(ExampleEventSummary.objects.get(event=gala).total_count, 1)
+
+        # generators refresh the summaries once
+        weekly = Rule.objects.create(frequency="WEEKLY")
+        future = datetime.combine(date.today() + timedelta(days=7), time(14,00))
+        gala.generators.create(start=future, _duration=60, rule=weekly, repeat_until=future.date() + timedelta(days=21))
+        summary = ExampleEventSummary.objects.get(event=festival)
+        self.ae((summary.total_count, summary.next_start, summary.distinct_times), (6, future, 2))
+
+        # so do admin actions
+        _cancel(None, None, gala.occurrences.filter(start__gte=future))
+        self.ae(ExampleEventSummary.objects.get(event=festival).cancelled_count, 4)
+
+        # a listing is one query
+        def listing():
+            return [
+                (e.season(), e.status(), e.occurrence_statuses(), e.next_start(), e.opening_occurrence())
+                for e in ExampleEvent.eventobjects.filter(tree_id=festival.tree_id).select_related('summary')
+            ]
+        self.ae(self.num_queries(listing), 1 + 2)
+        festival = festival.reload()
+        self.ae(festival.occurrence_statuses(), set(['', 'cancelled', 'fully booked']))
+        self.ae(festival.status(), "(various)")
+        self.ae(festival.next_start(), future)
+        self.ae(gala.reload().times_description(), 'Times vary')
+        # (the opening and closing occurrences are fetched by the pks in the
+        # summary)
+        summary = festival.schedule_summary()
+        self.ae(festival.opening_occurrence(), festival.occurrences_in_listing()[0])
+        self.ae(festival.closing_occurrence(), festival.occurrences_in_listing().reverse()[0])
+        self.ae((festival.opening_occurrence().pk, festival.closing_occurrence().pk),
+            (summary.first_occurrence_pk, summary.last_occurrence_pk))
+
+        # the summaries can be rebuilt from scratch
+        before = list(ExampleEventSummary.objects.order_by('event').values())
+        season = festival.season()
+        ExampleEventSummary.objects.all().delete()
+        # (without a summary, the accessors query the occurrences)
+        self.ae(festival.reload().season(), season)
+        call_command('rebuild_event_summaries', verbosity=0)
+        self.ae(list(ExampleEventSummary.objects.filter(event__tree_id=festival.tree_id).order_by('event').values()),
+            [s for s in before if s['event_id'] in (festival.pk, gala.pk)])
+
+        # moving an event out of its parent, or deleting it, refreshes the
+        # parent's summary
+        parade = ExampleEvent.eventobjects.create(title="Parade", slug="parade")
+        float1 = ExampleEvent.eventobjects.create(parent=parade, title="Float", slug="parade-float")
+        float1.occurrences.create(start=datetime(2030,1,1, 10,00))
+        self.ae(ExampleEventSummary.objects.get(event=parade).total_count, 1)
+        float1 = float1.reload()
+        float1.parent = None
+        float1.save()
+        self.ae(ExampleEventSummary.objects.get(event=parade).total_count, 0)
+        self.ae(parade.reload().season(), None)
+        self.ae(ExampleEventSummary.objects.get(event=float1).total_count, 1)
+
+        float2 = ExampleEvent.eventobjects.create(parent=parade.reload(), title="Float 2", slug="parade-float-2")
+        for day in (1, 2, 3):
+            float2.occurrences.create(start=datetime(2030,1,day, 10,00))
+        self.ae(ExampleEventSummary.objects.get(event=parade).total_count, 3)
+        float2.reload().delete()
+        self.ae(ExampleEventSummary.objects.get(event=parade).total_count, 0)
+        self.ae(parade.reload().season(), None)
+
+        # distinct times are counted from one row per time of day
+        for day, hour, minute in ((1, 10, 00), (2, 10, 30), (3, 10, 30), (4, 11, 00)):
+            float1.occurrences.create(start=datetime(2030,2,day, hour,minute))
+        self.ae(ExampleEventSummary.objects.get(event=float1).distinct_times, 3)
+
+    def test_admin_changelist(self):
+        """
+        The events admin changelist takes the same number of queries however
+        many events are on the page.
+        """
+        from django.contrib.auth.models import User
+        from django.test.client import RequestFactory
+        from eventtools.tests.eventtools_testapp.urls import admin_site
+
+        request = RequestFactory().get('/admin/eventtools_testapp/exampleevent/')
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        event_admin = admin_site._registry[ExampleEvent]
+        def changelist():
+            return event_admin.changelist_view(request).render().content
+
+        festival = ExampleEvent.eventobjects.create(title="Festival", slug="festival")
+        festival.occurrences.create(start=datetime(2010,1,1, 19,00))
+        gala = ExampleEvent.eventobjects.create(parent=festival, title="Gala", slug="festival-gala")
+        gala.occurrences.create(start=datetime.now() + timedelta(days=7))
+        gala.occurrences.create(start=datetime.now() + timedelta(days=14))
+        self.assertTrue('3 Occurrences</a> (1 direct, 2 forthcoming)' in changelist())
+        self.assertTrue('2 Occurrences</a> (2 direct, 2 forthcoming)' in changelist())
+        queries = self.num_queries(changelist)
+
+        for i in range(5):
+            event = ExampleEvent.eventobjects.create(parent=festival, title="Talk %s" % i, slug="festival-talk-%s" % i)
+            event.occurrences.create(start=datetime(2010,1,2, 10+i,00))
+        self.ae(self.num_queries(changelist), queries)
+
+        # (events that weren't annotated are counted)
+        self.assertTrue('8 Occurrences</a> (1 direct, 2 forthcoming)' in
+            event_admin.occurrence_link(festival.reload()))
+
+        # the counts are added to the queryset of the admin's superclass
+        from mptt.admin import MPTTModelAdmin
+        from eventtools.admin import EventAdmin
+        class RootsAdmin(MPTTModelAdmin):
+            def queryset(self, request):
+                return super(RootsAdmin, self).queryset(request).filter(parent=None)
+        roots_admin = EventAdmin(ExampleEvent, SuperModel=RootsAdmin)(ExampleEvent, admin_site)
+        events = dict((e, e) for e in roots_admin.queryset(request))
+        self.ae(set(e.parent_id for e in events), set([None]))
+        self.ae(events[festival].listing_occurrence_count, 8)
+
+    def test_change_cascade(self):
         """
         TestEvents are in an mptt tree, which indicates parents (more general) and children (more specific).
         When you save a parent event, every changed field cascades to all children events (and not to parent events).
@@ -9,6 +9,7 @@ from dateutil.relativedelta import relativedelta
 from django.core.urlresolvers import reverse
 from eventtools.models import Rule
 from django.core.exceptions import ValidationError
+from eventtools.conf import settings
 
 class TestGenerators(AppTestCase):
     
@@ -45,9 +46,10 @@ class TestGenerators(AppTestCase):
 
         self.assertTrue(self.endless_generator.occurrences.count() > 52)
 
-        #test re-save event resaves 'boundless' generators, by deleting them first.
+        #test re-save event extends 'boundless' generators, by deleting them first.
         self.endless_generator.occurrences.all().delete()
         self.ae(self.endless_generator.occurrences.count(), 0)
+        ExampleGenerator.objects.filter(pk=self.endless_generator.pk).update(generated_until=None)
         self.bin_night.save()
         self.assertTrue(self.endless_generator.occurrences.count() > 52)
 
@@ -555,3 +557,609 @@ class TestGenerators(AppTestCase):
         self.ae(event.occurrences.filter(generated_by__isnull=True).count(), 1)
         self.ae(event.occurrences.count(), 1)
 
+    def test_sync_query_count(self):
+        """
+        Planning (and so synchronising) occurrences takes the same number of
+        queries, however many occurrences are generated.
+        """
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        short = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,7))
+        long = event.generators.create(start=datetime(2010,1,1, 12,00), _duration=60, rule=self.daily, repeat_until=date(2010,12,31))
+        self.ae(short.occurrences.count(), 7)
+        self.ae(long.occurrences.count(), 365)
+
+        self.ae(
+            self.num_queries(short.plan_changes),
+            self.num_queries(long.plan_changes)
+        )
+
+        # shortening the series removes the orphans in bulk
+        long.repeat_until = date(2010,1,7)
+        long.save()
+        self.ae(long.occurrences.count(), 7)
+        self.ae(event.occurrences.count(), 14)
+
+    def test_plan_changes(self):
+        """
+        plan_changes() previews what saving a generator would do to its
+        occurrences, without changing anything, and save() does exactly that.
+        """
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+        generator = ExampleGenerator.objects.get(pk=generator.pk)
+        occurrences = dict((o.start, o.pk) for o in generator.occurrences.all())
+        ticket = ExampleTicket.objects.create(occurrence_id=occurrences[datetime(2010,1,10, 9,00)])
+
+        # no changes
+        self.assertFalse(generator.plan_changes())
+
+        # moving the start a day later and stopping earlier shifts everything,
+        # adds nothing, and removes the last two occurrences, one of which is
+        # protected by a ticket.
+        generator.start = datetime(2010,1,2, 10,00)
+        generator.repeat_until = date(2010,1,9)
+        self.assertTrue(self.num_queries(generator.plan_changes) <= 6)
+        changes = generator.plan_changes()
+        self.ae(changes.start_shift, timedelta(days=1, hours=1))
+        self.ae(len(changes.shifted), 10)
+        self.ae(changes.shifted[0], (occurrences[datetime(2010,1,1, 9,00)], datetime(2010,1,1, 9,00), datetime(2010,1,2, 10,00)))
+        self.ae(changes.added, [])
+        self.ae(changes.deleted, [(occurrences[datetime(2010,1,9, 9,00)], datetime(2010,1,10, 10,00))])
+        self.ae(changes.unhooked, [(occurrences[datetime(2010,1,10, 9,00)], datetime(2010,1,11, 10,00))])
+        # nothing was written
+        self.ae(dict((o.start, o.pk) for o in generator.occurrences.all()), occurrences)
+
+        generator.save()
+        self.ae(generator.occurrences.count(), 8)
+        self.ae(generator.occurrences.all()[0].start, datetime(2010,1,2, 10,00))
+        self.assertFalse(ExampleOccurrence.objects.filter(pk=changes.deleted[0][0]).exists())
+        unhooked = ExampleOccurrence.objects.get(pk=changes.unhooked[0][0])
+        self.ae(unhooked.generated_by, None)
+        self.ae(unhooked.start, datetime(2010,1,11, 10,00))
+
+        # a new generator just adds occurrences, except where they clash
+        other = ExampleGenerator(event=event, start=datetime(2010,1,8, 10,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,12))
+        changes = other.plan_changes()
+        self.ae(changes.added, [datetime(2010,1,10, 10,00), datetime(2010,1,12, 10,00)])
+        self.ae(changes.shifted + changes.deleted + changes.unhooked, [])
+
+    def test_bulk_timeshift(self):
+        """
+        Changing a generator's start or duration shifts all its occurrences
+        in a few queries, and sends a single occurrences_changed signal.
+        """
+        from eventtools.signals import occurrences_changed
+
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,12,31))
+        ids = set(generator.occurrences.values_list('id', flat=True))
+        self.ae(len(ids), 365)
+
+        received = []
+        def listener(sender, **kwargs):
+            received.append(kwargs)
+        occurrences_changed.connect(listener)
+        try:
+            generator.start = datetime(2010,1,2, 8,30)
+            generator.repeat_until = date(2011,1,1)
+            generator._duration = 90
+            self.assertTrue(self.num_queries(generator.save) < 20)
+        finally:
+            occurrences_changed.disconnect(listener)
+
+        self.ae(len(received), 1)
+        self.ae(set(received[0]['updated']), ids)
+        self.ae(set(generator.occurrences.values_list('id', flat=True)), ids)
+        for o in generator.occurrences.all():
+            self.ae(o.start.time(), time(8,30))
+            self.ae(o._duration, 90)
+            self.ae(o._end, o.end())
+        self.ae(generator.occurrences.all()[0].start, datetime(2010,1,2, 8,30))
+
+    def test_bulk_timeshift_parking(self):
+        """
+        Occurrences are parked out of the way of their final starts while
+        they are timeshifted, whatever order the rows are updated in.
+        """
+        # (so that the generator's occurrences are the latest in the table)
+        ExampleOccurrence.objects.all().delete()
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+        # the first occurrence is the last row
+        first = generator.occurrences.get(start=datetime(2010,1,1, 9,00))
+        first.delete()
+        first.pk = None
+        first.save()
+
+        generator.start = datetime(2010,1,2, 9,00)
+        generator.repeat_until = date(2010,1,11)
+        generator.save()
+        self.ae(list(generator.occurrences.order_by('start').values_list('start', flat=True)),
+            [datetime(2010,1,d, 9,00) for d in range(2, 12)])
+
+    def test_extend_to(self):
+        """
+        Generators record the date they have generated until. extend_to()
+        generates only the occurrences after that date, and saving an event
+        extends its endless generators.
+        """
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+        self.ae(generator.generated_until, date(2010,1,10))
+        self.ae(generator.occurrences.count(), 10)
+
+        # pretend only the first 5 days have been generated
+        generator.occurrences.filter(start__gt=datetime(2010,1,5, 23,59)).delete()
+        generator.occurrences.filter(start=datetime(2010,1,3, 9,00)).delete()
+        generator.generated_until = date(2010,1,5)
+
+        generator.extend_to(date(2010,1,7))
+        self.ae(generator.generated_until, date(2010,1,7))
+        # the occurrence before the high-water mark isn't regenerated
+        self.ae(generator.occurrences.count(), 6)
+        self.ae(ExampleGenerator.objects.get(pk=generator.pk).generated_until, date(2010,1,7))
+
+        # extending is clamped to repeat_until
+        generator.extend_to(date(2010,2,1))
+        self.ae(generator.generated_until, date(2010,1,10))
+        self.ae(generator.occurrences.count(), 9)
+
+        # extending to an earlier date does nothing
+        self.ae(self.num_queries(generator.extend_to, date(2010,1,8)), 0)
+
+        # saving the generator resynchronises the whole series
+        generator.save()
+        self.ae(generator.occurrences.count(), 10)
+
+        # saving the event extends endless generators up to the generator limit
+        endless = self.endless_generator
+        ExampleGenerator.objects.filter(pk=endless.pk).update(generated_until=date(2010,6,1))
+        endless.occurrences.filter(start__gt=datetime(2010,6,1, 23,59)).delete()
+        self.bin_night.save()
+        endless = ExampleGenerator.objects.get(pk=endless.pk)
+        self.ae(endless.generated_until, date.today() + settings.DEFAULT_GENERATOR_LIMIT)
+        self.assertTrue(endless.occurrences.filter(start__gt=datetime(2010,6,1, 23,59)).count() > 52)
+
+        # extending by a day only loads the occurrences after the generated
+        # date, and saving again extends nothing
+        from django.db import connection
+        last = endless.occurrences.order_by('-start')[0]
+        last.delete()
+        ExampleGenerator.objects.filter(pk=endless.pk).update(generated_until=last.start.date() - timedelta(1))
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            first = len(connection.queries)
+            self.bin_night.reload().save()
+            # (the snapshot reads the listing's occurrences with their generators)
+            listing_queries = [q['sql'] for q in connection.queries[first:]
+                if q['sql'].startswith('SELECT') and 'generated_by_id' in q['sql']
+                and '"event_lft" >=' in q['sql']]
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+        self.ae(len(listing_queries), 1)
+        self.assertTrue('"start" >' in listing_queries[0])
+        self.ae(endless.occurrences.filter(start=last.start).count(), 1)
+        self.ae(self.num_queries(self.bin_night.reload().save), 4)
+
+        # generators with an end date are generated up to it, however far away
+        start = datetime.combine(date.today(), time(9,00))
+        until = date.today() + relativedelta(years=2)
+        generator = event.generators.create(start=start, _duration=60, rule=self.daily, repeat_until=until)
+        self.ae(generator.generated_until, until)
+        self.ae(generator.occurrences.count(), (until - date.today()).days + 1)
+
+    def test_extend_generators_command(self):
+        """
+        The extend_generators command extends every generator that hasn't
+        generated up to the limit, and can safely be re-run.
+        """
+        from django.core.management import call_command
+
+        endless = self.endless_generator
+        ExampleGenerator.objects.filter(pk=endless.pk).update(generated_until=date(2010,6,1))
+        endless.occurrences.filter(start__gt=datetime(2010,6,1, 23,59)).delete()
+
+        call_command('extend_generators', processes=1, verbosity=0)
+        endless = ExampleGenerator.objects.get(pk=endless.pk)
+        self.ae(endless.generated_until, date.today() + settings.DEFAULT_GENERATOR_LIMIT)
+        count = endless.occurrences.count()
+        self.assertTrue(endless.occurrences.filter(start__gt=datetime(2010,6,1, 23,59)).count() > 52)
+        # generators with a repeat_until aren't changed
+        self.ae(ExampleGenerator.objects.get(pk=self.weekly_generator.pk).generated_until, date(2010,2,5))
+
+        call_command('extend_generators', processes=1, verbosity=0)
+        self.ae(endless.occurrences.count(), count)
+
+    def test_clash_resolution_is_targeted(self):
+        """
+        When a generator releases starts, only the other generators whose
+        rules hit those starts generate occurrences, and the others cost no
+        queries.
+        """
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,3,31))
+        dupe = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,3,31))
+        self.ae(dupe.occurrences.count(), 0)
+
+        def move(hour):
+            generator.start = datetime(2010,1,1, hour,00)
+            generator.save()
+
+        move(10)
+        self.ae(dupe.occurrences.count(), 90)
+        self.ae(generator.occurrences.count(), 90)
+        few_siblings = self.num_queries(move, 11)
+
+        for hour in range(12, 20):
+            event.generators.create(start=datetime(2010,1,1, hour,30), _duration=60, rule=self.daily, repeat_until=date(2010,3,31))
+        self.ae(self.num_queries(move, 10), few_siblings)
+        self.ae(event.occurrences.count(), 90 * 10)
+
+    def test_virtual_occurrences(self):
+        """
+        If MATERIALISE_GENERATED_OCCURRENCES is False, generators don't store
+        occurrences. between_with_virtual() merges the stored occurrences
+        with virtual ones computed from the generators' rules.
+        """
+        from django.conf import settings as django_settings
+        django_settings.MATERIALISE_GENERATED_OCCURRENCES = False
+        try:
+            event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+            generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,31))
+            self.ae(generator.occurrences.count(), 0)
+            # (plans list the starts they'd generate as virtual, not added)
+            generator.repeat_until = date(2010,2,2)
+            changes = generator.plan_changes()
+            self.ae((changes.added, len(changes.virtual)), ([], 33))
+            self.assertFalse(changes)
+            generator.repeat_until = date(2010,1,31)
+
+            event.exclusions.create(start=datetime(2010,1,3, 9,00))
+            one_off = event.occurrences.create(start=datetime(2010,1,2, 9,00), status='cancelled')
+            evening = event.occurrences.create(start=datetime(2010,1,2, 19,00))
+
+            generators = ExampleGenerator.objects.filter(event=event)
+            occurrences = event.occurrences.between_with_virtual(date(2010,1,1), date(2010,1,4), generators=generators)
+            self.ae(
+                [o.start for o in occurrences],
+                [datetime(2010,1,1, 9,00), datetime(2010,1,2, 9,00), datetime(2010,1,2, 19,00), datetime(2010,1,4, 9,00)]
+            )
+            self.ae([o.is_virtual() for o in occurrences], [True, False, False, True])
+            self.ae(occurrences[1], one_off)
+            self.ae(occurrences[0].duration, timedelta(seconds=3600))
+
+            # nothing after repeat_until
+            self.ae(event.occurrences.between_with_virtual(date(2010,2,1), date(2010,2,28), generators=generators), [])
+
+            # materialising stores the occurrence
+            o = occurrences[0].materialise()
+            self.assertTrue(o.pk)
+            self.ae(o.generated_by, generator)
+            self.ae(generator.occurrences.count(), 1)
+            occurrences = event.occurrences.between_with_virtual(date(2010,1,1), date(2010,1,1), generators=generators)
+            self.ae(occurrences, [o])
+            self.ae(occurrences[0].is_virtual(), False)
+
+            # re-saving the generator keeps it hooked up
+            generator.save()
+            self.ae(list(generator.occurrences.all()), [o])
+        finally:
+            del django_settings.MATERIALISE_GENERATED_OCCURRENCES
+
+    def test_compiled_rule_cache(self):
+        """
+        Rules are compiled once per process, and recompiled when they change.
+        """
+        rule = Rule.objects.create(frequency="WEEKLY", params="byweekday:0,2")
+        dtstart = datetime(2012,3,12, 10,30) # a Monday
+        compiled = rule.compiled()
+        self.assertTrue(Rule.objects.get(pk=rule.pk).compiled() is compiled)
+        self.ae(list(rule.get_rrule(dtstart)[:3]), [datetime(2012,3,12, 10,30), datetime(2012,3,14, 10,30), datetime(2012,3,19, 10,30)])
+        self.assertTrue(rule.get_rrule(dtstart) is rule.get_rrule(dtstart))
+
+        rule.params = "byweekday:1"
+        rule.save()
+        self.assertTrue(rule.compiled() is not compiled)
+        self.ae(list(rule.get_rrule(dtstart)[:2]), [datetime(2012,3,13, 10,30), datetime(2012,3,20, 10,30)])
+
+        # complex rules have their tokens replaced
+        rule = Rule.objects.create(frequency="MONTHLY", complex_rule="RRULE:FREQ=MONTHLY;BYDAY=%nthday%")
+        self.ae(list(rule.get_rrule(dtstart)[:2]), [datetime(2012,3,12, 10,30), datetime(2012,4,9, 10,30)])
+        rule = Rule.objects.create(frequency="MONTHLY", complex_rule="RRULE:FREQ=MONTHLY;BYDAY=%-nthday%")
+        self.ae(list(rule.get_rrule(dtstart)[:2]), [datetime(2012,3,12, 10,30), datetime(2012,4,16, 10,30)])
+
+        # rules bound to the same instant in different timezones repeat in
+        # their own timezone
+        import pytz
+        rule = Rule.objects.create(frequency="WEEKLY", params="byweekday:0")
+        sydney = pytz.timezone('Australia/Sydney').localize(datetime(2012,3,13, 9,00)) # a Tuesday
+        utc = sydney.astimezone(pytz.utc) # 22:00 on Monday
+        self.ae(list(rule.get_rrule(sydney)[:1]), [pytz.timezone('Australia/Sydney').localize(datetime(2012,3,19, 9,00))])
+        self.ae(rule.get_rrule(utc)[0].tzinfo, pytz.utc)
+        self.ae(rule.get_rrule(utc)[0], pytz.utc.localize(datetime(2012,3,12, 22,00)))
+
+    def test_fast_rule_expansion(self):
+        """
+        Simple DAILY and WEEKLY rules are expanded with NumPy, when it's
+        available, giving exactly the same datetimes as dateutil.
+        """
+        from eventtools.utils import fastrrule
+        if fastrrule.np is None:
+            return
+        import random
+        import pytz
+        from itertools import takewhile
+        random.seed(1234)
+        sydney = pytz.timezone('Australia/Sydney')
+
+        def random_params():
+            params = {}
+            if random.random() < 0.5:
+                params['interval'] = random.randint(1, 4)
+            if random.random() < 0.3:
+                params['count'] = random.randint(1, 40)
+            if random.random() < 0.3:
+                params['wkst'] = random.randint(0, 6)
+            for k, n, lo, hi in [
+                ('byweekday', 3, 0, 6), ('bymonth', 4, 1, 12), ('bymonthday', 5, 1, 31),
+                ('byhour', 2, 0, 23), ('byminute', 2, 0, 59), ('bysecond', 2, 0, 59),
+            ]:
+                if random.random() < 0.3:
+                    params[k] = random.sample(range(lo, hi+1), random.randint(1, n))
+            return ";".join("%s:%s" % (k, ",".join(str(v) for v in (vs if isinstance(vs, list) else [vs]))) for k, vs in params.items())
+
+        for i in range(200):
+            rule = Rule(frequency=random.choice(["DAILY", "WEEKLY"]), params=random_params())
+            dtstart = datetime(2012,1,1) + timedelta(seconds=random.randint(0, 2*365*24*3600), microseconds=random.randint(0, 999999))
+            until = dtstart + timedelta(days=random.randint(0, 400))
+            if i % 2:
+                # around daylight saving changes, wall clock times are kept
+                dtstart = sydney.normalize(sydney.localize(dtstart))
+                until = until.replace(tzinfo=dtstart.tzinfo)
+            compiled = rule.compiled()
+            self.assertTrue(fastrrule.can_expand(compiled))
+            expected = list(takewhile(lambda d: d <= until, compiled._bind(dtstart)))
+            self.ae(fastrrule.expand(compiled, dtstart, until), expected, "%s %s %s" % (rule.frequency, rule.params, dtstart))
+
+        # Anything else is left to dateutil
+        self.assertEqual(fastrrule.expand(Rule(frequency="MONTHLY").compiled(), dtstart, until), None)
+        self.assertEqual(fastrrule.expand(Rule(frequency="WEEKLY", params="bysetpos:1").compiled(), dtstart, until), None)
+        self.assertEqual(fastrrule.expand(Rule(frequency="WEEKLY", complex_rule="RRULE:FREQ=WEEKLY;BYDAY=%nthday%").compiled(), dtstart, until), None)
+
+    def test_deferred_generation(self):
+        """
+        With GENERATION_MODE = 'deferred', saving a generator records a job,
+        which process_generation_jobs processes. Jobs are coalesced per
+        generator, and processing them is idempotent.
+        """
+        import django.conf
+        from django.core.management import call_command
+        from eventtools.generation import process_pending
+        from eventtools.models import GenerationJob
+
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        django.conf.settings.GENERATION_MODE = 'deferred'
+        try:
+            generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+            generator.start = datetime(2010,1,1, 10,00)
+            generator.save()
+            self.ae(generator.occurrences.count(), 0)
+            self.ae(GenerationJob.objects.count(), 1)
+            self.ae(GenerationJob.objects.status_for_event(event), {'status': 'pending', 'pending': 1, 'failed': 0, 'errors': []})
+
+            self.ae(process_pending(), (1, 0))
+            self.ae(generator.occurrences.count(), 10)
+            self.ae(generator.occurrences.all()[0].start, datetime(2010,1,1, 10,00))
+            self.ae(GenerationJob.objects.status_for_event(event)['status'], 'done')
+            self.ae(ExampleGenerator.objects.get(pk=generator.pk).generated_until, date(2010,1,10))
+            ids = set(generator.occurrences.values_list('id', flat=True))
+
+            # occurrences are timeshifted from the state they were generated
+            # in, however many times the generator is saved meanwhile.
+            generator.start = datetime(2010,1,1, 11,00)
+            generator.save()
+            generator.start = datetime(2010,1,1, 12,00)
+            generator.save()
+            self.ae(GenerationJob.objects.count(), 1)
+            call_command('process_generation_jobs', verbosity=0)
+            self.ae(set(generator.occurrences.values_list('id', flat=True)), ids)
+            self.ae(generator.occurrences.all()[0].start, datetime(2010,1,1, 12,00))
+            self.ae(process_pending(), (0, 0))
+
+            # failed jobs are reported, and can be retried
+            generator.repeat_until = date(2010,1,5)
+            generator.save()
+            GenerationJob.objects.update(status=GenerationJob.FAILED, error="Oops")
+            self.ae(GenerationJob.objects.status_for_event(event), {'status': 'failed', 'pending': 0, 'failed': 1, 'errors': ["Oops"]})
+            self.ae(process_pending(), (0, 0))
+            self.ae(GenerationJob.objects.retry_failed(), 1)
+            self.ae(process_pending(), (1, 0))
+            self.ae(generator.occurrences.count(), 5)
+        finally:
+            del django.conf.settings.GENERATION_MODE
+
+    def test_schedule_snapshot(self):
+        """
+        Generators saved together share a snapshot of the event's schedule,
+        which is loaded once, and kept up to date as they change occurrences.
+        """
+        from eventtools.snapshot import schedule_snapshot
+
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        morning = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+        evening = event.generators.create(start=datetime(2010,1,1, 19,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+        event.exclusions.create(start=datetime(2010,1,5, 19,00))
+        generators = list(event.generators.select_related('rule'))
+        for g in generators:
+            g.event = event
+
+        with schedule_snapshot(event) as snapshot:
+            generators[0].plan_changes()
+            # everything else is read from the snapshot
+            self.ae(self.num_queries(generators[1].plan_changes), 0)
+            occurrence = evening.occurrences.all()[0]
+            occurrence.event = event
+            occurrence.start = datetime(2010,1,5, 19,00)
+            self.ae(self.num_queries(occurrence.is_exclusion), 0)
+            self.assertTrue(occurrence.is_exclusion())
+
+            # the snapshot follows the changes that generators make
+            generators[0].repeat_until = date(2010,1,5)
+            generators[0].save()
+            self.ae(generators[0].occurrences.count(), 5)
+            self.assertFalse(datetime(2010,1,6, 9,00) in snapshot.taken)
+            lunch = event.generators.create(start=datetime(2010,1,1, 12,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+            self.assertTrue(datetime(2010,1,6, 12,00) in snapshot.taken)
+            self.ae(self.num_queries(generators[1].plan_changes), 0)
+            self.assertFalse(lunch.plan_changes())
+
+        # (the excluded evening occurrence was unhooked, not deleted)
+        self.ae(event.occurrences.count(), 5 + 10 + 10)
+
+    def test_bulk_create_with_occurrences(self):
+        """
+        Generators can be imported in bulk. Their occurrences are generated as
+        if they had been saved in turn, and written in chunks.
+        """
+        talk = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        signed_talk = ExampleEvent.eventobjects.create(title="Daily Talk (signed)", slug="daily-talk-signed", parent=talk)
+        signed_talk.occurrences.create(start=datetime(2010,1,3, 9,00), _duration=60)
+        talk.exclusions.create(start=datetime(2010,1,5, 9,00))
+        talk, signed_talk = talk.reload(), signed_talk.reload()
+
+        generators = [
+            ExampleGenerator(event=talk, start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10)),
+            ExampleGenerator(event=talk, start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10)),
+            ExampleGenerator(event=signed_talk, start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10)),
+        ]
+        progress = []
+        created = ExampleGenerator.objects.bulk_create_with_occurrences(
+            generators, chunk_size=5,
+            progress=lambda done, total: progress.append((done, total)))
+
+        self.ae(created, 8 + 9)
+        self.ae(progress, [(5, 17), (10, 17), (15, 17), (17, 17)])
+        self.ae([g.occurrences.count() for g in generators], [8, 0, 9])
+        self.ae(ExampleGenerator.objects.get(pk=generators[0].pk).generated_until, date(2010,1,10))
+        # the imported generators behave as if they had been saved
+        self.assertFalse(generators[0].plan_changes())
+        self.assertFalse(generators[2].plan_changes())
+
+        # apart from saving the generators, importing more of them doesn't
+        # take more queries (their events and rules are fetched at once)
+        def import_talks(n):
+            event = ExampleEvent.eventobjects.create(title="Talks", slug="talks-%s" % n)
+            return self.num_queries(ExampleGenerator.objects.bulk_create_with_occurrences, [
+                ExampleGenerator(event_id=event.pk, start=datetime(2010,1,1, 9+i,00), _duration=30, rule_id=self.daily.pk, repeat_until=date(2010,1,10))
+                for i in range(n)
+            ])
+        self.ae(import_talks(5) - import_talks(1), 4)
+
+    def test_bulk_removal(self):
+        """
+        Occurrences are deleted or unhooked in bulk, in a number of queries
+        that doesn't depend on how many there are.
+        """
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,12,31))
+        self.ae(generator.occurrences.count(), 365)
+        tickets = [
+            ExampleTicket.objects.create(occurrence=o)
+            for o in generator.occurrences.filter(start__gte=datetime(2010,7,1))[:3]
+        ]
+
+        deleted, unhooked = generator.occurrences.filter(start__lt=datetime(2010,1,11)).delete_or_unhook()
+        self.ae((len(deleted), unhooked), (10, []))
+        self.ae(deleted[0], (deleted[0][0], datetime(2010,1,1, 9,00)))
+
+        removals = self.num_queries(generator.occurrences.filter(start__gte=datetime(2010,7,1)).delete_or_unhook)
+        # (including refreshing the event's summary)
+        self.assertTrue(removals < 16)
+        self.ae(generator.occurrences.count(), 171)
+        self.ae(event.occurrences.filter(generated_by=None).count(), 3)
+        self.ae(set(ExampleTicket.objects.values_list('occurrence__generated_by', flat=True)), set([None]))
+
+        generator.delete()
+        self.ae(event.occurrences.count(), 3)
+
+        # occurrences are also unhooked if deleting them would cascade to
+        # something protected
+        generator = event.generators.create(start=datetime(2011,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2011,1,31))
+        protected = generator.occurrences.get(start=datetime(2011,1,20, 9,00))
+        ExampleBookingTicket.objects.create(booking=ExampleBooking.objects.create(occurrence=protected))
+        ExampleBooking.objects.create(occurrence=generator.occurrences.get(start=datetime(2011,1,21, 9,00)))
+        deleted, unhooked = generator.occurrences.all().delete_or_unhook()
+        self.ae((len(deleted), unhooked), (30, [(protected.pk, protected.start)]))
+        self.ae(ExampleOccurrence.objects.get(pk=protected.pk).generated_by, None)
+        self.ae(ExampleBooking.objects.count(), 1)
+
+        # saving a generator removes occurrences as planned, without looking
+        # up the protected ones again
+        generator = event.generators.create(start=datetime(2012,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2012,1,31))
+        protected = generator.occurrences.get(start=datetime(2012,1,20, 9,00))
+        ExampleTicket.objects.create(occurrence=protected)
+        generator.repeat_until = date(2012,1,10)
+        changes = generator.plan_changes()
+        self.ae((len(changes.deleted), changes.unhooked), (20, [(protected.pk, protected.start)]))
+        lookups = []
+        protected_pks = ExampleOccurrence.protected_pks
+        ExampleOccurrence.protected_pks = classmethod(
+            lambda cls, pks: lookups.append(pks) or protected_pks(pks))
+        try:
+            generator._apply_changes(changes)
+            self.ae(lookups, [])
+            # (unless something has come to protect the others since)
+            generator.repeat_until = date(2012,1,5)
+            changes = generator.plan_changes()
+            late = generator.occurrences.get(start=datetime(2012,1,8, 9,00))
+            ExampleTicket.objects.create(occurrence=late)
+            del lookups[:]
+            generator._apply_changes(changes)
+            self.ae(len(lookups), 1)
+        finally:
+            ExampleOccurrence.protected_pks = protected_pks
+        self.ae(generator.occurrences.count(), 5)
+        self.ae(set(event.occurrences.filter(generated_by=None, start__year=2012)), set([protected, late]))
+
+    def test_occurrences_changed(self):
+        """
+        Generators send occurrences_changed once per change, with the ids of
+        the occurrences that were added, updated, unhooked and deleted, and
+        can be told not to send per-occurrence signals.
+        """
+        import django.conf
+        from django.db.models.signals import post_delete
+        from eventtools.signals import occurrences_changed
+
+        event = ExampleEvent.eventobjects.create(title="Daily Talk", slug="daily-talk")
+        received, deletions = [], []
+        def listener(sender, generator, **kwargs):
+            received.append((generator, kwargs))
+        def row_listener(sender, instance, **kwargs):
+            deletions.append(instance.pk)
+        occurrences_changed.connect(listener)
+        post_delete.connect(row_listener, sender=ExampleOccurrence)
+        django.conf.settings.GENERATOR_ROW_SIGNALS = True
+        try:
+            generator = event.generators.create(start=datetime(2010,1,1, 9,00), _duration=60, rule=self.daily, repeat_until=date(2010,1,10))
+            ids = list(generator.occurrences.values_list('id', flat=True))
+            self.ae(received, [(generator, {'signal': occurrences_changed, 'added': ids, 'updated': [], 'unhooked': [], 'deleted': []})])
+
+            ticket = ExampleTicket.objects.create(occurrence_id=ids[-1])
+            del received[:]
+            generator.repeat_until = date(2010,1,7)
+            generator.save()
+            self.ae(received[0][1]['unhooked'], ids[-1:])
+            self.ae(received[0][1]['deleted'], ids[7:9])
+            self.ae(sorted(deletions), ids[7:9])
+
+            django.conf.settings.GENERATOR_ROW_SIGNALS = False
+            del received[:]
+            generator.delete()
+            self.ae(received[0][1]['deleted'], ids[:7])
+            self.ae(sorted(deletions), ids[7:9])
+        finally:
+            occurrences_changed.disconnect(listener)
+            post_delete.disconnect(row_listener, sender=ExampleOccurrence)
+            del django.conf.settings.GENERATOR_ROW_SIGNALS
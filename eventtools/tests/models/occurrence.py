@@ -1,9 +1,10 @@
 # -*- coding: utf-8“ -*-
-from django.db import IntegrityError
+from django.db import IntegrityError, models
 from django.test import TestCase
 from eventtools.tests._fixture import fixture
 from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase
 from eventtools.tests.eventtools_testapp.models import *
+from eventtools.models import Rule
 from datetime import date, time, datetime, timedelta
 from eventtools.utils import datetimeify
 
@@ -131,6 +132,129 @@ class TestOccurrences(AppTestCase):
         self.assertTrue(o.time_to_go() < timedelta(0))
         self.ae(o2.time_to_go(), timedelta(0))
 
+    def test_stored_end(self):
+        """
+        Occurrences store their end, so that we can query it. It is kept up to
+        date on save and bulk_create, and can be recomputed in bulk.
+        """
+        e = ExampleEvent.eventobjects.create(title="event with occurrences")
+        now = datetime.now()
+
+        o = e.occurrences.create(start=datetime(2010,1,1, 9,00), _duration=25*60)
+        o2 = e.occurrences.create(start=now - timedelta(seconds=600), _duration=20)
+        ExampleOccurrence.objects.bulk_create([
+            ExampleOccurrence(event=e, start=datetime(2010,1,3, 0,00)),
+        ])
+        o3 = e.occurrences.get(start=datetime(2010,1,3, 0,00))
+
+        self.ae(o._end, datetime(2010,1,2, 10,00))
+        self.ae(o3._end, o3.start)
+        self.ae(list(e.occurrences.finished()), [o, o3])
+        self.ae(list(e.occurrences.unfinished()), [o2])
+        self.ae(list(e.occurrences.ends_before(date(2010,1,1))), [])
+        self.ae(list(e.occurrences.ends_before(date(2010,1,2))), [o])
+        self.ae(list(e.occurrences.ends_after(date(2010,1,2))), [o, o3, o2])
+        self.ae(list(e.occurrences.filter(start__lt=datetime(2010,1,2)).ends_after(date(2010,1,2))), [o])
+
+        o.start = datetime(2010,1,5, 9,00)
+        o.save()
+        self.ae(e.occurrences.get(pk=o.pk)._end, datetime(2010,1,6, 10,00))
+
+        # update() doesn't maintain the end, but update_ends() recomputes it.
+        e.occurrences.update(start=models.F('start') + timedelta(days=365), _end=None)
+        self.ae(e.occurrences.filter(_end=None).count(), 3)
+        e.occurrences.all().update_ends()
+        for o in e.occurrences.all():
+            self.ae(o._end, o.end())
+
+    def test_overlapping(self):
+        """
+        We can query for occurrences that are on at any time in a range,
+        including those that started before it.
+        """
+        e = ExampleEvent.eventobjects.create(title="event with occurrences")
+        exhibition = e.occurrences.create(start=datetime(2010,1,1, 10,00), _duration=30*24*60)
+        talk = e.occurrences.create(start=datetime(2010,1,15, 18,00), _duration=60)
+        party = e.occurrences.create(start=datetime(2010,1,31, 9,00), _duration=120)
+        now_on = e.occurrences.create(start=datetime.now() - timedelta(seconds=600), _duration=20)
+
+        self.ae(list(e.occurrences.overlapping(date(2010,1,15), date(2010,1,16))), [exhibition, talk])
+        self.ae(list(e.occurrences.overlapping(datetime(2010,1,15, 18,30), datetime(2010,1,31, 9,30))), [exhibition, talk, party])
+        self.ae(list(e.occurrences.on_day_overlapping(date(2010,1,20))), [exhibition])
+        self.ae(list(e.occurrences.on_day_overlapping(date(2010,2,1))), [])
+        self.ae(list(e.occurrences.on_day_overlapping(date(2010,1,20), max_duration=timedelta(days=31))), [exhibition])
+        # (max_duration must be at least the longest timespan)
+        self.ae(list(e.occurrences.on_day_overlapping(date(2010,1,20), max_duration=timedelta(days=7))), [])
+        self.ae(list(ExampleOccurrence.objects.now_on()), [now_on])
+
+    def test_interval_index(self):
+        """
+        An OccurrenceIntervalIndex answers the same overlap questions as the
+        queries, in memory, and can be updated as occurrences change.
+        """
+        from eventtools.utils.intervals import OccurrenceIntervalIndex
+
+        e = ExampleEvent.eventobjects.create(title="event with occurrences")
+        exhibition = e.occurrences.create(start=datetime(2010,1,1, 9,00), _duration=30*24*60)
+        for day in range(1, 32):
+            for hour in (10, 14, 18):
+                e.occurrences.create(start=datetime(2010,1,day, hour,00), _duration=60)
+        occurrences = e.occurrences.all()
+
+        self.ae(self.num_queries(OccurrenceIntervalIndex.from_queryset, occurrences), 1)
+        index = OccurrenceIntervalIndex.from_queryset(occurrences)
+        self.ae(len(index), 1 + 31 * 3)
+        windows = [
+            (date(2010,1,5), date(2010,1,5)),
+            (datetime(2010,1,5, 11,00), datetime(2010,1,5, 14,00)),
+            (datetime(2010,1,31, 10,30), datetime(2010,2,3)),
+            (date(2010,2,1), date(2010,2,2)),
+        ]
+        for d1, d2 in windows:
+            self.ae(index.overlapping(d1, d2), list(occurrences.overlapping(d1, d2).values_list('pk', flat=True)))
+        at = e.occurrences.get(start=datetime(2010,1,7, 14,00))
+        self.ae(index.at(datetime(2010,1,7, 14,30)), [exhibition.pk, at.pk])
+        self.ae(index.at(datetime(2010,1,7, 15,00)), [exhibition.pk, at.pk])
+        self.ae(index.at(datetime(2010,1,7, 15,01)), [exhibition.pk])
+        self.ae(index.next_after(datetime(2010,1,7, 14,00), count=2), list(
+            occurrences.filter(start__gt=datetime(2010,1,7, 14,00)).values_list('pk', flat=True)[:2]))
+
+        index.insert(-1, datetime(2010,1,7, 15,00), datetime(2010,1,7, 16,00))
+        index.remove(at.pk, at.start)
+        self.ae(index.at(datetime(2010,1,7, 15,00)), [exhibition.pk, -1])
+        self.assertRaises(KeyError, index.remove, at.pk, at.start)
+        self.ae(len(index), 1 + 31 * 3)
+
+    def test_find_overlaps(self):
+        """
+        We can find the pairs of occurrences that clash, optionally within
+        groups, and check a generator's changes for clashes before saving it.
+        """
+        talks = ExampleEvent.eventobjects.create(title="talks")
+        tours = ExampleEvent.eventobjects.create(title="tours")
+        talk = talks.occurrences.create(start=datetime(2010,1,1, 10,00), _duration=60)
+        # (only touches the talk)
+        late_talk = talks.occurrences.create(start=datetime(2010,1,1, 11,00), _duration=60)
+        tour = tours.occurrences.create(start=datetime(2010,1,1, 10,30), _duration=120)
+        other_tour = tours.occurrences.create(start=datetime(2010,1,1, 12,00), _duration=60)
+
+        def pairs(overlaps):
+            return [(a[3], b[3]) for a, b in overlaps]
+
+        occurrences = ExampleOccurrence.objects.filter(event__in=[talks, tours])
+        self.ae(pairs(occurrences.find_overlaps()), [
+            (talk.pk, tour.pk), (tour.pk, late_talk.pk), (tour.pk, other_tour.pk),
+        ])
+        self.ae(pairs(occurrences.find_overlaps(group_by='event')), [(tour.pk, other_tour.pk)])
+        self.ae(list(talks.occurrences.find_overlaps()), [])
+
+        weekly = Rule.objects.create(frequency="WEEKLY")
+        generator = ExampleGenerator(event=talks, start=datetime(2010,1,1, 11,30), _duration=60, rule=weekly, repeat_until=date(2010,1,15))
+        clashes = generator.plan_changes().clashes(tours.occurrences.all())
+        self.ae([(start, occurrence[3]) for start, occurrence in clashes], [
+            (datetime(2010,1,1, 11,30), tour.pk), (datetime(2010,1,1, 11,30), other_tour.pk),
+        ])
+
 """
 TODO
 
@@ -54,6 +54,10 @@ class TestEventTree(AppTestCase):
         qs = ExampleEvent.eventobjects.in_listings()
         self.ae(qs.count(), 3)
         self.ae(set(list(qs.filter())), set([self.talk1, self.talk2, self.tour]))
+        self.ae(self.num_queries(lambda: list(qs)), 1)
+        # (filtered querysets give those of their events that are listed)
+        self.ae(list(ExampleEvent.eventobjects.filter(pk__in=[self.talk2.pk, self.talk2a.pk]).in_listings()), [self.talk2])
+        self.ae(list(ExampleEvent.eventobjects.filter(pk=self.glen_tour.pk).in_listings()), [])
 
         #the 'direct' occurrences of an event are default and direct
         self.ae(self.tour.occurrences.count(), 26)
@@ -70,6 +74,10 @@ class TestEventTree(AppTestCase):
         self.ae(self.talk1.occurrences_in_listing().count(), 2)
         self.ae(self.talk2.occurrences_in_listing().count(), 2)
         self.ae(self.talk2a.occurrences_in_listing().count(), 1)
+        # (which are found, and ordered, without joining the events table)
+        self.assertFalse('JOIN' in str(self.tour.occurrences_in_listing().query))
+        self.ae(list(self.talks.occurrences_in_listing()), list(
+            ExampleOccurrence.objects.filter(event__in=[self.talk1, self.talk2, self.talk2a])))
 
     def test_methods(self):
         #an event knows the event it is listed under
@@ -80,6 +88,24 @@ class TestEventTree(AppTestCase):
         self.ae(self.talk2.listed_under(), self.talk2)
         self.ae(self.talk2a.listed_under(), self.talk2)
 
+        #...which can be worked out for a queryset at once
+        qs = ExampleEvent.eventobjects.annotate_listed_under()
+        self.ae(self.num_queries(lambda: list(qs)), 1)
+        events = list(qs)
+        self.ae(dict((e, e.listed_under()) for e in events), {
+            self.tour: self.tour, self.glen_tour: self.tour,
+            self.talks: None, self.talk1: self.talk1,
+            self.talk2: self.talk2, self.talk2a: self.talk2,
+        })
+        self.ae(self.num_queries(lambda: [e.is_listed() for e in events]), 0)
+        self.ae(set(e for e in events if e.is_listed()), set([self.tour, self.talk1, self.talk2]))
+        # (for filtered querysets, the events they're listed under are fetched)
+        qs = ExampleEvent.eventobjects.filter(pk=self.glen_tour.pk).annotate_listed_under()
+        self.ae(self.num_queries(lambda: list(qs)), 2)
+        glen_tour, = qs
+        self.ae(glen_tour.listed_under(), self.tour)
+        self.ae(glen_tour.is_listed(), False)
+
     def test_generation(self):
         # updating the generator for an event should not cause the regenerated Occurrences to be reassigned to that event.
         # the occurrences should be updated though, since they are still attached to the generator
@@ -90,4 +116,55 @@ class TestEventTree(AppTestCase):
         self.ae(self.glen_tour.occurrences.count(), 4)
 
         [self.ae(o.start.time(), datetime.time(10,30)) for o in self.tour.occurrences.all()]
-        [self.ae(o.start.time(), datetime.time(10,30)) for o in self.glen_tour.occurrences.all()]
\ No newline at end of file
+        [self.ae(o.start.time(), datetime.time(10,30)) for o in self.glen_tour.occurrences.all()]
+
+    def test_occurrence_tree_fields(self):
+        # occurrences store their event's tree_id and lft, which follow the
+        # event as the tree changes.
+        def check():
+            for occ in ExampleOccurrence.objects.select_related('event'):
+                self.ae((occ.event_tree_id, occ.event_lft),
+                    (occ.event.tree_id, occ.event.lft))
+
+        def listing(event):
+            event = ExampleEvent.tree.get(pk=event.pk)
+            return set(event.occurrences_in_listing().values_list('pk', flat=True))
+        check()
+
+        # inserting a node shifts the lfts after it
+        talk0 = ExampleEvent.tree.create(parent=self.talks, title="Artist Talk: Ann Other")
+        ExampleEvent.tree.create(parent=talk0, title="Artist Talk: Ann Other, again")
+        check()
+
+        # moving within a tree, and to another tree
+        talk2 = ExampleEvent.tree.get(pk=self.talk2.pk)
+        talk2.move_to(ExampleEvent.tree.get(pk=self.talk1.pk))
+        check()
+        talk1 = ExampleEvent.tree.get(pk=self.talk1.pk)
+        talk1.parent = ExampleEvent.tree.get(pk=self.tour.pk)
+        talk1.save()
+        check()
+        self.ae(listing(self.talks), set())
+        self.ae(listing(self.tour), set(ExampleOccurrence.objects.filter(
+            event__in=[self.tour, self.glen_tour, self.talk1, self.talk2, self.talk2a]
+        ).values_list('pk', flat=True)))
+        self.ae(listing(self.talk2), set(ExampleOccurrence.objects.filter(
+            event__in=[self.talk2, self.talk2a]).values_list('pk', flat=True)))
+
+        # making a node a root, next to an earlier tree, shifts the later trees
+        talk0 = ExampleEvent.tree.get(pk=talk0.pk)
+        talk0_occurrence = ExampleOccurrence.objects.create(event=talk0, start=datetime.datetime(2011,9,1, 19,0), _duration=30)
+        talks_occurrence = ExampleOccurrence.objects.create(event=self.talks, start=datetime.datetime(2011,9,2, 19,0), _duration=30)
+        talk0.move_to(ExampleEvent.tree.get(pk=self.tour.pk), 'right')
+        check()
+        self.ae(listing(talk0), set([talk0_occurrence.pk]))
+        self.ae(listing(self.talks), set([talks_occurrence.pk]))
+
+        # deleting a node closes the gap
+        ExampleEvent.tree.get(pk=self.glen_tour.pk).delete()
+        check()
+
+        # rebuilding resyncs everything
+        ExampleOccurrence.objects.update(event_tree_id=None, event_lft=None)
+        ExampleEvent.eventobjects.rebuild()
+        check()
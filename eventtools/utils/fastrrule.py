@@ -0,0 +1,133 @@
+"""
+Vectorised expansion of simple repetition rules, using NumPy.
+
+Most rules are plain DAILY or WEEKLY ones, and expanding them with dateutil's
+iterator, one occurrence at a time, is slow for long series. expand() computes
+the same datetimes as dateutil with array operations, for the rules it can
+handle, and returns None for the rest, so callers can fall back to dateutil:
+
+    dates = fastrrule.expand(rule.compiled(), dtstart, until)
+    if dates is None:
+        dates = rule.get_rrule(dtstart)
+
+NumPy is optional. Without it, expand() always returns None.
+"""
+import calendar
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FREQUENCIES = ('DAILY', 'WEEKLY')
+SUPPORTED_PARAMS = set([
+    'interval', 'count', 'wkst', 'bymonth', 'bymonthday', 'byweekday',
+    'byhour', 'byminute', 'bysecond',
+])
+
+def _as_tuple(v):
+    if v is None:
+        return ()
+    if isinstance(v, (list, tuple)):
+        return tuple(v)
+    return (v,)
+
+def can_expand(compiled_rule):
+    """
+    True if expand() can handle the given CompiledRule.
+    """
+    if np is None or compiled_rule.segments is not None:
+        return False
+    if compiled_rule.frequency not in FREQUENCIES:
+        return False
+    params = compiled_rule.params
+    if set(params) - SUPPORTED_PARAMS:
+        return False
+    # Only plain weekday numbers (not e.g. 'the 2nd Monday') and positive
+    # days of the month.
+    for k in ('bymonth', 'bymonthday', 'byweekday', 'byhour', 'byminute', 'bysecond'):
+        if not all(isinstance(v, int) for v in _as_tuple(params.get(k))):
+            return False
+    if any(v <= 0 for v in _as_tuple(params.get('bymonthday'))):
+        return False
+    return True
+
+def expand_datetime64(compiled_rule, dtstart, until):
+    """
+    Returns a numpy datetime64[s] array of the (naive, wall clock) datetimes
+    that the rule generates from dtstart up to and including until, or None if
+    the rule isn't supported.
+    """
+    if not can_expand(compiled_rule):
+        return None
+    params = compiled_rule.params
+    dtstart = dtstart.replace(microsecond=0, tzinfo=None)
+    until = until.replace(tzinfo=None)
+    if until < dtstart:
+        return np.array([], dtype='datetime64[s]')
+
+    interval = params.get('interval', 1)
+    wkst = params.get('wkst', calendar.firstweekday())
+    bymonth = _as_tuple(params.get('bymonth'))
+    bymonthday = _as_tuple(params.get('bymonthday'))
+    byweekday = _as_tuple(params.get('byweekday'))
+    # dateutil's defaults
+    if compiled_rule.frequency == 'WEEKLY' and not (bymonthday or byweekday):
+        byweekday = (dtstart.weekday(),)
+    byhour = _as_tuple(params.get('byhour')) or (dtstart.hour,)
+    byminute = _as_tuple(params.get('byminute')) or (dtstart.minute,)
+    bysecond = _as_tuple(params.get('bysecond')) or (dtstart.second,)
+
+    first_day = np.datetime64(dtstart.date(), 'D')
+    days = np.arange(first_day, np.datetime64(until.date(), 'D') + 1)
+    day_numbers = days.astype('int64')
+    # 1970-01-01 was a Thursday
+    weekdays = (day_numbers + 3) % 7
+
+    if compiled_rule.frequency == 'DAILY':
+        mask = (day_numbers - day_numbers[0]) % interval == 0
+    else:
+        week_starts = day_numbers - (weekdays - wkst) % 7
+        mask = (week_starts - week_starts[0]) // 7 % interval == 0
+    if byweekday:
+        mask &= np.in1d(weekdays, byweekday)
+    if bymonth:
+        months = days.astype('datetime64[M]')
+        mask &= np.in1d(months.astype('int64') % 12 + 1, bymonth)
+    if bymonthday:
+        monthdays = (days - days.astype('datetime64[M]')).astype('int64') + 1
+        mask &= np.in1d(monthdays, bymonthday)
+    days = days[mask]
+
+    times = np.array(sorted(set(
+        h * 3600 + m * 60 + s
+        for h in byhour for m in byminute for s in bysecond
+    )), dtype='timedelta64[s]')
+    result = (days.astype('datetime64[s]')[:, np.newaxis] + times).ravel()
+    result = result[
+        (result >= np.datetime64(dtstart, 's')) &
+        (result <= np.datetime64(until, 's'))
+    ]
+
+    count = params.get('count')
+    if count:
+        result = result[:count]
+    return result
+
+def expand(compiled_rule, dtstart, until):
+    """
+    Returns a list of the datetimes that the rule generates from dtstart up to
+    and including until, or None if the rule isn't supported.
+
+    Like dateutil, the datetimes have the same tzinfo as dtstart, and the same
+    wall clock times, even across daylight saving transitions.
+    """
+    result = expand_datetime64(compiled_rule, dtstart, until)
+    if result is None:
+        return None
+    dates = result.astype(datetime).tolist()
+    if dtstart.tzinfo is not None:
+        tzinfo = dtstart.tzinfo
+        dates = [d.replace(tzinfo=tzinfo) for d in dates]
+    return dates
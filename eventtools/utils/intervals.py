@@ -0,0 +1,260 @@
+"""
+An in-memory index of occurrences' timespans, for answering many "what is on
+between these times?" questions (e.g. signage, or checking a venue's
+schedule for clashes) without a query each:
+
+    index = OccurrenceIntervalIndex.from_queryset(
+        Occurrence.objects.on_day_overlapping(day))
+    for start, end in slots:
+        pks = index.overlapping(start, end)
+
+The index stores the occurrences' pks, sorted by start, with their starts and
+ends as microsecond timestamps in arrays, and an implicit interval tree over
+them: each position is the root of the subtree of the positions either side
+of it (as in a binary search), and stores the latest end in its subtree, so
+overlap queries can skip subtrees that end too early. Overlap and stabbing
+queries take O(log n + k) time for k results, and nearest-next queries
+O(log n).
+
+Inserted occurrences are kept in a small sorted list (which queries scan),
+and removed ones are remembered, until there are enough of them (sqrt(n)) to
+make it worth rebuilding the arrays.
+
+Like XTimespanQSFN.overlapping(), timespans are treated as closed intervals:
+an occurrence that ends at 10am overlaps one that starts at 10am.
+
+sweep_overlaps() finds all the pairs of timespans that overlap in a stream of
+them sorted by start (see OccurrenceQSFN.find_overlaps()).
+"""
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from heapq import heappop, heappush, merge
+from math import sqrt
+
+from django.conf import settings
+from django.utils.timezone import get_default_timezone, is_naive, make_aware, \
+    utc
+
+from eventtools.utils import datetimeify
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _timestamp(d, clamp="min"):
+    """
+    Returns the date/datetime as a number of microseconds, comparable with
+    those of other (UTC or naive) datetimes.
+    """
+    d = datetimeify(d, clamp=clamp)
+    if settings.USE_TZ and is_naive(d):
+        d = make_aware(d, get_default_timezone())
+    if not is_naive(d):
+        d = d.astimezone(utc).replace(tzinfo=None)
+    delta = d - _EPOCH
+    # (a float, but a whole number of microseconds, and so exact)
+    return float((delta.days * 86400 + delta.seconds) * 1000000 +
+        delta.microseconds)
+
+
+def sweep_overlaps(spans):
+    """
+    Yields the pairs of spans that overlap, given an iterable of spans
+    (tuples whose first two items are a start and an end) sorted by start.
+    Each pair is (earlier span, later span), in order of the later span's
+    start.
+
+    Unlike the rest of this module, spans that only touch (one ends when the
+    other starts) don't overlap, since back-to-back sessions don't clash.
+
+    This is a sweep line: spans that are still going are kept in a heap by
+    end, so it takes O(n log n + k) time for k pairs, and memory for the
+    spans that are going at once.
+    """
+    active = [] # (end, seq, span)
+    for seq, span in enumerate(spans):
+        start = span[0]
+        while active and active[0][0] <= start:
+            heappop(active)
+        for end, i, other in active:
+            # (a span without duration doesn't overlap one starting with it)
+            if other[0] < span[1]:
+                yield other, span
+        heappush(active, (span[1], seq, span))
+
+
+class OccurrenceIntervalIndex(object):
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """
+        Builds the index from the occurrences (or other timespans) in the
+        queryset, in one query.
+        """
+        spans = []
+        for pk, start, duration in queryset.order_by('start') \
+            .values_list('pk', 'start', '_duration'):
+            start = _timestamp(start)
+            spans.append((start, start + (duration or 0) * 60000000.0, pk))
+        return cls(spans, _timestamps=True)
+
+    def __init__(self, spans=(), _timestamps=False):
+        """
+        `spans` is an iterable of (start, end, pk) for the occurrences.
+        """
+        if not _timestamps:
+            spans = [(_timestamp(s), _timestamp(e), pk) for s, e, pk in spans]
+        self._build(sorted(spans))
+
+    def _build(self, spans):
+        self._starts = array('d', [s for s, e, pk in spans])
+        self._ends = array('d', [e for s, e, pk in spans])
+        self._pks = [pk for s, e, pk in spans]
+        self._inserted = [] # sorted (start, end, pk)
+        self._removed = set() # pks
+        # the latest end in the subtree rooted at each position
+        self._max_ends = array('d', self._ends)
+        self._augment(0, len(spans))
+
+    def _augment(self, lo, hi):
+        # (iteratively, in post-order)
+        max_ends = self._max_ends
+        stack = [(lo, hi, False)]
+        while stack:
+            lo, hi, children_done = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if not children_done:
+                stack.append((lo, hi, True))
+                stack.append((lo, mid, False))
+                stack.append((mid + 1, hi, False))
+                continue
+            if lo < mid:
+                max_ends[mid] = max(max_ends[mid], max_ends[(lo + mid) // 2])
+            if mid + 1 < hi:
+                max_ends[mid] = max(max_ends[mid],
+                    max_ends[(mid + 1 + hi) // 2])
+
+    def _rebuild(self):
+        spans = [
+            (self._starts[i], self._ends[i], self._pks[i])
+            for i in xrange(len(self._pks))
+            if self._pks[i] not in self._removed
+        ]
+        self._build(list(merge(spans, self._inserted)))
+
+    def _changed(self):
+        # Rebuilding is O(n), and queries scan the inserted occurrences, so
+        # rebuild every sqrt(n) changes.
+        if len(self._inserted) + len(self._removed) > \
+            max(64, int(sqrt(len(self._pks)))):
+            self._rebuild()
+
+    def __len__(self):
+        return len(self._pks) - len(self._removed) + len(self._inserted)
+
+    def insert(self, pk, start, end):
+        """
+        Adds an occurrence to the index.
+        """
+        insort(self._inserted, (_timestamp(start), _timestamp(end), pk))
+        self._changed()
+
+    def remove(self, pk, start):
+        """
+        Removes the occurrence with the given pk and start from the index.
+        Raises KeyError if it isn't there.
+        """
+        start = _timestamp(start)
+        for i, span in enumerate(self._inserted):
+            if span[0] == start and span[2] == pk:
+                del self._inserted[i]
+                return
+        i = bisect_left(self._starts, start)
+        while i < len(self._pks) and self._starts[i] == start:
+            if self._pks[i] == pk and pk not in self._removed:
+                self._removed.add(pk)
+                self._changed()
+                return
+            i += 1
+        raise KeyError(pk)
+
+    def overlapping(self, d1, d2):
+        """
+        Returns the pks of the occurrences that are on at any time between
+        d1 and d2 (dates or datetimes, which are clamped as by
+        XTimespanQSFN.overlapping()), in start order.
+        """
+        return self._overlapping(_timestamp(d1, clamp="min"),
+            _timestamp(d2, clamp="max"))
+
+    def _overlapping(self, lo, hi):
+        starts, ends, max_ends = self._starts, self._ends, self._max_ends
+        found = []
+        # Only the occurrences before position `last` start by hi.
+        last = bisect_right(starts, hi)
+        stack = [(0, len(starts))]
+        while stack:
+            l, r = stack.pop()
+            if l >= min(r, last):
+                continue
+            if r - l < 8:
+                # small subtrees aren't worth descending into
+                found.extend(i for i in xrange(l, min(r, last)) if ends[i] >= lo)
+                continue
+            mid = (l + r) // 2
+            if max_ends[mid] < lo:
+                continue
+            if mid < last and ends[mid] >= lo:
+                found.append(mid)
+            stack.append((mid + 1, r))
+            stack.append((l, mid))
+        found.sort()
+        pks = [self._pks[i] for i in found]
+        if self._removed:
+            pks = [pk for pk in pks if pk not in self._removed]
+        if self._inserted:
+            pks = self._merge_inserted(pks, found, [
+                span for span in self._inserted
+                if span[0] <= hi and span[1] >= lo
+            ])
+        return pks
+
+    def _merge_inserted(self, pks, found, inserted):
+        if not inserted:
+            return pks
+        spans = [
+            (self._starts[i], self._pks[i]) for i in found
+            if self._pks[i] not in self._removed
+        ]
+        return [pk for start, pk in merge(spans,
+            [(start, pk) for start, end, pk in inserted])]
+
+    def at(self, moment):
+        """
+        Returns the pks of the occurrences that are on at the given moment.
+        """
+        t = _timestamp(moment)
+        return self._overlapping(t, t)
+
+    def next_after(self, moment, count=1):
+        """
+        Returns the pks of the (up to) `count` occurrences that start soonest
+        after the given moment, in start order.
+        """
+        t = _timestamp(moment)
+        pks = []
+        i = bisect_right(self._starts, t)
+        j = bisect_right(self._inserted, (t, float('inf')))
+        while len(pks) < count:
+            if i < len(self._pks) and (j == len(self._inserted) or
+                self._starts[i] <= self._inserted[j][0]):
+                if self._pks[i] not in self._removed:
+                    pks.append(self._pks[i])
+                i += 1
+            elif j < len(self._inserted):
+                pks.append(self._inserted[j][2])
+                j += 1
+            else:
+                break
+        return pks
@@ -0,0 +1,11 @@
+from django.db.models import get_models
+
+def concrete_subclasses(AbstractModel):
+    """
+    Returns the installed, concrete models that subclass the given (abstract)
+    eventtools model, e.g. concrete_subclasses(GeneratorModel).
+    """
+    return [
+        m for m in get_models()
+        if issubclass(m, AbstractModel) and not m._meta.abstract
+    ]
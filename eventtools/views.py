@@ -55,7 +55,8 @@ class EventViews(object):
         )
                     
     def event(self, request, event_slug):
-        event = get_object_or_404(self.event_qs, slug=event_slug)
+        event = get_object_or_404(self.event_qs.annotate_listed_under(),
+            slug=event_slug)
         context = RequestContext(request)
         context['event'] = event
 